@@ -0,0 +1,1210 @@
+"""
+End-to-end benchmarks for PermitDiscoveryEngine and AutoFillEngine
+
+Runs the engines against deterministic local fakes of the LLM, geocoder,
+database, vector store and municipal websites. Each fake injects
+configurable latency and failures, and counts the work it is asked to do.
+
+Usage:
+    python docs/permit_engine_benchmark.py
+    python docs/permit_engine_benchmark.py --iterations 50 --output bench.json
+    python docs/permit_engine_benchmark.py --scenarios discovery_warm,autofill_large
+    python docs/permit_engine_benchmark.py --trace
+
+Results (p50/p95/p99 latency, throughput, LLM calls and tokens, database
+round trips, geocoder calls, errors) are written as JSON. With --trace
+the engines run under a Tracer and each scenario also reports per-span
+latencies, which shows where the time goes.
+
+Each scenario reports the exception types its operations raised, with a
+sample message for each. The exit status is 1 if any scenario had errors.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import random
+import re
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from permit_engine_pseudocode import (
+    AutoFillEngine,
+    CachedLLMClient,
+    ClassificationIndex,
+    FormExtractionError,
+    FormExtractor,
+    HashingEmbedder,
+    LLMHTTPError,
+    PermitDiscoveryEngine,
+    ResilientLLMClient,
+    SCRAPED_CONTENT_TTL,
+    Tracer,
+    estimate_tokens,
+    form_content,
+    np,
+    shapely
+)
+
+
+# ============================================
+# FAKE SERVICE CONFIGURATION
+# ============================================
+
+# Mean latencies in milliseconds, before --time-scale is applied
+DEFAULT_LATENCIES = {
+    'llm_base': 800,
+    'llm_per_output_token': 15,
+    'geocode': 150,
+    'db': 4,
+    'vector_search': 60,
+    'scrape': 900,
+    'extract': 300
+}
+
+CITIES = [
+    # name, county, state, lng, lat
+    ('Austin', 'Travis', 'TX', -97.74, 30.27),
+    ('Dallas', 'Dallas', 'TX', -96.80, 32.78),
+    ('Denver', 'Denver', 'CO', -104.99, 39.74),
+    ('Portland', 'Multnomah', 'OR', -122.68, 45.52),
+    ('Raleigh', 'Wake', 'NC', -78.64, 35.78)
+]
+
+PROJECT_TEMPLATES = [
+    ('I want to build a {w}x{l} foot deck attached to the back of my house, 2 feet off the ground',
+     'deck_construction', {'materials': 'pressure-treated wood', 'attached': True, 'height': 2}),
+    ('Install a 6 foot cedar privacy fence along {l} feet of the back property line',
+     'fence', {'materials': 'cedar', 'height': 6}),
+    ('Replace the 50 gallon gas water heater in the garage',
+     'water_heater', {'fuel': 'gas', 'capacity_gallons': 50}),
+    ('Add {w} rooftop solar panels with a battery backup',
+     'solar', {'panels': 20, 'battery': True}),
+    ('Remodel the kitchen, moving the sink and adding two circuits, about {l}0 sq ft',
+     'remodel', {'rooms': ['kitchen']})
+]
+
+# Document type of each permit type's form in binary-form scenarios; the
+# rest are scanned paper forms
+BINARY_FORM_TYPES = {'building': 'pdf', 'electrical': 'pdf'}
+
+# Form fields: name, type, data source, transformation
+FORM_FIELD_CATALOGUE = [
+    ('applicant_name', 'text', 'user.name', None),
+    ('applicant_email', 'email', 'user.email', None),
+    ('applicant_phone', 'phone', 'user.phone', 'format phone'),
+    ('property_address', 'address', 'user.property.address', 'title case'),
+    ('property_city', 'text', 'user.property.city', 'uppercase'),
+    ('property_state', 'state', 'user.property.state', 'abbreviate state'),
+    ('property_zip', 'zip', 'user.property.zip', None),
+    ('parcel_id', 'parcel_id', 'user.property.parcel_id', None),
+    ('project_description', 'textarea', 'project.description', None),
+    ('construction_materials', 'text', 'project.details.materials',
+     'describe the materials in plain terms for an inspector'),
+    ('structure_height', 'number', 'project.details.height', None),
+    ('contractor_license', 'text', None, None)
+]
+
+WORK_TYPE_KEYWORDS = [
+    ('deck', ['structural']),
+    ('fence', ['structural']),
+    ('water heater', ['plumbing', 'mechanical']),
+    ('solar', ['electrical', 'structural']),
+    ('remodel', ['electrical', 'plumbing', 'structural'])
+]
+
+SAMPLE_USER = {
+    'name': 'John Smith',
+    'email': 'john@example.com',
+    'phone': '512-555-1234',
+    'property': {
+        'address': '123 main st',
+        'city': 'Austin',
+        'state': 'Texas',
+        'zip': '78701',
+        'parcel_id': 'ABC123'
+    }
+}
+
+
+class FaultInjector:
+    """
+    Seeded latency and failure source shared by all fakes
+    """
+    
+    def __init__(self, seed=0, time_scale=0.01, latencies=None,
+                 llm_failure_rate=0.0, geocode_failure_rate=0.0):
+        self.random = random.Random(seed)
+        self.time_scale = time_scale
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.llm_failure_rate = llm_failure_rate
+        self.geocode_failure_rate = geocode_failure_rate
+    
+    async def wait(self, name, extra_ms=0):
+        # Log-normal jitter around the mean keeps a realistic tail
+        mean_ms = self.latencies[name] + extra_ms
+        sample_ms = mean_ms * self.random.lognormvariate(0, 0.35)
+        await asyncio.sleep(sample_ms * self.time_scale / 1000)
+    
+    def fails(self, rate):
+        return rate > 0 and self.random.random() < rate
+
+
+class Counters:
+    """
+    Work counters reported per scenario
+    """
+    
+    FIELDS = [
+        'llm_calls', 'llm_prompt_tokens', 'llm_completion_tokens', 'llm_failures',
+        'db_round_trips', 'geocoder_calls', 'vector_searches', 'scrapes',
+        'extraction_fallbacks'
+    ]
+    
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+    
+    def snapshot(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+# ============================================
+# FAKE SERVICES
+# ============================================
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the LLM transport
+    
+    Recognizes each engine prompt by its wording and answers with
+    plausible JSON. Latency grows with the size of the answer.
+    """
+    
+    model = 'fake-llm'
+    
+    def __init__(self, faults, counters):
+        self.faults = faults
+        self.counters = counters
+    
+    async def generate(self, prompt, response_format=None, model=None, **kwargs):
+        self.counters.llm_calls += 1
+        self.counters.llm_prompt_tokens += estimate_tokens(prompt)
+        
+        if self.faults.fails(self.faults.llm_failure_rate):
+            self.counters.llm_failures += 1
+            await self.faults.wait('llm_base')
+            raise LLMHTTPError(529, 'overloaded')
+        
+        response = self.respond(prompt)
+        completion_tokens = estimate_tokens(response)
+        self.counters.llm_completion_tokens += completion_tokens
+        
+        await self.faults.wait(
+            'llm_base',
+            completion_tokens * self.faults.latencies['llm_per_output_token']
+        )
+        return response
+    
+    def respond(self, prompt):
+        if 'Your previous response was cut off' in prompt:
+            return ''
+        
+        if 'Analyze each of these construction' in prompt:
+            projects = re.findall(r'\[(\d+)\] Description: (.*?) \|', prompt)
+            return json.dumps({i: classify(description) for i, description in projects})
+        
+        if 'Analyze this construction/renovation project' in prompt:
+            description = re.search(r'Description: (.*)', prompt)[1]
+            return json.dumps(classify(description))
+        
+        if 'Determine ALL required permits' in prompt:
+            return json.dumps([
+                {
+                    'permit_type': 'zoning',
+                    'permit_name': 'Zoning Compliance Review',
+                    'required': False,
+                    'reasoning': 'Setbacks may apply',
+                    'triggers': ['exterior work'],
+                    'exemptions': []
+                }
+            ])
+        
+        if 'Analyze these form fields' in prompt:
+            names = re.findall(r'"field_name":\s*"([^"]+)"', prompt)
+            return json.dumps([field_metadata(name) for name in names])
+        
+        if 'Create mappings between form fields' in prompt:
+            names = re.findall(r'"field_name":\s*"([^"]+)"', prompt)
+            mappings = {}
+            for name in names:
+                _, _, source, transformation = catalogue_entry(name)
+                if source:
+                    mappings[name] = {
+                        'source': source,
+                        'transformation': transformation,
+                        'confidence': 0.9
+                    }
+            return json.dumps(mappings)
+        
+        if 'Process each of these form field values' in prompt:
+            names = re.findall(r'"field_name":\s*"([^"]+)"', prompt)
+            return json.dumps({name: 'Pressure-treated lumber' for name in names})
+        
+        if 'Transform this value' in prompt:
+            return 'Pressure-treated lumber'
+        
+        if 'Review this filled permit form' in prompt:
+            return json.dumps({'valid': True, 'errors': [], 'warnings': []})
+        
+        return '{}'
+
+
+class FakeGeocoder:
+    """
+    Geocoder that places each address in one of CITIES
+    """
+    
+    def __init__(self, faults, counters):
+        self.faults = faults
+        self.counters = counters
+    
+    async def geocode(self, address):
+        self.counters.geocoder_calls += 1
+        await self.faults.wait('geocode')
+        
+        if self.faults.fails(self.faults.geocode_failure_rate):
+            raise ConnectionError('geocoder unavailable')
+        
+        city, county, state, lng, lat = city_for(address)
+        return SimpleNamespace(
+            success=True,
+            formatted_address=address,
+            coordinates=SimpleNamespace(lng=lng, lat=lat),
+            city=city,
+            county=county,
+            state=state,
+            postal_code='00000'
+        )
+
+
+class FakeDatabase:
+    """
+    In-memory database that answers the engines' queries by table
+    """
+    
+    def __init__(self, faults, counters):
+        self.faults = faults
+        self.counters = counters
+        self.form_templates = {}  # (jurisdiction id, permit type) -> row
+        self.field_mappings = {}  # (template hash, shape signature) -> {field: row}
+        self.rules = {jurisdiction_id(c[0]): sample_rules(c[0]) for c in CITIES}
+        self.permits = {}  # jurisdiction id -> stored permit rows
+        self.projects = {}  # project id -> projects row joined with its address
+        self.stages = {}  # project id -> {stage: discovery_stages row}
+    
+    async def query(self, sql, *args):
+        self.counters.db_round_trips += 1
+        await self.faults.wait('db')
+        
+        if 'FROM jurisdictions' in sql and 'ST_AsGeoJSON' in sql:
+            return [jurisdiction_row(city, with_boundary=True) for city in CITIES]
+        
+        if 'FROM jurisdictions' in sql:
+            lng, lat = args
+            city = min(CITIES, key=lambda c: (c[3] - lng) ** 2 + (c[4] - lat) ** 2)
+            return jurisdiction_row(city)
+        
+        if 'JOIN permits p' in sql:
+            return list(self.permits.get(args[0], []))
+        
+        if 'FROM discovery_stages' in sql and 'JOIN projects' in sql:
+            return [
+                {**self.projects[project_id], 'address': stages['jurisdiction']['inputs']}
+                for project_id, stages in self.stages.items()
+                if stages['jurisdiction']['output']['permit_authority']['id'] == args[0]
+            ]
+        
+        if 'FROM discovery_stages' in sql:
+            # Round-trip through JSON, as a JSONB column would
+            return json.loads(json.dumps(list(self.stages.get(args[0], {}).values())))
+        
+        if 'FROM permit_requirements' in sql and 'scraped_at >' in sql:
+            return []  # sample rules are all curated
+        
+        if 'FROM permit_requirements' in sql:
+            return list(self.rules.get(args[0], []))
+        
+        if 'FROM form_templates' in sql:
+            jurisdiction, permit_types = args
+            now = time.time()
+            return [
+                {**row, 'age_seconds': now - row['stored_at']}
+                for row in (
+                    self.form_templates.get((jurisdiction, permit_type))
+                    for permit_type in permit_types
+                )
+                if row
+            ]
+        
+        if 'FROM form_field_mappings' in sql:
+            rows = self.field_mappings.get(tuple(args), {})
+            return list(rows.values())
+        
+        return []
+    
+    def change_rules(self, jurisdiction):
+        """Publish new electrical fees for a jurisdiction"""
+        for rule in self.rules[jurisdiction]:
+            rule['updated_at'] = '2024-07-01'
+            if rule['permit_type'] == 'electrical':
+                rule['base_fee'] = 95
+    
+    def age_templates(self, seconds):
+        for row in self.form_templates.values():
+            row['stored_at'] -= seconds
+    
+    async def execute(self, sql, *args):
+        self.counters.db_round_trips += 1
+        await self.faults.wait('db')
+        
+        if 'INSERT INTO form_templates' in sql:
+            jurisdiction, rows = args
+            for row in json.loads(rows):
+                # Stored and returned under the table's column names
+                self.form_templates[(jurisdiction, row['permit_type'])] = {
+                    **row,
+                    'jurisdiction_id': jurisdiction,
+                    'stored_at': time.time()
+                }
+        
+        elif 'INSERT INTO discovery_stages' in sql:
+            project_id, rows = args
+            stages = self.stages.setdefault(project_id, {})
+            for row in json.loads(rows):
+                stages[row['stage']] = row
+        
+        elif 'INSERT INTO form_field_mappings' in sql:
+            template_hash, shape_signature, rows = args
+            stored = self.field_mappings.setdefault((template_hash, shape_signature), {})
+            for row in json.loads(rows):
+                stored[row['field_name']] = row
+
+
+class FakeFormExtractor(FormExtractor):
+    """
+    FormExtractor that reads the field list the fake scraper serialized
+    as the form's content, wherever the content is kept
+    
+    With backends=False it behaves as if pypdf and pytesseract were not
+    installed.
+    """
+    
+    def __init__(self, faults, backends=True):
+        super().__init__()
+        self.faults = faults
+        self.backends = backends
+    
+    async def extract_form(self, form):
+        if not self.backends:
+            raise FormExtractionError(f"no extraction backend for {form['type']} forms")
+        
+        await self.faults.wait('extract')
+        return json.loads(await form_content(form))
+
+
+class FakeVectorStore:
+    """
+    Remote vector store stand-in returning canned regulatory passages
+    """
+    
+    def __init__(self, faults, counters):
+        self.faults = faults
+        self.counters = counters
+    
+    async def search(self, query, top_k=10):
+        self.counters.vector_searches += 1
+        await self.faults.wait('vector_search')
+        return [
+            {'text': f"{query} - section {i}", 'score': 1 - i / top_k}
+            for i in range(top_k)
+        ]
+
+
+# ============================================
+# BENCHMARK ENGINES
+# ============================================
+
+class BenchmarkDiscoveryEngine(PermitDiscoveryEngine):
+    """
+    Discovery engine with deterministic implementations of the helpers
+    the engine leaves to the data and scraping layers
+    """
+    
+    def __init__(self, llm_client, database, geocoder, vector_store, faults, counters,
+                 form_size=len(FORM_FIELD_CATALOGUE), instrumentation=None,
+                 classification_index=None, binary_forms=False, extraction_backends=True):
+        super().__init__(
+            llm_client, database, geocoder,
+            vector_store=vector_store,
+            instrumentation=instrumentation,
+            form_extractor=FakeFormExtractor(faults, backends=extraction_backends),
+            classification_index=classification_index
+        )
+        self.faults = faults
+        self.counters = counters
+        self.form_size = form_size
+        # Scrape forms as bytes, as real PDF and scanned documents are
+        self.binary_forms = binary_forms
+    
+    async def scrape_form(self, permit, jurisdiction):
+        self.counters.scrapes += 1
+        await self.faults.wait('scrape')
+        
+        form_type = 'pdf'
+        content = json.dumps(form_fields(self.form_size))
+        if self.binary_forms:
+            form_type = BINARY_FORM_TYPES.get(permit['permit_type'], 'paper')
+            content = content.encode('utf-8')
+        
+        return {
+            'permit_type': permit['permit_type'],
+            'name': f"{permit['permit_name']} Application",
+            'type': form_type,
+            'url': f"https://{jurisdiction['city'].lower()}.example.gov/{permit['permit_type']}",
+            'pdf_url': None,
+            'online_portal_url': None,
+            'content': content,
+            'version': '2024.1'
+        }
+    
+    async def scrape_jurisdiction_rules(self, jurisdiction):
+        self.counters.scrapes += 1
+        await self.faults.wait('scrape')
+        return sample_rules(jurisdiction['city'])
+    
+    async def extract_html_fields(self, content):
+        await self.faults.wait('extract')
+        return json.loads(content)
+    
+    async def extract_pdf_fields(self, content):
+        self.counters.extraction_fallbacks += 1
+        await self.faults.wait('extract')
+        return json.loads(content)
+    
+    async def extract_fields_with_vision(self, content):
+        self.counters.extraction_fallbacks += 1
+        await self.faults.wait('llm_base')
+        return json.loads(content)
+    
+    def estimate_project_value(self, classification, project_data):
+        return (classification.get('square_footage') or 100) * 150
+    
+    def merge_permit_lists(self, rule_based, llm_based):
+        merged = {permit['permit_type']: permit for permit in rule_based}
+        for permit in llm_based:
+            if permit.get('required') and permit['permit_type'] not in merged:
+                merged[permit['permit_type']] = permit
+        return list(merged.values())
+    
+    def get_form_id(self, permit, classification):
+        return f"{permit['permit_type']}-application"
+    
+    async def generate_workflow(self, required_permits, jurisdiction):
+        # Trade permits follow the building permit, and the final
+        # inspection follows everything
+        steps = [
+            {'step': i + 1, 'permit_type': permit['permit_type']}
+            for i, permit in enumerate(required_permits)
+        ]
+        building = [s['step'] for s in steps if s['permit_type'] == 'building']
+        for step in steps:
+            step['depends_on'] = [] if step['permit_type'] == 'building' else building
+        
+        steps.append({
+            'step': len(steps) + 1,
+            'name': 'final_inspection',
+            'duration_days': 2,
+            'depends_on': [s['step'] for s in steps]
+        })
+        return steps
+
+
+class BenchmarkAutoFillEngine(AutoFillEngine):
+    """
+    Auto-fill engine with a deterministic llm_fix_value
+    """
+    
+    async def llm_fix_value(self, value, field):
+        return value
+
+
+# ============================================
+# SAMPLE DATA
+# ============================================
+
+def jurisdiction_id(city):
+    return f"jur-{city.lower()}"
+
+
+def jurisdiction_row(city, with_boundary=False):
+    name, _, state, lng, lat = city
+    row = {
+        'id': jurisdiction_id(name),
+        'authority_level': 'city',
+        'authority_name': f"City of {name}, {state}",
+        'contact_info': {},
+        'website_url': f"https://{name.lower()}.example.gov"
+    }
+    
+    if with_boundary:
+        row['boundary'] = json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[
+                [lng - 0.5, lat - 0.5], [lng + 0.5, lat - 0.5],
+                [lng + 0.5, lat + 0.5], [lng - 0.5, lat + 0.5],
+                [lng - 0.5, lat - 0.5]
+            ]]
+        })
+    
+    return row
+
+
+# permit type -> (base_fee, fee_calculation_formula, processing days)
+SAMPLE_FEES = {
+    'building': (None, '$50 + $0.50 per sq ft', (10, 30)),
+    'electrical': (75, None, (3, 10)),
+    'plumbing': (75, None, (3, 10)),
+    'mechanical': (None, '$60 + $4.00 per $1,000 of valuation', (5, 15))
+}
+
+
+def sample_rules(city):
+    rules = [
+        ('building', 'Residential Building Permit', {'work_types': ['structural'], 'min_square_footage': 120}),
+        ('building', 'Residential Building Permit', {'structural_changes': True}),
+        ('electrical', 'Electrical Permit', {'work_types': ['electrical']}),
+        ('plumbing', 'Plumbing Permit', {'work_types': ['plumbing']}),
+        ('mechanical', 'Mechanical Permit', {'work_types': ['mechanical']}),
+        ('fire', 'Fire Safety Review', {'fire_safety_concerns': True})
+    ]
+    
+    return [
+        {
+            'id': f"{jurisdiction_id(city)}-rule-{i}",
+            'updated_at': '2024-01-01',
+            'permit_type': permit_type,
+            'permit_name': permit_name,
+            'description': f"{permit_name} required in {city}",
+            'triggers': list(conditions),
+            'conditions': conditions,
+            'base_fee': SAMPLE_FEES.get(permit_type, (None,))[0],
+            'fee_calculation_formula': SAMPLE_FEES.get(permit_type, (None, None))[1],
+            'processing_time_min_days': SAMPLE_FEES.get(permit_type, (0, 0, (5, 15)))[2][0],
+            'processing_time_max_days': SAMPLE_FEES.get(permit_type, (0, 0, (5, 15)))[2][1]
+        }
+        for i, (permit_type, permit_name, conditions) in enumerate(rules)
+    ]
+
+
+def sample_permits(city, count, seed=0):
+    """Stored permits of open projects in a city, for fee re-estimation"""
+    rng = random.Random(seed)
+    permit_types = [*SAMPLE_FEES, 'fire']
+    
+    return [
+        {
+            'id': f"{jurisdiction_id(city)}-permit-{i}",
+            'permit_type': permit_types[rng.randrange(len(permit_types))],
+            'square_footage': str(rng.randint(80, 3000)),
+            'estimated_value': rng.randint(1, 400) * 1000
+        }
+        for i in range(count)
+    ]
+
+
+def city_for(address):
+    for city in CITIES:
+        if city[0].lower() in address.lower():
+            return city
+    return CITIES[sum(map(ord, address)) % len(CITIES)]
+
+
+def classify(description):
+    text = description.lower()
+    work_types = next(
+        (types for keyword, types in WORK_TYPE_KEYWORDS if keyword in text),
+        ['cosmetic']
+    )
+    dimensions = re.search(r'(\d+)x(\d+)', text)
+    
+    return {
+        'project_category': 'residential',
+        'work_types': work_types,
+        'scope': 'addition' if 'build' in text or 'add' in text else 'alteration',
+        'square_footage': int(dimensions[1]) * int(dimensions[2]) if dimensions else None,
+        'stories': 1,
+        'involves_utilities': 'electrical' in work_types or 'plumbing' in work_types,
+        'involves_structural_changes': 'structural' in work_types,
+        'involves_occupancy_change': False,
+        'fire_safety_concerns': False,
+        'key_features': [],
+        'risk_level': 'low' if len(work_types) == 1 else 'medium'
+    }
+
+
+def catalogue_entry(field_name):
+    base = re.sub(r'_\d+$', '', field_name)
+    for entry in FORM_FIELD_CATALOGUE:
+        if entry[0] == base:
+            return entry
+    return (base, 'text', None, None)
+
+
+def field_metadata(field_name):
+    _, field_type, source, _ = catalogue_entry(field_name)
+    return {
+        'field_name': field_name,
+        'field_type': field_type,
+        'label': field_name.replace('_', ' ').title(),
+        'required': source is not None,
+        'validation_rules': [],
+        'help_text': '',
+        'auto_fillable': source is not None,
+        'data_source': source or ''
+    }
+
+
+def form_fields(size):
+    """Raw extracted fields for a form with `size` fields"""
+    fields = []
+    for i in range(size):
+        name, _, _, _ = FORM_FIELD_CATALOGUE[i % len(FORM_FIELD_CATALOGUE)]
+        repeat = i // len(FORM_FIELD_CATALOGUE)
+        fields.append({'field_name': f"{name}_{repeat}" if repeat else name})
+    return fields
+
+
+def form_structure(size):
+    """Parsed form structure with `size` fields"""
+    return {'fields': [field_metadata(f['field_name']) for f in form_fields(size)]}
+
+
+def sample_projects(count, seed=0):
+    rng = random.Random(seed)
+    projects = []
+    
+    for i in range(count):
+        template, project_type, details = PROJECT_TEMPLATES[i % len(PROJECT_TEMPLATES)]
+        city, _, state, _, _ = CITIES[rng.randrange(len(CITIES))]
+        projects.append({
+            'description': template.format(w=rng.randint(8, 20), l=rng.randint(10, 40)),
+            'address': f"{rng.randint(100, 9999)} Main St, {city}, {state}",
+            'project_type': project_type,
+            'details': details
+        })
+    
+    return projects
+
+
+# ============================================
+# HARNESS
+# ============================================
+
+class Environment:
+    """
+    One set of fakes plus the engines wired to them
+    """
+    
+    def __init__(self, faults, form_size, instrumentation=None, classification_index=None,
+                 binary_forms=False, extraction_backends=True):
+        self.counters = Counters()
+        self.db = FakeDatabase(faults, self.counters)
+        self.llm = CachedLLMClient(ResilientLLMClient(FakeLLM(faults, self.counters)))
+        self.discovery = BenchmarkDiscoveryEngine(
+            self.llm,
+            self.db,
+            FakeGeocoder(faults, self.counters),
+            FakeVectorStore(faults, self.counters),
+            faults,
+            self.counters,
+            form_size=form_size,
+            instrumentation=instrumentation,
+            classification_index=classification_index,
+            binary_forms=binary_forms,
+            extraction_backends=extraction_backends
+        )
+        self.autofill = BenchmarkAutoFillEngine(
+            self.llm, self.db, instrumentation=instrumentation
+        )
+    
+    async def start(self):
+        if shapely is not None:
+            await self.discovery.jurisdiction_index.load()
+
+
+class SpanStats:
+    """
+    Span exporter that keeps every finished span's duration by name
+    """
+    
+    def __init__(self):
+        self.durations = {}  # span name -> [ms]
+    
+    def on_start(self, span):
+        pass
+    
+    def on_end(self, span):
+        self.durations.setdefault(span.name, []).append(span.duration * 1000)
+    
+    def report(self):
+        return {
+            name: {
+                'count': len(samples),
+                'p50_ms': percentile(samples, 50),
+                'p95_ms': percentile(samples, 95),
+                'total_ms': sum(samples)
+            }
+            for name, samples in sorted(self.durations.items())
+        }
+
+
+class ErrorStats:
+    """
+    Exceptions raised by one scenario's operations, by type, with the
+    first message of each type as a sample
+    """
+    
+    def __init__(self):
+        self.types = {}  # exception type name -> {'count', 'sample'}
+    
+    def record(self, kind, message):
+        entry = self.types.setdefault(kind, {'count': 0, 'sample': message[:500]})
+        entry['count'] += 1
+    
+    def report(self):
+        return dict(sorted(self.types.items()))
+
+
+# ErrorStats of the scenario being run
+scenario_errors = contextvars.ContextVar('scenario_errors', default=None)
+
+
+def record_error(kind, message):
+    stats = scenario_errors.get()
+    if stats is not None:
+        stats.record(kind, message)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies_ms, elapsed, operations, errors, work):
+    return {
+        'operations': operations,
+        'errors': errors,
+        'latency_ms': {
+            'p50': percentile(latencies_ms, 50),
+            'p95': percentile(latencies_ms, 95),
+            'p99': percentile(latencies_ms, 99),
+            'mean': sum(latencies_ms) / len(latencies_ms) if latencies_ms else None
+        },
+        'throughput_per_s': operations / elapsed if elapsed else None,
+        'per_operation': {
+            name: value / operations if operations else None
+            for name, value in work.items()
+        },
+        'totals': work
+    }
+
+
+async def timed(operation):
+    """
+    Run an operation; returns (latency in ms, whether it failed)
+    
+    Exceptions, and forms a discovery result reports as failed, are
+    recorded in the scenario's ErrorStats, including those of warm-up
+    operations whose result is otherwise ignored.
+    """
+    started = time.perf_counter()
+    try:
+        result = await operation()
+        error = not result_succeeded(result)
+    except Exception as e:
+        record_error(type(e).__name__, str(e))
+        error = True
+    return (time.perf_counter() - started) * 1000, error
+
+
+def result_succeeded(result):
+    """
+    False, after recording them, if a discovery result has failed forms
+    (fetch_forms reports these per form rather than raising)
+    """
+    if not isinstance(result, dict):
+        return True
+    
+    failed = [form for form in result.get('forms') or [] if form.get('error')]
+    
+    for form in failed:
+        record_error('FormError', f"{form['permit_type']}: {form['error']}")
+    return not failed
+
+
+async def run_repeated(iterations, make_operation, environment):
+    """
+    Run an operation `iterations` times
+    
+    environment() is called before every iteration; returning a new
+    Environment each time gives cache-cold runs, returning the same one
+    gives cache-warm runs.
+    """
+    latencies = []
+    errors = 0
+    totals = dict.fromkeys(Counters.FIELDS, 0)
+    started = time.perf_counter()
+    
+    for i in range(iterations):
+        env = await environment()
+        before = env.counters.snapshot()
+        
+        latency, error = await timed(make_operation(env, i))
+        latencies.append(latency)
+        errors += error
+        
+        after = env.counters.snapshot()
+        for name in totals:
+            totals[name] += after[name] - before[name]
+    
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, iterations, errors, totals)
+
+
+async def fresh_environment(args, faults, binary_forms=False, extraction_backends=True):
+    env = Environment(
+        faults, args.form_size, args.instrumentation,
+        binary_forms=binary_forms, extraction_backends=extraction_backends
+    )
+    await env.start()
+    return env
+
+
+async def same_environment(env):
+    return env
+
+
+async def scenario_discovery(args, faults, warm, binary_forms=False, extraction_backends=True):
+    projects = sample_projects(args.iterations, args.seed)
+    
+    def make_operation(env, i):
+        return lambda: env.discovery.discover_permits(projects[i])
+    
+    if not warm:
+        return await run_repeated(
+            args.iterations, make_operation,
+            lambda: fresh_environment(args, faults, binary_forms, extraction_backends)
+        )
+    
+    env = await fresh_environment(args, faults, binary_forms, extraction_backends)
+    
+    # Warm every cache with one pass over the same projects
+    for project in projects:
+        await timed(lambda: env.discovery.discover_permits(project))
+    
+    return await run_repeated(args.iterations, make_operation, lambda: same_environment(env))
+
+
+async def scenario_discovery_batch(args, faults):
+    env = await fresh_environment(args, faults)
+    projects = sample_projects(args.batch_size, args.seed)
+    
+    latencies = []
+    errors = 0
+    before = env.counters.snapshot()
+    started = time.perf_counter()
+    
+    async for item in env.discovery.discover_permits_batch(projects):
+        latencies.append((time.perf_counter() - started) * 1000)
+        if 'error' in item:
+            record_error('BatchProjectError', item['error'])
+            errors += 1
+        elif not result_succeeded(item['result']):
+            errors += 1
+    
+    elapsed = time.perf_counter() - started
+    after = env.counters.snapshot()
+    work = {name: after[name] - before[name] for name in after}
+    summary = summarize(latencies, elapsed, len(projects), errors, work)
+    
+    # Latency here is time from batch start until each project completed
+    summary['latency_ms']['kind'] = 'time_to_result'
+    return summary
+
+
+async def scenario_discovery_stale(args, faults):
+    """
+    Warm discovery after every stored template has expired, with the
+    refresh scheduler serving stale templates and re-scraping them in the
+    background (background scrapes are included in the work counters)
+    """
+    projects = sample_projects(args.iterations, args.seed)
+    env = await fresh_environment(args, faults)
+    
+    for project in projects:
+        await timed(lambda: env.discovery.discover_permits(project))
+    env.db.age_templates(SCRAPED_CONTENT_TTL)
+    
+    def make_operation(env, i):
+        return lambda: env.discovery.discover_permits(projects[i])
+    
+    scheduler = env.discovery.refresh_scheduler
+    scheduler.start()
+    try:
+        summary = await run_repeated(
+            args.iterations, make_operation, lambda: same_environment(env)
+        )
+    finally:
+        await scheduler.stop()
+    
+    summary['refreshes'] = dict(scheduler.metrics)
+    return summary
+
+
+async def scenario_discovery_similar(args, faults):
+    """
+    Warm discovery of projects that differ only slightly from the ones
+    seen before, so exact-prompt caches miss and classifications are
+    reused from the classification index (a tenth of reuses verified)
+    """
+    if np is None:
+        return {'skipped': 'numpy is not installed'}
+    
+    index = ClassificationIndex(HashingEmbedder(), verify_rate=0.1)
+    env = Environment(faults, args.form_size, args.instrumentation, classification_index=index)
+    await env.start()
+    
+    for project in sample_projects(args.iterations, args.seed):
+        await timed(lambda: env.discovery.discover_permits(project))
+    
+    projects = sample_projects(args.iterations, args.seed + 1)
+    
+    def make_operation(env, i):
+        return lambda: env.discovery.discover_permits(projects[i])
+    
+    summary = await run_repeated(args.iterations, make_operation, lambda: same_environment(env))
+    summary['classification_index'] = index.report()
+    return summary
+
+
+async def scenario_fee_reestimate(args, faults):
+    """
+    Re-estimate every stored permit in one jurisdiction, as after it
+    publishes new fees (batch-size x 100 permits per operation)
+    """
+    env = await fresh_environment(args, faults)
+    city = CITIES[0][0]
+    env.db.permits[jurisdiction_id(city)] = sample_permits(city, args.batch_size * 100, args.seed)
+    
+    def make_operation(env, i):
+        return lambda: env.discovery.reestimate_fees(jurisdiction_id(city))
+    
+    summary = await run_repeated(args.iterations, make_operation, lambda: same_environment(env))
+    summary['permits_per_operation'] = args.batch_size * 100
+    return summary
+
+
+async def scenario_rediscovery_edit(args, faults):
+    """
+    Re-discovery of stored projects after a description edit; only the
+    stages downstream of an actually changed output are recomputed
+    """
+    projects = sample_projects(args.iterations, args.seed)
+    env = await fresh_environment(args, faults)
+    
+    for i, project in enumerate(projects):
+        await timed(lambda: env.discovery.discover_permits(project, project_id=f"project-{i}"))
+    
+    edited = [
+        {**project, 'description': project['description'] + ', permit-ready plans attached'}
+        for project in projects
+    ]
+    recomputed = Counter()
+    
+    def make_operation(env, i):
+        async def operation():
+            result = await env.discovery.discover_permits(edited[i], project_id=f"project-{i}")
+            recomputed.update(result['recomputed_stages'])
+        return operation
+    
+    summary = await run_repeated(args.iterations, make_operation, lambda: same_environment(env))
+    summary['recomputed_stages'] = dict(recomputed)
+    return summary
+
+
+async def scenario_rediscovery_rule_change(args, faults):
+    """
+    Bulk refresh of the stored projects in one jurisdiction after its
+    rules change (batch-size projects stored across all cities)
+    """
+    env = await fresh_environment(args, faults)
+    projects = sample_projects(args.batch_size, args.seed)
+    
+    for i, project in enumerate(projects):
+        project_id = f"project-{i}"
+        env.db.projects[project_id] = {'id': project_id, **project}
+        await timed(lambda: env.discovery.discover_permits(project, project_id=project_id))
+    
+    city = city_for(projects[0]['address'])[0]
+    env.db.change_rules(jurisdiction_id(city))
+    
+    before = env.counters.snapshot()
+    started = time.perf_counter()
+    refreshed = await env.discovery.refresh_affected_projects(jurisdiction_id(city))
+    elapsed = time.perf_counter() - started
+    after = env.counters.snapshot()
+    
+    summary = summarize(
+        [elapsed * 1000], elapsed, 1, refreshed['errors'],
+        {name: after[name] - before[name] for name in after}
+    )
+    summary['refreshed'] = refreshed
+    return summary
+
+
+async def scenario_autofill(args, faults, size, warm):
+    structure = form_structure(size)
+    project = sample_projects(1, args.seed)[0]
+    
+    def make_operation(env, i):
+        user = {**SAMPLE_USER, 'name': f"Applicant {i}"}
+        return lambda: env.autofill.auto_fill_form(structure, user, project)
+    
+    if not warm:
+        return await run_repeated(
+            args.iterations, make_operation,
+            lambda: fresh_environment(args, faults)
+        )
+    
+    env = await fresh_environment(args, faults)
+    await timed(lambda: env.autofill.auto_fill_form(structure, SAMPLE_USER, project))
+    return await run_repeated(args.iterations, make_operation, lambda: same_environment(env))
+
+
+SCENARIOS = {
+    'discovery_cold': lambda args, faults: scenario_discovery(args, faults, warm=False),
+    'discovery_warm': lambda args, faults: scenario_discovery(args, faults, warm=True),
+    # PDF and scanned forms scraped as bytes, stored in the form store and
+    # read back from it
+    'discovery_binary_forms': lambda args, faults: scenario_discovery(
+        args, faults, warm=True, binary_forms=True
+    ),
+    # Cold discovery of binary forms without pypdf or OCR, parsed by the
+    # PDF and vision fallbacks (counted in extraction_fallbacks)
+    'discovery_no_extraction_backends': lambda args, faults: scenario_discovery(
+        args, faults, warm=False, binary_forms=True, extraction_backends=False
+    ),
+    'discovery_batch': scenario_discovery_batch,
+    'discovery_stale': scenario_discovery_stale,
+    'discovery_similar': scenario_discovery_similar,
+    'fee_reestimate': scenario_fee_reestimate,
+    'rediscovery_edit': scenario_rediscovery_edit,
+    'rediscovery_rule_change': scenario_rediscovery_rule_change,
+    'autofill_small_cold': lambda args, faults: scenario_autofill(args, faults, 12, warm=False),
+    'autofill_small_warm': lambda args, faults: scenario_autofill(args, faults, 12, warm=True),
+    'autofill_large_cold': lambda args, faults: scenario_autofill(args, faults, 80, warm=False),
+    'autofill_large_warm': lambda args, faults: scenario_autofill(args, faults, 80, warm=True)
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated scenarios to run')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--form-size', type=int, default=len(FORM_FIELD_CATALOGUE),
+                        help='fields per scraped form in discovery scenarios')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--time-scale', type=float, default=0.01,
+                        help='multiplier applied to every fake latency')
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0)
+    parser.add_argument('--geocode-failure-rate', type=float, default=0.0)
+    parser.add_argument('--trace', action='store_true',
+                        help='report per-span latencies for each scenario')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    results = {
+        'config': {
+            'iterations': args.iterations,
+            'batch_size': args.batch_size,
+            'form_size': args.form_size,
+            'seed': args.seed,
+            'time_scale': args.time_scale,
+            'llm_failure_rate': args.llm_failure_rate,
+            'geocode_failure_rate': args.geocode_failure_rate,
+            'trace': args.trace,
+            'latencies_ms': DEFAULT_LATENCIES
+        },
+        'scenarios': {}
+    }
+    
+    for name in args.scenarios.split(','):
+        faults = FaultInjector(
+            seed=args.seed,
+            time_scale=args.time_scale,
+            llm_failure_rate=args.llm_failure_rate,
+            geocode_failure_rate=args.geocode_failure_rate
+        )
+        span_stats = SpanStats() if args.trace else None
+        args.instrumentation = Tracer([span_stats]) if span_stats else None
+        error_stats = ErrorStats()
+        scenario_errors.set(error_stats)
+        
+        results['scenarios'][name] = await SCENARIOS[name](args, faults)
+        results['scenarios'][name]['error_types'] = error_stats.report()
+        if span_stats:
+            results['scenarios'][name]['spans'] = span_stats.report()
+    
+    return results
+
+
+def failed_scenarios(results):
+    """Scenarios with errors, counting ones raised while warming up"""
+    return [
+        name for name, summary in results['scenarios'].items()
+        if summary.get('errors') or summary.get('error_types')
+    ]
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    
+    failed = failed_scenarios(results)
+    if failed:
+        for name in failed:
+            for kind, entry in results['scenarios'][name]['error_types'].items():
+                print(f"{name}: {entry['count']} x {kind}: {entry['sample']}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,166 @@
+import asyncio
+import bisect
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
+import functools
+import graphlib
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+# Optional: local embedding index, spatial jurisdiction index, pooled transport
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import shapely
+    import shapely.geometry
+except ImportError:
+    shapely = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Optional: PDF field extraction and OCR of scanned forms
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    import PIL.Image
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# Optional: OpenTelemetry span export
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+
 # ============================================
 # PERMIT DISCOVERY ENGINE
 # ============================================
 
+# Maximum forms fetched/parsed at once per discovery
+FORM_FETCH_CONCURRENCY = 4
+
+# Maximum concurrent scrapes against a single municipality's website
+SCRAPE_CONCURRENCY_PER_JURISDICTION = 1
+
+# Projects per multi-project classification prompt in batch discovery
+CLASSIFY_BATCH_SIZE = 10
+
+# Maximum projects in flight at once within one batch discovery
+BATCH_PROJECT_CONCURRENCY = 20
+
+# Shape of the classification returned by classify_project
+CLASSIFICATION_SCHEMA = """
+{
+    "project_category": "residential|commercial|industrial",
+    "work_types": ["structural", "electrical", "plumbing", "mechanical", "cosmetic"],
+    "scope": "new_construction|addition|alteration|repair",
+    "square_footage": number or null,
+    "stories": number or null,
+    "involves_utilities": bool,
+    "involves_structural_changes": bool,
+    "involves_occupancy_change": bool,
+    "fire_safety_concerns": bool,
+    "key_features": [list of important features],
+    "risk_level": "low|medium|high"
+}
+"""
+
+# Risk levels for which conclusive rule-based matches skip the LLM pass
+RULES_CONCLUSIVE_RISK_LEVELS = {'low'}
+
+# Permit type each classified work type requires when it applies
+WORK_TYPE_PERMITS = {
+    'structural': 'building',
+    'electrical': 'electrical',
+    'plumbing': 'plumbing',
+    'mechanical': 'mechanical'
+}
+
+
+def traced(name):
+    """
+    Run an engine method in a span named `name`
+    
+    The span comes from the engine's instrumentation (see
+    INSTRUMENTATION); with none configured this is a no-op.
+    """
+    def decorate(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def wrapper(self, *args, **kwargs):
+                with self.instrumentation.span(name):
+                    return await method(self, *args, **kwargs)
+        else:
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self.instrumentation.span(name):
+                    return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
 class PermitDiscoveryEngine:
     """
     Core engine for discovering required permits based on project details
     """
     
-    def __init__(self, llm_client, database, geocoder):
-        self.llm = llm_client
-        self.db = database
-        self.geocoder = geocoder
-        self.vector_store = VectorDatabase()
+    def __init__(self, llm_client, database, geocoder,
+                 form_fetch_concurrency=FORM_FETCH_CONCURRENCY, vector_store=None,
+                 instrumentation=None, cross_process_lock=None, form_extractor=None,
+                 classification_index=None):
+        # External clients are wrapped so every call gets its own span
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+        self.llm = self.instrumentation.wrap('llm', llm_client)
+        self.db = self.instrumentation.wrap('db', database)
+        self.geocoder = self.instrumentation.wrap('geocoder', geocoder)
+        self.vector_store = self.instrumentation.wrap(
+            'vector_store', vector_store or VectorDatabase()
+        )
+        self.regulatory_context = RegulatoryContextCache(self.vector_store, self.db)
+        self.form_fetch_concurrency = form_fetch_concurrency
+        self.scrape_semaphores = {}
+        self.geocode_cache = GeocodeCache()
+        self.jurisdiction_index = JurisdictionIndex(database)
+        self.rule_sets = RuleSetCache()
+        self.batch_budget = ConcurrencyBudget(BATCH_CONCURRENCY_LIMITS)
+        self.refresh_scheduler = RefreshScheduler(self)
+        # Concurrent identical scrapes, parses, geocodes and
+        # classifications share one call
+        self.single_flight = SingleFlight(cross_process_lock)
+        # PDF parsing and OCR run page by page in worker processes
+        self.form_extractor = form_extractor or FormExtractor()
+        # Optional ClassificationIndex; near-duplicate projects reuse a
+        # past classification instead of an LLM call
+        self.classification_index = classification_index
     
-    async def discover_permits(self, project_data):
+    async def discover_permits(self, project_data, profile=False, project_id=None):
         """
         Main entry point for permit discovery
         
@@ -24,141 +171,720 @@ class PermitDiscoveryEngine:
                 'project_type': str,
                 'details': dict
             }
+            profile: Sample this request with the instrumentation's profiler
+            project_id: Store this project's stage outputs, and reuse the
+                ones stored by its last discovery whose inputs are unchanged
         
         Returns:
             List of required permits with details
         """
         
+        with self.instrumentation.request(
+            'discovery.discover_permits',
+            {'project.type': project_data.get('project_type', 'unknown')},
+            profile=profile
+        ):
+            stored = await self.load_stages(project_id) if project_id else None
+            graph = self.build_discovery_graph(project_data)
+            results = await graph.run(stored=stored)
+            
+            result = self.build_discovery_result(results, project_data, graph.timings)
+            
+            if project_id:
+                await self.save_stages(project_id, graph.records)
+                result['recomputed_stages'] = [
+                    name for name, record in graph.records.items() if not record['reused']
+                ]
+            
+            return result
+    
+    async def discover_permits_stream(self, project_data, profile=False):
+        """
+        Streaming variant of discover_permits
+        
+        Yields {'event', 'data'} dicts as soon as each piece is known:
+        'jurisdiction', 'classification', one 'permit' per matched permit,
+        one 'form' per form as it is fetched, 'workflow', then 'estimates'
+        and finally 'complete' with the full discover_permits result.
+        Stage failures are raised as DiscoveryStageError.
+        """
+        queue = asyncio.Queue()
+        
+        def on_stage_complete(name, result):
+            if name in ('jurisdiction', 'classification', 'workflow'):
+                queue.put_nowait({'event': name, 'data': result})
+            elif name == 'permits':
+                for permit in result:
+                    queue.put_nowait({'event': 'permit', 'data': permit})
+        
+        graph = self.build_discovery_graph(
+            project_data,
+            on_form=lambda form: queue.put_nowait({'event': 'form', 'data': form})
+        )
+        
+        # The request span lives in the graph task rather than across the
+        # generator's yields, which may resume in another context
+        async def run_graph():
+            with self.instrumentation.request(
+                'discovery.discover_permits_stream',
+                {'project.type': project_data.get('project_type', 'unknown')},
+                profile=profile
+            ):
+                return await graph.run(on_complete=on_stage_complete)
+        
+        run = asyncio.create_task(run_graph())
+        run.add_done_callback(lambda _: queue.put_nowait(None))
+        
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            
+            result = self.build_discovery_result(run.result(), project_data, graph.timings)
+            
+            yield {
+                'event': 'estimates',
+                'data': {
+                    'estimated_timeline': result['estimated_timeline'],
+                    'estimated_cost': result['estimated_cost']
+                }
+            }
+            yield {'event': 'complete', 'data': result}
+        finally:
+            # Client went away mid-stream
+            if not run.done():
+                run.cancel()
+    
+    async def discover_permits_batch(self, projects):
+        """
+        Discover permits for many projects at once
+        
+        Each distinct address is resolved once and projects are classified
+        in bulk, then projects are grouped by jurisdiction so rules and
+        regulatory context are fetched once per group. A project moves on
+        as soon as its own jurisdiction and classification are known. All
+        external calls share the engine's batch_budget, so concurrent
+        batches can't starve interactive traffic.
+        
+        Yields {'index', 'result'} or {'index', 'error'} as each project
+        completes, in completion order. A project that fails at any step
+        yields its error; the rest of the batch carries on.
+        """
+        engine = self.with_budget(self.batch_budget, priority='batch')
+        
+        # One geocode per distinct address
+        address_lookups = {}
+        
+        def jurisdiction_for(address):
+            key = normalize_address(address)
+            if key not in address_lookups:
+                address_lookups[key] = asyncio.ensure_future(
+                    engine.resolve_jurisdiction(address)
+                )
+            return address_lookups[key]
+        
+        # Classifications arrive chunk by chunk
+        loop = asyncio.get_running_loop()
+        classified = [loop.create_future() for _ in projects]
+        
+        def on_classified(index, classification):
+            if classified[index].done():
+                return
+            if isinstance(classification, Exception):
+                classified[index].set_exception(classification)
+            else:
+                classified[index].set_result(classification)
+        
+        def on_classify_done(task):
+            # A failure outside any one project fails those still waiting
+            if task.cancelled() or task.exception() is None:
+                return
+            for index in range(len(projects)):
+                on_classified(index, task.exception())
+        
+        classifying = asyncio.ensure_future(engine.classify_projects(projects, on_classified))
+        classifying.add_done_callback(on_classify_done)
+        
+        # One rules lookup per jurisdiction group
+        group_rules = {}
+        
+        def rules_for(jurisdiction):
+            key = jurisdiction['permit_authority']['id']
+            if key not in group_rules:
+                group_rules[key] = asyncio.ensure_future(
+                    engine.get_jurisdiction_rules(jurisdiction)
+                )
+            return group_rules[key]
+        
+        semaphore = asyncio.Semaphore(BATCH_PROJECT_CONCURRENCY)
+        
+        async def discover_one(index):
+            project = projects[index]
+            
+            try:
+                jurisdiction = await jurisdiction_for(project['address'])
+                classification = await classified[index]
+            except Exception as e:
+                return {'index': index, 'error': str(e)}
+            
+            async with semaphore:
+                try:
+                    with self.instrumentation.span(
+                        'discovery.batch_project', {'batch.index': index}
+                    ):
+                        permit_rules = await rules_for(jurisdiction)
+                        required_permits = await engine.match_permits(
+                            classification,
+                            permit_rules
+                        )
+                        forms, workflow = await asyncio.gather(
+                            engine.fetch_forms(required_permits, jurisdiction),
+                            engine.generate_workflow(required_permits, jurisdiction)
+                        )
+                except Exception as e:
+                    return {'index': index, 'error': str(e)}
+            
+            results = {
+                'jurisdiction': jurisdiction,
+                'permits': required_permits,
+                'forms': forms,
+                'workflow': workflow
+            }
+            return {
+                'index': index,
+                'result': engine.build_discovery_result(results, project, {})
+            }
+        
+        tasks = [asyncio.ensure_future(discover_one(i)) for i in range(len(projects))]
+        
+        try:
+            for completed in asyncio.as_completed(tasks):
+                yield await completed
+        finally:
+            # Caller stopped consuming mid-batch
+            for task in [*tasks, classifying]:
+                if not task.done():
+                    task.cancel()
+    
+    def with_budget(self, budget, priority=None):
+        """
+        Shallow copy of this engine whose external clients draw on budget
+        
+        Caches and indexes are shared with the original engine. If priority
+        is given and the LLM client has priority lanes (see
+        ResilientLLMClient), LLM calls are tagged with that lane.
+        """
+        engine = copy.copy(self)
+        # self.llm and friends are already instrumented, so spans include
+        # the time spent waiting on the budget
+        llm = PriorityLane(self.llm, priority) if priority else self.llm
+        engine.llm = budget.wrap('llm', llm)
+        engine.geocoder = budget.wrap('geocoder', self.geocoder)
+        engine.db = budget.wrap('db', self.db)
+        return engine
+    
+    @traced('discovery.load_stages')
+    async def load_stages(self, project_id):
+        """
+        Stage records stored by a project's last discovery, by stage name
+        """
+        rows = await self.db.query(
+            "SELECT stage, input_hash, output_hash, output "
+            "FROM discovery_stages "
+            "WHERE project_id = $1",
+            project_id
+        )
+        
+        return {row['stage']: row for row in rows}
+    
+    @traced('discovery.save_stages')
+    async def save_stages(self, project_id, records):
+        """
+        Bulk upsert the stage records a discovery recomputed
+        
+        Stages that always run (reusable=False) are not stored.
+        """
+        changed = {
+            name: record for name, record in records.items()
+            if record['reusable'] and not record['reused']
+        }
+        if not changed:
+            return
+        
+        await self.db.execute(
+            "INSERT INTO discovery_stages "
+            "(project_id, stage, inputs, input_hash, output_hash, output) "
+            "SELECT $1, s.stage, s.inputs, s.input_hash, s.output_hash, s.output "
+            "FROM jsonb_to_recordset($2) AS s("
+            "  stage text, inputs jsonb, input_hash text, output_hash text, output jsonb) "
+            "ON CONFLICT (project_id, stage) DO UPDATE SET "
+            "  inputs = EXCLUDED.inputs, "
+            "  input_hash = EXCLUDED.input_hash, "
+            "  output_hash = EXCLUDED.output_hash, "
+            "  output = EXCLUDED.output, "
+            "  updated_at = NOW()",
+            project_id,
+            json.dumps([
+                {
+                    'stage': name,
+                    'inputs': record['inputs'],
+                    'input_hash': record['input_hash'],
+                    'output_hash': record['output_hash'],
+                    'output': record['output']
+                }
+                for name, record in changed.items()
+            ], default=str)
+        )
+    
+    @traced('discovery.refresh_affected_projects')
+    async def refresh_affected_projects(self, jurisdiction_id):
+        """
+        Re-discover the stored projects in a jurisdiction after its
+        permit_requirements change
+        
+        Affected projects are found from their stored jurisdiction stage,
+        and are rediscovered with the normalized address that stage was
+        computed from, so it is reused along with the classification.
+        Permits are rematched, forms are re-read from the template cache,
+        and the workflow is redone only for projects whose permits
+        changed. Runs on the batch budget.
+        
+        Returns {'projects', 'changed', 'errors'}.
+        """
+        projects = await self.db.query(
+            "SELECT p.id, p.description, p.project_type, p.details, "
+            "       s.inputs #>> '{}' AS address "
+            "FROM discovery_stages s "
+            "JOIN projects p ON p.id = s.project_id "
+            "WHERE s.stage = 'jurisdiction' "
+            "  AND s.output->'permit_authority'->>'id' = $1 "
+            "  AND p.deleted_at IS NULL",
+            jurisdiction_id
+        )
+        
+        engine = self.with_budget(self.batch_budget, priority='batch')
+        semaphore = asyncio.Semaphore(BATCH_PROJECT_CONCURRENCY)
+        
+        async def refresh(project):
+            async with semaphore:
+                result = await engine.discover_permits(
+                    {
+                        'description': project['description'],
+                        'address': project['address'],
+                        'project_type': project['project_type'],
+                        'details': project['details'] or {}
+                    },
+                    project_id=project['id']
+                )
+            # Workflow is redone only when the rematched permits differ
+            return 'workflow' in result['recomputed_stages']
+        
+        outcomes = await asyncio.gather(
+            *(refresh(project) for project in projects),
+            return_exceptions=True
+        )
+        
+        summary = {
+            'projects': len(projects),
+            'changed': sum(outcome is True for outcome in outcomes),
+            'errors': sum(isinstance(outcome, Exception) for outcome in outcomes)
+        }
+        current_span().set_attributes({
+            'jurisdiction.id': jurisdiction_id,
+            'project.count': summary['projects'],
+            'project.changed': summary['changed']
+        })
+        return summary
+    
+    def build_discovery_graph(self, project_data, on_form=None):
+        """
+        Stage graph for one discovery run
+        """
+        # Independent stages run concurrently; each stage starts as soon
+        # as the stages it depends on have finished.
+        graph = StageGraph(self.instrumentation)
+        
         # Step 1: Resolve jurisdiction
-        jurisdiction = await self.resolve_jurisdiction(project_data['address'])
+        graph.add_stage(
+            'jurisdiction',
+            lambda: self.resolve_jurisdiction(project_data['address']),
+            timeout=STAGE_TIMEOUTS['jurisdiction'],
+            inputs=normalize_address(project_data['address'])
+        )
         
         # Step 2: Classify project and extract key features
-        classification = await self.classify_project(project_data)
+        graph.add_stage(
+            'classification',
+            lambda: self.classify_project(project_data),
+            timeout=STAGE_TIMEOUTS['classification'],
+            inputs=[
+                project_data['description'],
+                project_data.get('project_type'),
+                project_data.get('details', {})
+            ]
+        )
         
-        # Step 3: Query permit rules for jurisdiction
-        permit_rules = await self.get_jurisdiction_rules(jurisdiction)
+        # Step 3: Query permit rules for jurisdiction (always read, so rule
+        # changes reach incremental runs; matching reruns only when the
+        # rules' fingerprint changed)
+        graph.add_stage(
+            'permit_rules',
+            lambda r: self.get_jurisdiction_rules(r['jurisdiction']),
+            depends_on=['jurisdiction'],
+            timeout=STAGE_TIMEOUTS['permit_rules'],
+            reusable=False,
+            fingerprint=permit_rules_fingerprint
+        )
         
         # Step 4: Match project to required permits
-        required_permits = await self.match_permits(classification, permit_rules)
+        graph.add_stage(
+            'permits',
+            lambda r: self.match_permits(r['classification'], r['permit_rules']),
+            depends_on=['classification', 'permit_rules'],
+            timeout=STAGE_TIMEOUTS['permits']
+        )
         
-        # Step 5: Fetch current forms
-        permit_forms = await self.fetch_forms(required_permits, jurisdiction)
+        # Step 5: Fetch current forms (always read, as stored templates
+        # are refreshed independently of the project)
+        graph.add_stage(
+            'forms',
+            lambda r: self.fetch_forms(r['permits'], r['jurisdiction'], on_form),
+            depends_on=['permits', 'jurisdiction'],
+            timeout=STAGE_TIMEOUTS['forms'],
+            reusable=False
+        )
         
         # Step 6: Generate workflow
-        workflow = await self.generate_workflow(required_permits, jurisdiction)
+        graph.add_stage(
+            'workflow',
+            lambda r: self.generate_workflow(r['permits'], r['jurisdiction']),
+            depends_on=['permits', 'jurisdiction'],
+            timeout=STAGE_TIMEOUTS['workflow']
+        )
+        
+        return graph
+    
+    def build_discovery_result(self, results, project_data, timings):
+        """
+        Assemble the discover_permits response from stage results
+        """
+        required_permits = results['permits']
         
         return {
-            'jurisdiction': jurisdiction,
+            'jurisdiction': results['jurisdiction'],
             'permits': required_permits,
-            'forms': permit_forms,
-            'workflow': workflow,
-            'estimated_timeline': self.calculate_timeline(required_permits),
-            'estimated_cost': self.calculate_costs(required_permits, project_data)
+            'forms': results['forms'],
+            'workflow': results['workflow'],
+            'estimated_timeline': self.calculate_timeline(results['workflow'], required_permits),
+            'estimated_cost': self.calculate_costs(required_permits, project_data),
+            'stage_timings': timings
         }
     
+    @traced('discovery.resolve_jurisdiction')
     async def resolve_jurisdiction(self, address):
         """
         Determine governing jurisdiction from address
         """
-        # Geocode address
-        geocode_result = await self.geocoder.geocode(address)
+        # Geocode address (memoized by normalized address)
+        geocode_result = await self.geocode(address)
+        
+        jurisdiction = await self.build_jurisdiction(geocode_result)
+        
+        current_span().set_attributes({
+            'jurisdiction.id': jurisdiction['permit_authority']['id'],
+            'jurisdiction.name': jurisdiction['permit_authority']['authority_name']
+        })
+        return jurisdiction
+    
+    @traced('discovery.resolve_jurisdictions')
+    async def resolve_jurisdictions(self, addresses):
+        """
+        Resolve several addresses at once
+        
+        Duplicate addresses are geocoded once and all lookups run
+        concurrently. Returns jurisdictions in the order of addresses; an
+        address that cannot be resolved yields its exception instead.
+        """
+        unique = {normalize_address(a): a for a in addresses}
+        
+        resolved = await asyncio.gather(
+            *(self.resolve_jurisdiction(a) for a in unique.values()),
+            return_exceptions=True
+        )
+        by_address = dict(zip(unique.keys(), resolved))
+        
+        return [by_address[normalize_address(a)] for a in addresses]
+    
+    @traced('discovery.geocode')
+    async def geocode(self, address):
+        cached = self.geocode_cache.get(address)
+        current_span().set_attribute('cache.hit', bool(cached))
+        if cached:
+            return cached
+        
+        geocode_result = await self.single_flight.do(
+            ('geocode', normalize_address(address)),
+            lambda: self.geocoder.geocode(address)
+        )
         
         if not geocode_result.success:
             raise AddressValidationError("Cannot validate address")
         
+        self.geocode_cache.set(address, geocode_result)
+        return geocode_result
+    
+    @traced('discovery.build_jurisdiction')
+    async def build_jurisdiction(self, geocode_result):
         # Extract jurisdiction hierarchy
         jurisdiction = {
             'address': geocode_result.formatted_address,
-            'coordinates': geocode_result.coordinates,
+            'coordinates': {
+                'lat': geocode_result.coordinates.lat,
+                'lng': geocode_result.coordinates.lng
+            },
             'city': geocode_result.city,
             'county': geocode_result.county,
             'state': geocode_result.state,
             'zip': geocode_result.postal_code
         }
         
-        # Check which level handles permits (city vs county)
-        permit_authority = await self.db.query(
-            "SELECT authority_level, authority_name, contact_info "
-            "FROM jurisdictions "
-            "WHERE ST_Contains(boundary, ST_Point($1, $2))",
-            geocode_result.coordinates.lng,
-            geocode_result.coordinates.lat
-        )
+        # Check which level handles permits (city vs county), in memory
+        # when the boundary index is loaded
+        permit_authority = None
+        if self.jurisdiction_index.loaded:
+            permit_authority = self.jurisdiction_index.lookup(
+                geocode_result.coordinates.lng,
+                geocode_result.coordinates.lat
+            )
+        
+        current_span().set_attribute('jurisdiction.index_hit', permit_authority is not None)
+        
+        if permit_authority is None:
+            permit_authority = await self.db.query(
+                "SELECT id, authority_level, authority_name, contact_info, website_url "
+                "FROM jurisdictions "
+                "WHERE ST_Contains(boundary, ST_Point($1, $2))",
+                geocode_result.coordinates.lng,
+                geocode_result.coordinates.lat
+            )
         
         jurisdiction['permit_authority'] = permit_authority
         
         return jurisdiction
     
+    @traced('discovery.classify_project')
     async def classify_project(self, project_data):
         """
         Use LLM to classify project and extract structured information
+        
+        With a classification index, the stored classification of a
+        near-identical past project is reused instead.
         """
         
+        match = (await self.similar_classifications([project_data]))[0]
+        current_span().set_attributes({
+            'classification.reused': bool(match and not match['verify']),
+            'classification.similarity': match['similarity'] if match else None
+        })
+        
+        if match and not match['verify']:
+            classification = match['classification']
+        else:
+            classification = await self.classify_with_llm(project_data)
+            await self.remember_classification(project_data, classification, match)
+        
+        # Enhance with rule-based checks
+        classification['estimated_value'] = self.estimate_project_value(
+            classification, 
+            project_data
+        )
+        
+        return classification
+    
+    async def classify_with_llm(self, project_data):
         prompt = f"""
         Analyze this construction/renovation project and extract key details:
         
         Description: {project_data['description']}
         Project Type: {project_data.get('project_type', 'unknown')}
-        Additional Details: {project_data.get('details', {})}
+        Additional Details: {compact_json(project_data.get('details', {}))}
         
         Extract and return JSON with:
-        {{
-            "project_category": "residential|commercial|industrial",
-            "work_types": ["structural", "electrical", "plumbing", "mechanical", "cosmetic"],
-            "scope": "new_construction|addition|alteration|repair",
-            "square_footage": number or null,
-            "stories": number or null,
-            "involves_utilities": bool,
-            "involves_structural_changes": bool,
-            "involves_occupancy_change": bool,
-            "fire_safety_concerns": bool,
-            "key_features": [list of important features],
-            "risk_level": "low|medium|high"
-        }}
+        {CLASSIFICATION_SCHEMA}
         """
         
-        response = await self.llm.generate(
-            prompt=prompt,
-            response_format='json'
-        )
+        # Identical projects classified at the same time share one call;
+        # each caller gets its own copy to enhance
+        return copy.deepcopy(await self.single_flight.do(
+            ('classify', hashlib.sha256(compact_prompt(prompt).encode('utf-8')).hexdigest()),
+            lambda: generate_json(
+                self.llm,
+                prompt,
+                schema=CLASSIFICATION_JSON_SCHEMA
+            )
+        ))
+    
+    @traced('discovery.classify_projects')
+    async def classify_projects(self, projects, on_classified=None):
+        """
+        Classify several projects with multi-project LLM prompts
         
-        classification = parse_json(response)
+        Projects with a reusable classification in the classification
+        index are not sent. The rest go CLASSIFY_BATCH_SIZE at a time; any
+        project a batched response leaves out (or a whole failed batch)
+        falls back to a single-project prompt. Returns classifications in
+        the order of projects, with the exception in place of a project
+        that could not be classified.
         
-        # Enhance with rule-based checks
-        classification['estimated_value'] = self.estimate_project_value(
-            classification, 
-            project_data
-        )
+        on_classified(index, classification) is called as each project's
+        classification (or exception) becomes known.
+        """
         
-        return classification
+        matches = await self.similar_classifications(projects)
+        classifications = [None] * len(projects)
+        
+        def done(i, classification):
+            if not isinstance(classification, Exception):
+                # Enhance with rule-based checks
+                classification['estimated_value'] = self.estimate_project_value(
+                    classification,
+                    projects[i]
+                )
+            classifications[i] = classification
+            if on_classified is not None:
+                on_classified(i, classification)
+        
+        for i, match in enumerate(matches):
+            if match and not match['verify']:
+                done(i, match['classification'])
+        
+        pending = [i for i, c in enumerate(classifications) if c is None]
+        current_span().set_attribute('classification.reused', len(projects) - len(pending))
+        
+        async def classify_chunk(chunk):
+            listing = '\n'.join(
+                f"[{n}] Description: {projects[i]['description']} | "
+                f"Project Type: {projects[i].get('project_type', 'unknown')} | "
+                f"Additional Details: {compact_json(projects[i].get('details', {}))}"
+                for n, i in enumerate(chunk)
+            )
+            
+            prompt = f"""
+            Analyze each of these construction/renovation projects and
+            extract key details:
+            
+            {listing}
+            
+            Return a JSON object keyed by the project number in brackets,
+            where each value has this shape:
+            {CLASSIFICATION_SCHEMA}
+            """
+            
+            try:
+                batch_result = await generate_json(
+                    self.llm,
+                    prompt,
+                    schema={
+                        'type': 'object',
+                        'additionalProperties': CLASSIFICATION_JSON_SCHEMA
+                    }
+                )
+            except Exception:
+                batch_result = {}
+            
+            async def finish(n, i):
+                try:
+                    classification = (batch_result.get(str(n))
+                                      or await self.classify_with_llm(projects[i]))
+                except Exception as e:
+                    done(i, e)
+                    return
+                
+                await self.remember_classification(projects[i], classification, matches[i])
+                done(i, classification)
+            
+            await asyncio.gather(*(finish(n, i) for n, i in enumerate(chunk)))
+        
+        await asyncio.gather(*(
+            classify_chunk(pending[i:i + CLASSIFY_BATCH_SIZE])
+            for i in range(0, len(pending), CLASSIFY_BATCH_SIZE)
+        ))
+        
+        return classifications
+    
+    async def similar_classifications(self, projects):
+        """
+        Reusable classification index matches for several projects, None
+        where there is none (or no index)
+        """
+        if self.classification_index is None:
+            return [None] * len(projects)
+        
+        return await self.classification_index.lookup_many(projects)
+    
+    async def remember_classification(self, project_data, classification, match=None):
+        """
+        Store an LLM classification in the classification index, or check
+        it against the reuse it was sampled to verify
+        """
+        if self.classification_index is not None:
+            await self.classification_index.record(project_data, classification, match)
     
+    @traced('discovery.get_jurisdiction_rules')
     async def get_jurisdiction_rules(self, jurisdiction):
         """
         Retrieve permit requirements for this jurisdiction
+        
+        Curated rules never expire. Scraped rules are kept warm by the
+        refresh scheduler and only re-scraped inline when there are none,
+        or when they are too old to serve.
         """
         
         # Query database for jurisdiction rules
         rules = await self.db.query(
-            "SELECT * FROM permit_requirements "
+            "SELECT *, EXTRACT(EPOCH FROM NOW() - scraped_at) AS age_seconds "
+            "FROM permit_requirements "
             "WHERE jurisdiction_id = $1 AND active = true",
             jurisdiction['permit_authority']['id']
         )
         
+        scraped_ages = [
+            rule['age_seconds'] for rule in rules if rule.get('age_seconds') is not None
+        ]
+        age = max(scraped_ages) if scraped_ages else None
+        
+        if age is not None and not self.refresh_scheduler.usable(age):
+            curated = [rule for rule in rules if rule.get('age_seconds') is None]
+            rules = curated + await self.refresh_rules(jurisdiction)
+            age = 0
+        
         # If no cached rules, scrape from municipality website
         if not rules:
-            rules = await self.scrape_jurisdiction_rules(jurisdiction)
+            rules = await self.refresh_rules(jurisdiction)
+            age = 0
         
-        # Also query vector database for regulatory text
-        regulatory_context = await self.vector_store.search(
-            query=f"{jurisdiction['city']} building code permit requirements",
-            top_k=10
-        )
+        if age is not None:
+            self.refresh_scheduler.record_rules(jurisdiction, age)
+        
+        # Also query vector database for regulatory text (cached per
+        # jurisdiction until new documents are ingested)
+        with self.instrumentation.span('discovery.regulatory_context'):
+            regulatory_context = await self.regulatory_context.get(jurisdiction)
+        
+        current_span().set_attributes({
+            'jurisdiction.id': jurisdiction['permit_authority']['id'],
+            'rule.count': len(rules)
+        })
         
         return {
+            'jurisdiction_id': jurisdiction['permit_authority']['id'],
             'structured_rules': rules,
             'regulatory_context': regulatory_context
         }
     
+    @traced('discovery.match_permits')
     async def match_permits(self, classification, permit_rules):
         """
         Match project classification to required permits using hybrid approach
@@ -169,61 +895,233 @@ class PermitDiscoveryEngine:
         # Rule-based matching
         rule_based_permits = self.apply_rule_based_matching(
             classification, 
-            permit_rules['structured_rules']
+            permit_rules['structured_rules'],
+            permit_rules.get('jurisdiction_id')
         )
         
-        # LLM-enhanced matching for edge cases
-        llm_prompt = f"""
-        Based on these project details:
-        {json.dumps(classification, indent=2)}
-        
-        And these jurisdiction requirements:
-        {json.dumps(permit_rules['structured_rules'], indent=2)}
+        # Skip the LLM when the rules already cover the project
+        span = current_span()
+        if self.rules_are_conclusive(classification, rule_based_permits):
+            span.set_attributes({
+                'rules.conclusive': True,
+                'permit.count': len(rule_based_permits)
+            })
+            return self.add_permit_metadata(rule_based_permits, classification, permit_rules)
         
-        And this regulatory context:
-        {permit_rules['regulatory_context']}
+        # LLM-enhanced matching for edge cases, given only the rules that
+        # could apply to this project
+        relevant_rules = self.relevant_rules(classification, permit_rules)
+        regulatory_context = fit_to_budget(
+            permit_rules['regulatory_context'],
+            REGULATORY_CONTEXT_TOKEN_BUDGET
+        )
         
-        Determine ALL required permits. Return JSON array:
-        [
-            {{
-                "permit_type": "building|electrical|plumbing|mechanical|demolition|etc",
-                "permit_name": "official name",
-                "required": true|false,
-                "reasoning": "why this is required",
-                "triggers": ["what triggered this requirement"],
-                "exemptions": ["potential exemptions if any"]
-            }}
-        ]
-        """
+        def build_prompt(rules):
+            return f"""
+            Based on these project details:
+            {compact_json(classification)}
+            
+            And these jurisdiction requirements:
+            {compact_json(rules)}
+            
+            And this regulatory context:
+            {compact_json(regulatory_context)}
+            
+            Determine ALL required permits. Return JSON array:
+            [
+                {{
+                    "permit_type": "building|electrical|plumbing|mechanical|demolition|etc",
+                    "permit_name": "official name",
+                    "required": true|false,
+                    "reasoning": "why this is required",
+                    "triggers": ["what triggered this requirement"],
+                    "exemptions": ["potential exemptions if any"]
+                }}
+            ]
+            """
         
-        llm_permits = await self.llm.generate(
-            prompt=llm_prompt,
-            response_format='json'
+        # Very large rule sets are split across concurrent prompts; a
+        # permit type returned by several chunks is kept once
+        llm_permits = await generate_json_chunked(
+            self.llm,
+            build_prompt,
+            relevant_rules,
+            schema=PERMIT_LIST_JSON_SCHEMA,
+            merge=lambda results: merge_json_results(results, key='permit_type')
         )
         
         # Merge rule-based and LLM results
         merged_permits = self.merge_permit_lists(
             rule_based_permits, 
-            parse_json(llm_permits)
+            llm_permits
+        )
+        
+        span.set_attributes({
+            'rules.conclusive': False,
+            'rule.candidates': len(relevant_rules),
+            'permit.count': len(merged_permits)
+        })
+        
+        return self.add_permit_metadata(merged_permits, classification, permit_rules)
+    
+    def add_permit_metadata(self, permits, classification, permit_rules):
+        # Fees and processing times for all permits in one vectorized pass
+        # over the jurisdiction's compiled fee schedule
+        fee_schedule = self.rule_sets.get(
+            permit_rules.get('jurisdiction_id'),
+            permit_rules['structured_rules']
+        ).fee_schedule
+        fees, min_days, max_days = fee_schedule.estimate(
+            [permit['permit_type'] for permit in permits],
+            classification.get('square_footage') or 0,
+            classification.get('estimated_value') or 0
         )
         
-        # Add metadata for each permit
-        for permit in merged_permits:
+        for permit, fee, low, high in zip(permits, fees, min_days, max_days):
             permit['form_id'] = self.get_form_id(permit, classification)
-            permit['estimated_fee'] = self.get_permit_fee(permit, classification)
-            permit['processing_time'] = self.get_processing_time(permit)
+            permit['estimated_fee'] = fee
+            permit['processing_time'] = {'min_days': low, 'max_days': high}
+        
+        return permits
+    
+    def calculate_timeline(self, workflow, required_permits):
+        """
+        Critical-path timeline of the workflow, with each permit step
+        taking its permit's processing time
+        """
+        return critical_path_timeline(workflow, required_permits)
+    
+    def calculate_costs(self, required_permits, project_data):
+        return round(sum(
+            permit['estimated_fee'] for permit in required_permits
+            if permit.get('estimated_fee') is not None
+        ), 2)
+    
+    @traced('discovery.reestimate_fees')
+    async def reestimate_fees(self, jurisdiction_id):
+        """
+        Re-estimate fees and processing times of every open project's
+        permits in a jurisdiction, e.g. after it publishes new fees
+        
+        Projects are those whose stored jurisdiction stage assigned them
+        to this jurisdiction, as in refresh_affected_projects, so projects
+        in a city are not re-priced on its county's schedule. The permits
+        are loaded in one query, estimated in one vectorized pass and
+        written back in one statement; a value the schedule has no
+        estimate for (e.g. a permit type it doesn't list) is left as it
+        was. Returns how many permits were updated.
+        """
+        rules, permits = await asyncio.gather(
+            self.db.query(
+                "SELECT * FROM permit_requirements "
+                "WHERE jurisdiction_id = $1 AND active = true",
+                jurisdiction_id
+            ),
+            self.db.query(
+                "SELECT p.id, p.permit_type, "
+                "       pr.classification->>'square_footage' AS square_footage, "
+                "       pr.estimated_value "
+                "FROM discovery_stages s "
+                "JOIN projects pr ON pr.id = s.project_id "
+                "JOIN permits p ON p.project_id = pr.id "
+                "WHERE s.stage = 'jurisdiction' "
+                "  AND s.output->'permit_authority'->>'id' = $1 "
+                "  AND pr.deleted_at IS NULL "
+                "  AND pr.status NOT IN ('approved', 'rejected', 'completed')",
+                jurisdiction_id
+            )
+        )
+        
+        fee_schedule = self.rule_sets.get(jurisdiction_id, rules).fee_schedule
+        fees, min_days, max_days = fee_schedule.estimate(
+            [permit['permit_type'] for permit in permits],
+            [float(permit['square_footage'] or 0) for permit in permits],
+            [float(permit['estimated_value'] or 0) for permit in permits]
+        )
+        
+        updates = [
+            {'id': permit['id'], 'fee': fee, 'processing_time': processing_time}
+            for permit, fee, processing_time in zip(
+                permits, fees, map(format_processing_time, min_days, max_days)
+            )
+            if fee is not None or processing_time is not None
+        ]
+        
+        if updates:
+            await self.db.execute(
+                "UPDATE permits p SET "
+                "  fee = COALESCE(f.fee, p.fee), "
+                "  processing_time = COALESCE(f.processing_time, p.processing_time), "
+                "  updated_at = NOW() "
+                "FROM jsonb_to_recordset($1) AS f(id uuid, fee numeric, processing_time text) "
+                "WHERE p.id = f.id",
+                json.dumps(updates)
+            )
+        
+        current_span().set_attributes({
+            'jurisdiction.id': jurisdiction_id,
+            'permit.count': len(permits),
+            'permit.updated': len(updates)
+        })
+        return len(updates)
+    
+    def rules_are_conclusive(self, classification, rule_based_permits):
+        """
+        Whether rule-based matching alone is enough for this project
+        
+        True when the project's risk level is one rules are trusted for and
+        every permit-bearing work type is covered by a matched rule.
+        """
+        if not rule_based_permits:
+            return False
+        
+        if classification.get('risk_level') not in RULES_CONCLUSIVE_RISK_LEVELS:
+            return False
+        
+        matched_types = {permit['permit_type'] for permit in rule_based_permits}
+        
+        return all(
+            WORK_TYPE_PERMITS[work_type] in matched_types
+            for work_type in classification.get('work_types', [])
+            if work_type in WORK_TYPE_PERMITS
+        )
+    
+    def relevant_rules(self, classification, permit_rules):
+        """
+        The jurisdiction rules that could apply to this project, trimmed
+        to the fields the LLM needs
+        """
+        rule_set = self.rule_sets.get(
+            permit_rules.get('jurisdiction_id'),
+            permit_rules['structured_rules']
+        )
         
-        return merged_permits
+        return [
+            {
+                'permit_type': rule['permit_type'],
+                'permit_name': rule['permit_name'],
+                'description': rule.get('description'),
+                'conditions': rule['conditions'],
+                'exemptions': rule.get('exemptions')
+            }
+            for rule, _ in rule_set.candidates(classification)
+        ]
     
-    def apply_rule_based_matching(self, classification, rules):
+    @traced('discovery.apply_rule_based_matching')
+    def apply_rule_based_matching(self, classification, rules, jurisdiction_id=None):
         """
         Apply deterministic rules for common scenarios
+        
+        Rules are compiled once per jurisdiction and indexed by the
+        classification attributes they test, so only candidate rules are
+        evaluated.
         """
         required = []
+        rule_set = self.rule_sets.get(jurisdiction_id, rules)
         
-        for rule in rules:
+        for rule, predicate in rule_set.candidates(classification):
             # Check if rule conditions match project
-            if self.evaluate_rule_conditions(rule['conditions'], classification):
+            if predicate(classification):
                 required.append({
                     'permit_type': rule['permit_type'],
                     'permit_name': rule['permit_name'],
@@ -234,66 +1132,366 @@ class PermitDiscoveryEngine:
         
         return required
     
-    async def fetch_forms(self, required_permits, jurisdiction):
+    @traced('discovery.fetch_forms')
+    async def fetch_forms(self, required_permits, jurisdiction, on_form=None):
         """
         Retrieve current permit forms from municipality
+        
+        Forms are fetched concurrently (bounded by form_fetch_concurrency)
+        and returned in the same order as required_permits. A form that
+        fails to fetch or parse is returned with an 'error' entry instead
+        of aborting the others.
+        
+        Parsed structures are stored with the template, keyed on a hash of
+        the form content, so a warm request does no parsing at all. Missing
+        templates are scraped and stored one at a time by refresh_form;
+        cached templates that need re-parsing are written back together.
+        If given, on_form(entry) is called as each form completes.
         """
-        forms = []
+        jurisdiction_id = jurisdiction['permit_authority']['id']
         
-        for permit in required_permits:
-            # Check cache first
-            cached_form = await self.db.query(
-                "SELECT * FROM form_templates "
-                "WHERE jurisdiction_id = $1 AND permit_type = $2 "
-                "AND updated_at > NOW() - INTERVAL '30 days'",
-                jurisdiction['permit_authority']['id'],
-                permit['permit_type']
-            )
-            
-            if cached_form:
-                form = cached_form
-            else:
-                # Scrape from municipality website
-                form = await self.scrape_form(permit, jurisdiction)
-                
-                # Cache it
-                await self.db.insert('form_templates', form)
-            
-            # Parse form structure
-            form_structure = await self.parse_form_structure(form)
-            
-            forms.append({
-                'permit_type': permit['permit_type'],
-                'form_url': form['url'],
-                'form_structure': form_structure,
-                'fillable_pdf': form.get('pdf_url'),
-                'online_portal': form.get('online_portal_url')
-            })
+        # Check cache first: one round trip for all permits
+        cached_forms = await self.get_cached_forms(
+            jurisdiction_id,
+            [permit['permit_type'] for permit in required_permits]
+        )
+        
+        semaphore = asyncio.Semaphore(self.form_fetch_concurrency)
+        forms_to_cache = []
+        
+        async def fetch_one(permit):
+            entry = await fetch_entry(permit)
+            if on_form:
+                on_form(entry)
+            return entry
+        
+        async def fetch_entry(permit):
+            async with semaphore:
+                try:
+                    form = cached_forms.get(permit['permit_type'])
+                    
+                    # Stale templates are served while the refresh
+                    # scheduler re-scrapes them in the background
+                    if form and not self.refresh_scheduler.usable(form['age_seconds']):
+                        form = None
+                    
+                    # Stored in a form store this process can't reach
+                    if form and not document_available(form):
+                        form = None
+                    
+                    if form:
+                        self.refresh_scheduler.record_form(
+                            permit, jurisdiction, form['age_seconds']
+                        )
+                    else:
+                        # Scrape, parse and store it; concurrent requests
+                        # for the same template share one scrape
+                        form = await self.refresh_form(permit, jurisdiction)
+                        self.refresh_scheduler.record_form(permit, jurisdiction, 0)
+                    
+                    # Parse form structure only if the content has changed
+                    content_hash = await form_hash(form)
+                    if (not form.get('form_structure')
+                            or form.get('content_hash') != content_hash):
+                        form['form_structure'] = await self.parse_form_once(form, content_hash)
+                        form['content_hash'] = content_hash
+                        forms_to_cache.append(form)
+                    
+                    return self.build_form_entry(permit, form)
+                except Exception as e:
+                    return {
+                        'permit_type': permit['permit_type'],
+                        'form_url': None,
+                        'form_structure': None,
+                        'error': str(e)
+                    }
+        
+        forms = await asyncio.gather(*(fetch_one(p) for p in required_permits))
+        
+        current_span().set_attributes({
+            'jurisdiction.id': jurisdiction_id,
+            'permit.count': len(required_permits),
+            'form.cache_hits': len(cached_forms),
+            'form.parsed': len(forms_to_cache),
+            'form.errors': sum(1 for form in forms if form.get('error'))
+        })
+        
+        # Cache re-parsed forms in a single write
+        if forms_to_cache:
+            await self.cache_forms(jurisdiction_id, forms_to_cache)
         
         return forms
     
-    async def parse_form_structure(self, form):
+    @traced('discovery.get_cached_forms')
+    async def get_cached_forms(self, jurisdiction_id, permit_types):
         """
-        Extract form fields and their requirements using AI
+        Look up cached templates for several permit types at once
+        
+        Returns a dict of permit_type -> most recently updated template,
+        shaped like a scraped form (see template_form), with its age in
+        seconds as 'age_seconds'. Whether it is fresh enough to use is up
+        to the caller (see RefreshScheduler.usable).
         """
+        rows = await self.db.query(
+            "SELECT DISTINCT ON (permit_type) "
+            "       permit_type, form_name, form_type, form_url, pdf_url, "
+            "       online_portal_url, raw_content, document_path, content_hash, "
+            "       form_structure, version, "
+            "       EXTRACT(EPOCH FROM NOW() - updated_at) AS age_seconds "
+            "FROM form_templates "
+            "WHERE jurisdiction_id = $1 AND permit_type = ANY($2) "
+            "ORDER BY permit_type, updated_at DESC",
+            jurisdiction_id,
+            list(set(permit_types))
+        )
         
-        if form['type'] == 'pdf':
-            # Extract PDF form fields
-            fields = await self.extract_pdf_fields(form['content'])
-        elif form['type'] == 'html':
-            # Parse HTML form
-            fields = await self.extract_html_fields(form['content'])
-        else:
-            # Use OCR + LLM for scanned forms
-            fields = await self.extract_fields_with_vision(form['content'])
+        return {row['permit_type']: template_form(row) for row in rows}
+    
+    @traced('discovery.cache_forms')
+    async def cache_forms(self, jurisdiction_id, forms):
+        """
+        Bulk upsert scraped forms and their parsed structures into form_templates
+        
+        A template without a version is stored as one unversioned row per
+        permit type (see idx_form_templates_version). Only HTML text is
+        stored in the row; PDF and scanned documents are written to the
+        form store by content hash and referenced by document_path.
+        """
+        records = []
+        for form in forms:
+            inline = form['type'] == 'html' and isinstance(form.get('content'), str)
+            if not inline:
+                form['document_path'] = await self.form_extractor.document_path(form)
+            
+            records.append({
+                'permit_type': form['permit_type'],
+                'form_name': form.get('name') or default_form_name(form['permit_type']),
+                'form_type': form['type'],
+                'form_url': form['url'],
+                'pdf_url': form.get('pdf_url'),
+                'online_portal_url': form.get('online_portal_url'),
+                'raw_content': form['content'] if inline else None,
+                'document_path': None if inline else form['document_path'],
+                'content_hash': form['content_hash'],
+                'form_structure': form['form_structure'],
+                'version': form.get('version')
+            })
+        
+        await self.db.execute(
+            "INSERT INTO form_templates "
+            "(jurisdiction_id, permit_type, form_name, form_type, form_url, "
+            " pdf_url, online_portal_url, raw_content, document_path, content_hash, "
+            " form_structure, version) "
+            "SELECT $1, f.permit_type, f.form_name, f.form_type, f.form_url, "
+            "       f.pdf_url, f.online_portal_url, f.raw_content, f.document_path, "
+            "       f.content_hash, f.form_structure, f.version "
+            "FROM jsonb_to_recordset($2) AS f("
+            "  permit_type text, form_name text, form_type text, form_url text, "
+            "  pdf_url text, online_portal_url text, raw_content text, "
+            "  document_path text, content_hash text, form_structure jsonb, "
+            "  version text) "
+            "ON CONFLICT (jurisdiction_id, permit_type, (COALESCE(version, ''))) "
+            "DO UPDATE SET "
+            "  form_name = EXCLUDED.form_name, "
+            "  form_type = EXCLUDED.form_type, "
+            "  form_url = EXCLUDED.form_url, "
+            "  pdf_url = EXCLUDED.pdf_url, "
+            "  online_portal_url = EXCLUDED.online_portal_url, "
+            "  raw_content = EXCLUDED.raw_content, "
+            "  document_path = EXCLUDED.document_path, "
+            "  content_hash = EXCLUDED.content_hash, "
+            "  form_structure = EXCLUDED.form_structure, "
+            "  updated_at = NOW()",
+            jurisdiction_id,
+            json.dumps(records)
+        )
+    
+    @traced('discovery.refresh_form')
+    async def refresh_form(self, permit, jurisdiction):
+        """
+        Scrape, parse and store one form template, and return it
+        
+        Concurrent calls for the same template, from live requests or the
+        refresh scheduler, share one scrape; with a cross-process lock,
+        so do calls from other processes.
+        """
+        jurisdiction_id = jurisdiction['permit_authority']['id']
+        
+        return await self.single_flight.do(
+            ('form', jurisdiction_id, permit['permit_type']),
+            lambda: self.scrape_and_store_form(permit, jurisdiction),
+            cross_process=True
+        )
+    
+    async def scrape_and_store_form(self, permit, jurisdiction):
+        jurisdiction_id = jurisdiction['permit_authority']['id']
+        cached = (await self.get_cached_forms(
+            jurisdiction_id, [permit['permit_type']]
+        )).get(permit['permit_type'])
+        
+        # Refreshed by another process while this one waited for the lock
+        if (cached and cached.get('form_structure')
+                and cached['age_seconds'] < SCRAPED_CONTENT_TTL - REFRESH_AHEAD
+                and document_available(cached)):
+            return cached
+        
+        # Scrape from municipality website, politely
+        async with self.scrape_slot(jurisdiction):
+            with self.instrumentation.span(
+                'discovery.scrape_form',
+                {'permit.type': permit['permit_type']}
+            ):
+                form = await self.scrape_form(permit, jurisdiction)
+        
+        # Re-parse only if the content changed
+        content_hash = await form_hash(form)
+        if (cached and cached.get('form_structure')
+                and cached.get('content_hash') == content_hash):
+            form['form_structure'] = cached['form_structure']
+        else:
+            form['form_structure'] = await self.parse_form_once(form, content_hash)
+        form['content_hash'] = content_hash
+        
+        await self.cache_forms(jurisdiction_id, [form])
+        return form
+    
+    async def parse_form_once(self, form, content_hash):
+        """
+        parse_form_structure, shared by concurrent callers with the same
+        form content
+        """
+        return await self.single_flight.do(
+            ('parse_form', content_hash),
+            lambda: self.parse_form_structure(form)
+        )
+    
+    @traced('discovery.refresh_rules')
+    async def refresh_rules(self, jurisdiction):
+        """
+        Scrape a jurisdiction's permit rules and replace the stored ones
+        
+        Concurrent calls for the same jurisdiction share one scrape, across
+        processes too when a cross-process lock is configured.
+        """
+        return await self.single_flight.do(
+            ('rules', jurisdiction['permit_authority']['id']),
+            lambda: self.scrape_and_store_rules(jurisdiction),
+            cross_process=True
+        )
+    
+    async def scrape_and_store_rules(self, jurisdiction):
+        jurisdiction_id = jurisdiction['permit_authority']['id']
+        
+        # Refreshed by another process while this one waited for the lock
+        rules = await self.db.query(
+            "SELECT * FROM permit_requirements "
+            "WHERE jurisdiction_id = $1 AND active = true "
+            "AND scraped_at > NOW() - make_interval(secs => $2)",
+            jurisdiction_id,
+            SCRAPED_CONTENT_TTL - REFRESH_AHEAD
+        )
+        if rules:
+            return rules
+        
+        async with self.scrape_slot(jurisdiction):
+            rules = await self.scrape_jurisdiction_rules(jurisdiction)
+        
+        await self.cache_rules(jurisdiction_id, rules)
+        return rules
+    
+    @traced('discovery.cache_rules')
+    async def cache_rules(self, jurisdiction_id, rules):
+        """
+        Retire a jurisdiction's scraped rules and insert the new set in
+        one statement; curated rules (no scraped_at) are left alone
+        """
+        await self.db.execute(
+            "WITH retired AS ("
+            "  UPDATE permit_requirements SET active = false, updated_at = NOW() "
+            "  WHERE jurisdiction_id = $1 AND active = true AND scraped_at IS NOT NULL"
+            ") "
+            "INSERT INTO permit_requirements "
+            "(jurisdiction_id, permit_type, permit_name, description, base_fee, "
+            " fee_calculation_formula, fee_tiers, processing_time_min_days, "
+            " processing_time_max_days, conditions, exemptions, "
+            " required_documents, scraped_at) "
+            "SELECT $1, r.permit_type, r.permit_name, r.description, r.base_fee, "
+            "       r.fee_calculation_formula, r.fee_tiers, r.processing_time_min_days, "
+            "       r.processing_time_max_days, r.conditions, r.exemptions, "
+            "       r.required_documents, NOW() "
+            "FROM jsonb_to_recordset($2) AS r("
+            "  permit_type text, permit_name text, description text, "
+            "  base_fee numeric, fee_calculation_formula text, fee_tiers jsonb, "
+            "  processing_time_min_days int, processing_time_max_days int, "
+            "  conditions jsonb, exemptions jsonb, required_documents jsonb)",
+            jurisdiction_id,
+            json.dumps(rules, default=str)
+        )
+    
+    def build_form_entry(self, permit, form):
+        """
+        Shape a fetched and parsed form into the entry returned by fetch_forms
+        """
+        return {
+            'permit_type': permit['permit_type'],
+            'form_url': form['url'],
+            'form_structure': form['form_structure'],
+            'fillable_pdf': form.get('pdf_url'),
+            'online_portal': form.get('online_portal_url')
+        }
+    
+    def scrape_slot(self, jurisdiction):
+        """
+        Per-host politeness limit for municipal website scraping
+        
+        Jurisdictions served by the same host (e.g. a county portal) share
+        one limit.
+        """
+        key = scrape_host(jurisdiction)
+        
+        if key not in self.scrape_semaphores:
+            self.scrape_semaphores[key] = asyncio.Semaphore(
+                SCRAPE_CONCURRENCY_PER_JURISDICTION
+            )
+        
+        return self.scrape_semaphores[key]
+    
+    @traced('discovery.parse_form_structure')
+    async def parse_form_structure(self, form):
+        """
+        Extract form fields and their requirements using AI
+        """
+        
+        vision = False
+        if form['type'] == 'html':
+            # Parse HTML form
+            fields = await self.extract_html_fields(await form_content(form))
+        else:
+            # PDF form fields, or OCR for scanned forms, extracted page by
+            # page off the event loop; None if the backend isn't installed
+            try:
+                fields = await self.form_extractor.extract_form(form)
+            except FormExtractionError:
+                fields = None
+            
+            if fields is None and form['type'] == 'pdf':
+                fields = await self.extract_pdf_fields(await form_content(form))
+            elif fields is None or (
+                form['type'] != 'pdf' and ocr_confidence(fields) < OCR_MIN_CONFIDENCE
+            ):
+                # Use LLM vision for scans OCR can't read reliably, or at all
+                vision = True
+                fields = await self.extract_fields_with_vision(await form_content(form))
         
-        # Enhance with LLM understanding
-        enhanced_fields = await self.llm.generate(
-            prompt=f"""
+        # Enhance with LLM understanding, in concurrent chunks for large
+        # forms
+        enhanced_fields = await generate_json_chunked(
+            self.llm,
+            lambda chunk: f"""
             Analyze these form fields and provide structured metadata:
-            {json.dumps(fields, indent=2)}
+            {compact_json(chunk)}
             
-            For each field, return:
+            Return a JSON array with, for each field:
             {{
                 "field_name": "original name",
                 "field_type": "text|number|date|address|checkbox|signature|etc",
@@ -305,10 +1503,17 @@ class PermitDiscoveryEngine:
                 "data_source": "where we can get this data"
             }}
             """,
-            response_format='json'
+            fields,
+            schema=FORM_FIELDS_JSON_SCHEMA
         )
         
-        return parse_json(enhanced_fields)
+        current_span().set_attributes({
+            'form.type': form['type'],
+            'form.vision_fallback': vision,
+            'form.field_count': len(enhanced_fields)
+        })
+        
+        return {'fields': enhanced_fields}
 
 
 # ============================================
@@ -320,11 +1525,15 @@ class AutoFillEngine:
     Intelligently fills permit forms with user data
     """
     
-    def __init__(self, llm_client, database):
-        self.llm = llm_client
-        self.db = database
+    def __init__(self, llm_client, database, instrumentation=None):
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+        self.llm = self.instrumentation.wrap('llm', llm_client)
+        self.db = self.instrumentation.wrap('db', database)
+        self.form_validators = OrderedDict()  # structure hash -> FormValidator
+        self.field_mappings = {}  # (template hash, shape signature) -> mappings
     
-    async def auto_fill_form(self, form_structure, user_data, project_data):
+    async def auto_fill_form(self, form_structure, user_data, project_data,
+                             profile=False):
         """
         Main entry point for form auto-filling
         
@@ -332,56 +1541,68 @@ class AutoFillEngine:
             form_structure: Parsed form fields from discovery engine
             user_data: User profile information
             project_data: Project-specific details
+            profile: Sample this request with the instrumentation's profiler
         
         Returns:
             Filled form with confidence scores
         """
         
-        # Step 1: Map user/project data to form fields
-        field_mappings = await self.create_field_mappings(
-            form_structure,
-            user_data,
-            project_data
-        )
-        
-        # Step 2: Fill each field with appropriate data
-        filled_form = {}
-        confidence_scores = {}
-        missing_fields = []
-        
-        for field in form_structure['fields']:
-            result = await self.fill_field(
-                field,
+        with self.instrumentation.request(
+            'autofill.auto_fill_form',
+            {'form.field_count': len(form_structure['fields'])},
+            profile=profile
+        ):
+            # Step 1: Map user/project data to form fields
+            field_mappings = await self.create_field_mappings(
+                form_structure,
+                user_data,
+                project_data
+            )
+            
+            # Step 2: Fill each field with appropriate data
+            filled_form = {}
+            confidence_scores = {}
+            missing_fields = []
+            
+            results = await self.fill_fields(
+                form_structure['fields'],
                 field_mappings,
                 user_data,
                 project_data
             )
             
-            if result['value'] is not None:
-                filled_form[field['field_name']] = result['value']
-                confidence_scores[field['field_name']] = result['confidence']
-            else:
-                if field['required']:
-                    missing_fields.append({
-                        'field': field['field_name'],
-                        'label': field['label'],
-                        'help_text': field.get('help_text', '')
-                    })
-        
-        # Step 3: Validate filled data
-        validation_results = await self.validate_form(filled_form, form_structure)
-        
-        return {
-            'filled_form': filled_form,
-            'confidence_scores': confidence_scores,
-            'missing_fields': missing_fields,
-            'validation_results': validation_results,
-            'ready_to_submit': len(missing_fields) == 0 and validation_results['valid']
-        }
+            for field, result in zip(form_structure['fields'], results):
+                if result['value'] is not None:
+                    filled_form[field['field_name']] = result['value']
+                    confidence_scores[field['field_name']] = result['confidence']
+                else:
+                    if field['required']:
+                        missing_fields.append({
+                            'field': field['field_name'],
+                            'label': field['label'],
+                            'help_text': field.get('help_text', '')
+                        })
+            
+            # Step 3: Validate filled data
+            validation_results = await self.validate_form(filled_form, form_structure)
+            
+            return {
+                'filled_form': filled_form,
+                'confidence_scores': confidence_scores,
+                'missing_fields': missing_fields,
+                'validation_results': validation_results,
+                'ready_to_submit': len(missing_fields) == 0 and validation_results['valid']
+            }
     
+    @traced('autofill.create_field_mappings')
     async def create_field_mappings(self, form_structure, user_data, project_data):
         """
         Create intelligent mappings between form fields and available data
+        
+        Mappings are learned per form template and data shape (the set of
+        available key paths, not their values) and reused from then on. The
+        LLM is only asked about fields without a cached mapping, and only
+        sees key paths and value types, never the user's data.
         """
         
         all_data = {
@@ -389,65 +1610,271 @@ class AutoFillEngine:
             'project': project_data
         }
         
-        prompt = f"""
-        Create mappings between form fields and available data:
+        key_paths = data_key_paths(all_data)
+        template_hash = form_structure_hash(form_structure)
+        shape_signature = hashlib.sha256(
+            '\n'.join(sorted(key_paths)).encode('utf-8')
+        ).hexdigest()
+        
+        mappings = await self.get_cached_mappings(template_hash, shape_signature)
+        unmapped = [
+            field for field in form_structure['fields']
+            if field['field_name'] not in mappings
+        ]
         
-        Form fields:
-        {json.dumps(form_structure['fields'], indent=2)}
+        current_span().set_attributes({
+            'form.field_count': len(form_structure['fields']),
+            'cache.hit': not unmapped
+        })
         
-        Available data:
-        {json.dumps(all_data, indent=2)}
+        if unmapped:
+            learned = await self.learn_field_mappings(unmapped, key_paths)
+            
+            # Remember fields with no usable source too, so they aren't
+            # asked about again
+            for field in unmapped:
+                mapping = learned.get(field['field_name'])
+                if not mapping or mapping.get('source') not in key_paths:
+                    mapping = {'source': None, 'transformation': None, 'confidence': 0}
+                mappings[field['field_name']] = mapping
+            
+            await self.cache_mappings(
+                template_hash,
+                shape_signature,
+                {field['field_name']: mappings[field['field_name']] for field in unmapped}
+            )
         
-        For each form field, return the best data source:
-        {{
-            "field_name": {{
-                "source": "user.property.address | project.description | etc",
-                "transformation": "any needed transformation",
-                "confidence": 0-1 score
-            }}
-        }}
+        return {
+            field_name: mapping
+            for field_name, mapping in mappings.items()
+            if mapping.get('source')
+        }
+    
+    @traced('autofill.learn_field_mappings')
+    async def learn_field_mappings(self, fields, key_paths):
         """
+        Ask the LLM to map fields to data paths
         
-        mappings = await self.llm.generate(
-            prompt=prompt,
-            response_format='json'
+        Fields are trimmed to what identifies them; large forms are split
+        across concurrent prompts.
+        """
+        def build_prompt(chunk):
+            return f"""
+            Create mappings between form fields and available data:
+            
+            Form fields:
+            {compact_json(chunk)}
+            
+            Available data paths and value types:
+            {compact_json(key_paths)}
+            
+            For each form field, return the best data source:
+            {{
+                "field_name": {{
+                    "source": "user.property.address | project.description | etc",
+                    "transformation": "any needed transformation",
+                    "confidence": 0-1 score
+                }}
+            }}
+            """
+        
+        return await generate_json_chunked(
+            self.llm,
+            build_prompt,
+            [prune_record(field, FIELD_PROMPT_KEYS) for field in fields],
+            schema=FIELD_MAPPINGS_JSON_SCHEMA
         )
+    
+    @traced('autofill.get_cached_mappings')
+    async def get_cached_mappings(self, template_hash, shape_signature):
+        key = (template_hash, shape_signature)
+        if key in self.field_mappings:
+            return dict(self.field_mappings[key])
+        
+        rows = await self.db.query(
+            "SELECT field_name, source, transformation, confidence "
+            "FROM form_field_mappings "
+            "WHERE template_hash = $1 AND shape_signature = $2",
+            template_hash,
+            shape_signature
+        )
+        
+        mappings = {
+            row['field_name']: {
+                'source': row['source'],
+                'transformation': row['transformation'],
+                'confidence': row['confidence']
+            }
+            for row in rows
+        }
+        self.field_mappings[key] = mappings
+        return dict(mappings)
+    
+    @traced('autofill.cache_mappings')
+    async def cache_mappings(self, template_hash, shape_signature, mappings):
+        self.field_mappings.setdefault((template_hash, shape_signature), {}).update(mappings)
         
-        return parse_json(mappings)
+        await self.db.execute(
+            "INSERT INTO form_field_mappings "
+            "(template_hash, shape_signature, field_name, source, transformation, confidence) "
+            "SELECT $1, $2, m.field_name, m.source, m.transformation, m.confidence "
+            "FROM jsonb_to_recordset($3) AS m("
+            "  field_name text, source text, transformation text, confidence numeric) "
+            "ON CONFLICT (template_hash, shape_signature, field_name) DO UPDATE SET "
+            "  source = EXCLUDED.source, "
+            "  transformation = EXCLUDED.transformation, "
+            "  confidence = EXCLUDED.confidence, "
+            "  updated_at = NOW()",
+            template_hash,
+            shape_signature,
+            json.dumps([
+                {'field_name': field_name, **mapping}
+                for field_name, mapping in mappings.items()
+            ])
+        )
     
-    async def fill_field(self, field, mappings, user_data, project_data):
+    @traced('autofill.fill_fields')
+    async def fill_fields(self, fields, mappings, user_data, project_data):
         """
-        Fill a single field with appropriate data
+        Fill all fields of a form, coalescing LLM work into batched calls
+        
+        Values are extracted and locally transformed for every field first.
+        Fields that still need an LLM transformation, and then fields whose
+        value fails validation, are each sent to the LLM as a single batched
+        request per form instead of one call per field.
+        
+        Returns a list of {'value', 'confidence'} in the order of fields.
         """
+        values = {}
+        pending_transformations = []
         
-        field_name = field['field_name']
+        for field in fields:
+            field_name = field['field_name']
+            
+            # Check if we have a mapping
+            if field_name not in mappings:
+                continue
+            
+            mapping = mappings[field_name]
+            
+            # Extract value from data source
+            value = self.extract_value(mapping['source'], user_data, project_data)
+            
+            # Apply any transformations that don't need the LLM
+            transformation = mapping.get('transformation')
+            if transformation:
+                local = self.get_local_transformation(transformation, field)
+                try:
+                    if not local:
+                        raise ValueError(transformation)
+                    value = local(value)
+                except TRANSFORMATION_ERRORS:
+                    pending_transformations.append({
+                        'field': field,
+                        'value': value,
+                        'instruction': transformation
+                    })
+            
+            values[field_name] = value
         
-        # Check if we have a mapping
-        if field_name not in mappings:
-            return {'value': None, 'confidence': 0}
+        # Complex transformations use LLM, batched per form
+        values.update(await self.batch_llm_requests(
+            pending_transformations,
+            fallback=lambda r: self.apply_transformation(
+                r['value'], r['instruction'], r['field']
+            )
+        ))
         
-        mapping = mappings[field_name]
+        # Validate against field requirements and try to use LLM to
+        # fix/convert any invalid values, batched per form
+        pending_fixes = [
+            {
+                'field': field,
+                'value': values[field['field_name']],
+                'instruction': 'Convert this value so it is valid for the field'
+            }
+            for field in fields
+            if field['field_name'] in values
+            and not self.validate_field_value(values[field['field_name']], field)
+        ]
         
-        # Extract value from data source
-        value = self.extract_value(mapping['source'], user_data, project_data)
+        values.update(await self.batch_llm_requests(
+            pending_fixes,
+            fallback=lambda r: self.llm_fix_value(r['value'], r['field'])
+        ))
         
-        # Apply any transformations
-        if mapping.get('transformation'):
-            value = await self.apply_transformation(
-                value,
-                mapping['transformation'],
-                field
-            )
+        return [
+            {
+                'value': values[field['field_name']],
+                'confidence': mappings[field['field_name']]['confidence']
+            }
+            if field['field_name'] in values
+            else {'value': None, 'confidence': 0}
+            for field in fields
+        ]
+    
+    @traced('autofill.batch_llm_requests')
+    async def batch_llm_requests(self, requests, fallback):
+        """
+        Resolve several per-field LLM requests with one structured prompt
         
-        # Validate against field requirements
-        if not self.validate_field_value(value, field):
-            # Try to use LLM to fix/convert the value
-            value = await self.llm_fix_value(value, field)
+        Each request is {'field', 'value', 'instruction'}. Returns a dict of
+        field_name -> new value. If the batched call fails or leaves fields
+        out, those fields are resolved concurrently with fallback(request).
+        """
+        if not requests:
+            return {}
         
-        return {
-            'value': value,
-            'confidence': mapping['confidence']
-        }
+        resolved = {}
+        
+        if len(requests) > 1:
+            batch = [
+                {
+                    'field_name': r['field']['field_name'],
+                    'label': r['field']['label'],
+                    'field_type': r['field']['field_type'],
+                    'value': r['value'],
+                    'instruction': r['instruction']
+                }
+                for r in requests
+            ]
+            
+            try:
+                batch_result = await generate_json_chunked(
+                    self.llm,
+                    lambda chunk: f"""
+                    Process each of these form field values as instructed:
+                    {compact_json(chunk)}
+                    
+                    Return a JSON object mapping each field_name to its resulting
+                    value, nothing else:
+                    {{
+                        "field_name": "transformed value"
+                    }}
+                    """,
+                    batch,
+                    schema={'type': 'object'}
+                )
+                resolved = {
+                    r['field']['field_name']: batch_result[r['field']['field_name']]
+                    for r in requests
+                    if r['field']['field_name'] in batch_result
+                }
+            except Exception:
+                resolved = {}
+        
+        # Fall back to per-field calls for anything the batch didn't cover
+        remaining = [r for r in requests if r['field']['field_name'] not in resolved]
+        current_span().set_attributes({
+            'llm.batch_size': len(requests),
+            'llm.fallbacks': len(remaining)
+        })
+        fallback_values = await asyncio.gather(*(fallback(r) for r in remaining))
+        
+        for r, value in zip(remaining, fallback_values):
+            resolved[r['field']['field_name']] = value
+        
+        return resolved
     
     def extract_value(self, source_path, user_data, project_data):
         """
@@ -471,22 +1898,50 @@ class AutoFillEngine:
         
         return data
     
+    def get_local_transformation(self, transformation, field):
+        """
+        Return a callable for transformations that don't need the LLM
+        
+        Looks transformation up in FIELD_TRANSFORMERS by name, then matches
+        the whole normalized instruction against TRANSFORMATION_PATTERNS
+        (e.g. "format as MM/DD/YYYY"). Anything more than a bare format,
+        like "extract the area code from the phone number", is left to the
+        LLM. The callable raises one of TRANSFORMATION_ERRORS if the value
+        can't be converted.
+        """
+        name = transformation.strip().lower()
+        
+        transformer = FIELD_TRANSFORMERS.get(name)
+        if not transformer:
+            instruction = normalize_instruction(transformation)
+            for pattern, candidate in TRANSFORMATION_PATTERNS:
+                if pattern.fullmatch(instruction):
+                    transformer = candidate
+                    break
+        
+        if not transformer:
+            return None
+        
+        return lambda value: transformer(value, field, transformation)
+    
+    def validate_field_value(self, value, field):
+        """
+        Check a value against its field type, if there is a local check for it
+        """
+        validator = FIELD_TYPE_VALIDATORS.get(field.get('field_type'))
+        return value is None or validator is None or validator(value)
+    
     async def apply_transformation(self, value, transformation, field):
         """
         Transform data to match field requirements
         """
         
-        # Common transformations
-        transformations = {
-            'uppercase': lambda v: v.upper() if v else v,
-            'lowercase': lambda v: v.lower() if v else v,
-            'format_phone': lambda v: self.format_phone_number(v),
-            'format_date': lambda v: self.format_date(v, field.get('date_format')),
-            'format_currency': lambda v: f"${float(v):,.2f}" if v else None
-        }
-        
-        if transformation in transformations:
-            return transformations[transformation](value)
+        local = self.get_local_transformation(transformation, field)
+        if local:
+            try:
+                return local(value)
+            except TRANSFORMATION_ERRORS:
+                pass
         
         # Complex transformations use LLM
         prompt = f"""
@@ -501,35 +1956,47 @@ class AutoFillEngine:
         result = await self.llm.generate(prompt=prompt)
         return result.strip()
     
+    @traced('autofill.validate_form')
     async def validate_form(self, filled_form, form_structure):
         """
         Validate entire filled form
+        
+        Field checks run through validators compiled once per form
+        structure. The LLM consistency check is skipped only when every
+        rule on the form could be checked deterministically and no rule
+        relates fields to each other.
         """
         
-        errors = []
+        validator = self.get_form_validator(form_structure)
+        errors = validator.validate(filled_form)
         warnings = []
+        current_span().set_attributes({
+            'validation.conclusive': validator.conclusive,
+            'validation.cross_field': validator.cross_field,
+            'validation.invalid_rules': len(validator.invalid_rules)
+        })
         
-        for field in form_structure['fields']:
-            field_name = field['field_name']
-            value = filled_form.get(field_name)
-            
-            # Check required fields
-            if field['required'] and not value:
-                errors.append(f"Required field missing: {field['label']}")
-                continue
+        # Cross-field validation using LLM. Values are labelled and long
+        # text clipped; oversized forms are checked in chunks of
+        # consecutive fields, which keeps related fields together.
+        if not errors and (not validator.conclusive or validator.cross_field):
+            labels = {
+                field['field_name']: field.get('label')
+                for field in form_structure['fields']
+            }
+            values = [
+                prune_record(
+                    {'field': name, 'label': labels.get(name), 'value': clip_value(value)},
+                    ('field', 'label', 'value')
+                )
+                for name, value in filled_form.items()
+            ]
             
-            # Validate field-specific rules
-            if value and field.get('validation_rules'):
-                for rule in field['validation_rules']:
-                    if not self.check_validation_rule(value, rule):
-                        errors.append(f"{field['label']}: {rule['message']}")
-        
-        # Cross-field validation using LLM
-        if not errors:
-            consistency_check = await self.llm.generate(
-                prompt=f"""
+            check_result = await generate_json_chunked(
+                self.llm,
+                lambda chunk: f"""
                 Review this filled permit form for consistency and completeness:
-                {json.dumps(filled_form, indent=2)}
+                {compact_json(chunk)}
                 
                 Check for:
                 - Inconsistent information
@@ -543,10 +2010,10 @@ class AutoFillEngine:
                     "warnings": [list of warnings]
                 }}
                 """,
-                response_format='json'
+                values,
+                schema=CONSISTENCY_JSON_SCHEMA
             )
             
-            check_result = parse_json(consistency_check)
             errors.extend(check_result.get('errors', []))
             warnings.extend(check_result.get('warnings', []))
         
@@ -555,38 +2022,3800 @@ class AutoFillEngine:
             'errors': errors,
             'warnings': warnings
         }
+    
+    def get_form_validator(self, form_structure):
+        key = form_structure_hash(form_structure)
+        
+        validator = self.form_validators.get(key)
+        if validator is None:
+            validator = FormValidator(form_structure)
+            self.form_validators[key] = validator
+            
+            while len(self.form_validators) > FORM_VALIDATOR_CACHE_SIZE:
+                self.form_validators.popitem(last=False)
+        
+        self.form_validators.move_to_end(key)
+        return validator
 
 
 # ============================================
-# HELPER FUNCTIONS
+# FIELD TRANSFORMERS AND VALIDATORS
 # ============================================
 
-def parse_json(text):
-    """Safely parse JSON from LLM response"""
-    # Remove markdown code blocks if present
-    text = text.strip()
-    if text.startswith('```'):
-        text = text.split('\n', 1)[1]
-        text = text.rsplit('```', 1)[0]
+# Compiled form validators kept per AutoFillEngine
+FORM_VALIDATOR_CACHE_SIZE = 500
+
+US_STATES = {
+    'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR',
+    'california': 'CA', 'colorado': 'CO', 'connecticut': 'CT', 'delaware': 'DE',
+    'district of columbia': 'DC', 'florida': 'FL', 'georgia': 'GA', 'hawaii': 'HI',
+    'idaho': 'ID', 'illinois': 'IL', 'indiana': 'IN', 'iowa': 'IA',
+    'kansas': 'KS', 'kentucky': 'KY', 'louisiana': 'LA', 'maine': 'ME',
+    'maryland': 'MD', 'massachusetts': 'MA', 'michigan': 'MI', 'minnesota': 'MN',
+    'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT', 'nebraska': 'NE',
+    'nevada': 'NV', 'new hampshire': 'NH', 'new jersey': 'NJ', 'new mexico': 'NM',
+    'new york': 'NY', 'north carolina': 'NC', 'north dakota': 'ND', 'ohio': 'OH',
+    'oklahoma': 'OK', 'oregon': 'OR', 'pennsylvania': 'PA', 'rhode island': 'RI',
+    'south carolina': 'SC', 'south dakota': 'SD', 'tennessee': 'TN', 'texas': 'TX',
+    'utah': 'UT', 'vermont': 'VT', 'virginia': 'VA', 'washington': 'WA',
+    'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY'
+}
+
+# Accepted input date formats, tried in order
+DATE_INPUT_FORMATS = [
+    '%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%B %d, %Y', '%b %d, %Y',
+    '%d %B %Y', '%Y/%m/%d'
+]
+
+# Form-style date format tokens to strftime directives
+DATE_FORMAT_TOKENS = [
+    ('YYYY', '%Y'), ('YY', '%y'), ('MM', '%m'), ('DD', '%d')
+]
+
+PHONE_DIGITS = re.compile(r'\d')
+ZIP_PATTERN = re.compile(r'^(\d{5})(?:-?(\d{4}))?$')
+PARCEL_ID_PATTERN = re.compile(r'^[A-Z0-9][A-Z0-9.\-]{2,29}$')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+UNIT_DESIGNATOR = re.compile(
+    r'\s*,?\s*(?:suite|ste|unit|apt|apartment|#)\s*\.?\s*#?\s*[\w-]+\s*$',
+    re.IGNORECASE
+)
+DIMENSIONS_PATTERN = re.compile(
+    r'(\d+(?:\.\d+)?)\s*(?:ft|feet|\')?\s*[x×]\s*(\d+(?:\.\d+)?)', re.IGNORECASE
+)
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    if hasattr(value, 'year') and hasattr(value, 'month'):
+        return datetime(value.year, value.month, value.day)
+    
+    text = str(value).strip()
+    for fmt in DATE_INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
     
-    return json.loads(text)
+    raise ValueError(f"Unrecognized date: {value!r}")
 
 
-# ============================================
-# USAGE EXAMPLE
-# ============================================
+def format_date(value, date_format=None):
+    """Format a date using a form-style format such as MM/DD/YYYY"""
+    directive = date_format or 'MM/DD/YYYY'
+    for token, replacement in DATE_FORMAT_TOKENS:
+        directive = directive.replace(token, replacement)
+    
+    return parse_date(value).strftime(directive)
 
-async def main():
+
+def format_phone(value):
+    digits = ''.join(PHONE_DIGITS.findall(str(value)))
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    if len(digits) != 10:
+        raise ValueError(f"Not a US phone number: {value!r}")
+    
+    return f"({digits[:3]}) {digits[3:6]}-{digits[6:]}"
+
+
+def format_zip(value):
+    match = ZIP_PATTERN.match(str(value).strip())
+    if not match:
+        raise ValueError(f"Not a ZIP code: {value!r}")
+    
+    return f"{match[1]}-{match[2]}" if match[2] else match[1]
+
+
+def parse_amount(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    
+    text = str(value).replace('$', '').replace(',', '').strip()
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"Not an amount: {value!r}")
+
+
+def format_currency(value):
+    return f"${parse_amount(value):,.2f}"
+
+
+def abbreviate_state(value):
+    text = str(value).strip()
+    if text.upper() in US_STATES.values():
+        return text.upper()
+    
+    abbreviation = US_STATES.get(text.lower())
+    if not abbreviation:
+        raise ValueError(f"Unknown state: {value!r}")
+    
+    return abbreviation
+
+
+def strip_unit(address):
+    """Remove a trailing suite/unit/apartment designator"""
+    return UNIT_DESIGNATOR.sub('', str(address)).strip()
+
+
+def parse_square_feet(value):
+    """Square footage from a number, '1,200 sq ft' or dimensions like '12x16'"""
+    if isinstance(value, (int, float)):
+        return value
+    
+    text = str(value)
+    dimensions = DIMENSIONS_PATTERN.search(text)
+    if dimensions:
+        area = float(dimensions[1]) * float(dimensions[2])
+    else:
+        number = re.search(r'\d[\d,]*(?:\.\d+)?', text)
+        if not number:
+            raise ValueError(f"No square footage in {value!r}")
+        area = float(number[0].replace(',', ''))
+    
+    return int(area) if area.is_integer() else area
+
+
+def normalize_parcel_id(value):
+    parcel_id = re.sub(r'\s+', '', str(value)).upper()
+    if not PARCEL_ID_PATTERN.match(parcel_id):
+        raise ValueError(f"Not a parcel ID: {value!r}")
+    
+    return parcel_id
+
+
+def title_case(value):
+    return ' '.join(word[:1].upper() + word[1:].lower() for word in str(value).split())
+
+
+def extract_date_format(transformation):
+    match = re.search(r'[MDY]{2,4}([/\-. ])[MDY]{2,4}\1[MDY]{2,4}', transformation.upper())
+    return match[0] if match else None
+
+
+# Transformers are called as transformer(value, field, transformation)
+FIELD_TRANSFORMERS = {
+    'uppercase': lambda v, f, t: str(v).upper() if v else v,
+    'lowercase': lambda v, f, t: str(v).lower() if v else v,
+    'title_case': lambda v, f, t: title_case(v) if v else v,
+    'format_phone': lambda v, f, t: format_phone(v),
+    'format_date': lambda v, f, t: format_date(
+        v, extract_date_format(t) or f.get('date_format')
+    ),
+    'format_currency': lambda v, f, t: format_currency(v) if v else None,
+    'format_zip': lambda v, f, t: format_zip(v),
+    'abbreviate_state': lambda v, f, t: abbreviate_state(v),
+    'strip_unit': lambda v, f, t: strip_unit(v),
+    'parse_square_feet': lambda v, f, t: parse_square_feet(v),
+    'format_parcel_id': lambda v, f, t: normalize_parcel_id(v)
+}
+
+# Errors a local transformer raises for a value it can't convert; the
+# field is then transformed by the LLM
+TRANSFORMATION_ERRORS = (ValueError, TypeError, AttributeError)
+
+# Leading verbs, articles and a trailing "format" that don't change what a
+# transformation instruction asks for
+INSTRUCTION_PREFIX = re.compile(
+    r'^(?:(?:re)?format|convert|change|write|make|put|use)\b\s*'
+    r'(?:(?:it|the value|value)\b\s*)?(?:(?:as|to|in|into)\b\s*)?(?:(?:an?|the)\b\s*)?'
+    r'|^(?:(?:as|to|in|into)\b\s*)?(?:(?:an?|the)\b\s*)?'
+)
+INSTRUCTION_SUFFIX = re.compile(r'\s+(?:format|formatted|form)$')
+
+# Free-text transformation instructions recognized without the LLM; each
+# pattern must match the whole normalized instruction
+TRANSFORMATION_PATTERNS = [
+    (re.compile(pattern), FIELD_TRANSFORMERS[name])
+    for pattern, name in [
+        (r'(?:date )?(?:as )?[mdy]{2}([/\-.])[mdy]{2}\1[mdy]{2,4}|date', 'format_date'),
+        (r'phone(?: number)?', 'format_phone'),
+        (r'zip(?: code)?|postal code', 'format_zip'),
+        (r'abbreviated? (?:the )?state|(?:two.letter )?state (?:abbreviation|code)', 'abbreviate_state'),
+        (r'(?:strip|remove|drop) (?:the |any )?(?:suite|unit|apt|apartment)(?: number)?', 'strip_unit'),
+        (r'square (?:feet|footage)|sq\.? ?ft', 'parse_square_feet'),
+        (r'(?:parcel(?: id| number)?|apn)', 'format_parcel_id'),
+        (r'currency|dollars?|us dollars', 'format_currency'),
+        (r'title ?case|capitali[sz]e each word', 'title_case'),
+        (r'upper ?case|all caps|capitals', 'uppercase'),
+        (r'lower ?case', 'lowercase')
+    ]
+]
+
+
+def normalize_instruction(transformation):
     """
-    Example usage of the permit system
+    Transformation instruction reduced to what it asks for
+    
+    >>> normalize_instruction('Format as MM/DD/YYYY.')
+    'mm/dd/yyyy'
+    >>> normalize_instruction('Convert to uppercase')
+    'uppercase'
+    >>> normalize_instruction('use only the 5-digit ZIP')
+    'only the 5-digit zip'
+    """
+    text = ' '.join(str(transformation).lower().split()).rstrip('.')
+    return INSTRUCTION_SUFFIX.sub('', INSTRUCTION_PREFIX.sub('', text, count=1))
+
+
+def succeeds(parser):
+    def check(value):
+        try:
+            parser(value)
+            return True
+        except (ValueError, TypeError):
+            return False
+    return check
+
+
+# Format checks by field_type
+FIELD_TYPE_VALIDATORS = {
+    'date': succeeds(parse_date),
+    'phone': succeeds(format_phone),
+    'zip': succeeds(format_zip),
+    'email': lambda v: bool(EMAIL_PATTERN.match(str(v))),
+    'currency': succeeds(parse_amount),
+    'number': succeeds(parse_amount),
+    'parcel_id': succeeds(normalize_parcel_id),
+    'state': succeeds(abbreviate_state),
+    'checkbox': lambda v: isinstance(v, bool),
+    'text': lambda v: isinstance(v, (str, int, float)),
+    'textarea': lambda v: isinstance(v, str),
+    'address': lambda v: isinstance(v, str)
+}
+
+# Leading "must be a valid" and the like, which don't change what a
+# free-text validation rule requires
+VALIDATION_RULE_PREFIX = re.compile(
+    r'^(?:(?:must|should|has to) be\s+)?(?:(?:a|an)\s+)?(?:valid\s+)?'
+)
+
+# Free-text validation rules recognized without the LLM; each pattern must
+# match the whole normalized rule, so a rule with further constraints
+# ("phone number in the 512 area code") is left to the LLM. Each builds a
+# check from the regex match.
+VALIDATION_RULE_PATTERNS = [
+    (re.compile(r'max(?:imum)?(?: length)?(?: of)? (\d+) char(?:acter)?s?(?: long)?'),
+     lambda m: lambda v: len(str(v)) <= int(m[1])),
+    (re.compile(r'min(?:imum)?(?: length)?(?: of)? (\d+) char(?:acter)?s?(?: long)?'),
+     lambda m: lambda v: len(str(v)) >= int(m[1])),
+    (re.compile(r'(date|phone|zip|email|state)(?: number| code| address)?'),
+     lambda m: FIELD_TYPE_VALIDATORS[m[1]]),
+    (re.compile(r'numeric|number'),
+     lambda m: FIELD_TYPE_VALIDATORS['number']),
+    (re.compile(r'positive(?: number)?'),
+     lambda m: lambda v: parse_amount(v) > 0),
+    (re.compile(r'non-?negative(?: number)?'),
+     lambda m: lambda v: parse_amount(v) >= 0)
+]
+
+# Structured validation rules ({'type': ..., 'value': ..., 'message': ...});
+# a builder raising for a malformed rule leaves that rule to the LLM
+VALIDATION_RULE_TYPES = {
+    'pattern': lambda r: (lambda v, rx=re.compile(r['value']): bool(rx.fullmatch(str(v)))),
+    'max_length': lambda r: lambda v: len(str(v)) <= r['value'],
+    'min_length': lambda r: lambda v: len(str(v)) >= r['value'],
+    'min': lambda r: lambda v: parse_amount(v) >= r['value'],
+    'max': lambda r: lambda v: parse_amount(v) <= r['value'],
+    'one_of': lambda r: lambda v: v in r['value'],
+    'format': lambda r: FIELD_TYPE_VALIDATORS[r['value']]
+}
+
+# Errors raised compiling a malformed structured rule, e.g. an invalid
+# regex or an unknown format
+VALIDATION_RULE_ERRORS = (re.error, KeyError, TypeError, ValueError)
+
+# Wording of free-text rules that relate a field to other fields
+CROSS_FIELD_RULE_PATTERN = re.compile(
+    r'\b(?:if|when|unless|same as|match(?:es)?|before|after|sum of|total of)\b',
+    re.I
+)
+
+
+class FormValidator:
     """
+    Field validation for one form structure, compiled once
     
-    # Initialize engines
-    llm = ClaudeClient(api_key="...")
-    db = Database(connection_string="...")
-    geocoder = GeocodingService()
+    Each field's type check and validation rules are compiled into
+    predicates. conclusive is False if any rule could not be compiled or
+    any field type has no local check, and cross_field is True if any rule
+    relates fields to each other; validate_form then still asks the LLM
+    for a consistency review. Malformed rules are skipped and kept in
+    invalid_rules as (field_name, rule, error).
+    """
+    
+    def __init__(self, form_structure):
+        self.fields = []
+        self.conclusive = True
+        self.cross_field = False
+        self.invalid_rules = []
+        
+        names = {
+            name.lower()
+            for field in form_structure['fields']
+            for name in (field['field_name'], field.get('label'))
+            if name
+        }
+        
+        for field in form_structure['fields']:
+            checks = []
+            
+            type_check = FIELD_TYPE_VALIDATORS.get(field.get('field_type'))
+            if type_check:
+                checks.append((type_check, f"Invalid {field.get('field_type')}"))
+            elif field.get('field_type') not in ('signature', None):
+                self.conclusive = False
+            
+            own_names = {field['field_name'].lower(), (field.get('label') or '').lower()}
+            
+            for rule in field.get('validation_rules') or []:
+                if is_cross_field_rule(rule, names - own_names):
+                    self.cross_field = True
+                
+                try:
+                    check = self.compile_rule(rule)
+                except VALIDATION_RULE_ERRORS as e:
+                    self.invalid_rules.append((field['field_name'], rule, repr(e)))
+                    check = None
+                
+                if check is None:
+                    self.conclusive = False
+                else:
+                    message = rule['message'] if isinstance(rule, dict) else rule
+                    checks.append((check, message))
+            
+            self.fields.append((field, checks))
     
-    discovery = PermitDiscoveryEngine(llm, db, geocoder)
+    def compile_rule(self, rule):
+        if isinstance(rule, dict):
+            builder = VALIDATION_RULE_TYPES.get(rule.get('type'))
+            return builder(rule) if builder else None
+        
+        text = normalize_validation_rule(rule)
+        for pattern, builder in VALIDATION_RULE_PATTERNS:
+            match = pattern.fullmatch(text)
+            if match:
+                return builder(match)
+        
+        return None
+    
+    def validate(self, filled_form):
+        errors = []
+        
+        for field, checks in self.fields:
+            value = filled_form.get(field['field_name'])
+            
+            # Check required fields
+            if field['required'] and not value:
+                errors.append(f"Required field missing: {field['label']}")
+                continue
+            
+            if not value:
+                continue
+            
+            # Validate field-specific rules
+            for check, message in checks:
+                try:
+                    passed = check(value)
+                except (ValueError, TypeError):
+                    passed = False
+                
+                if not passed:
+                    errors.append(f"{field['label']}: {message}")
+        
+        return errors
+
+
+def normalize_validation_rule(rule):
+    """
+    Free-text validation rule reduced to what it requires
+    
+    >>> normalize_validation_rule('Must be a valid phone number.')
+    'phone number'
+    >>> normalize_validation_rule('Maximum  50 characters')
+    'maximum 50 characters'
+    >>> normalize_validation_rule('valid phone number in 512 area code')
+    'phone number in 512 area code'
+    """
+    text = ' '.join(str(rule).lower().split()).rstrip('.')
+    return VALIDATION_RULE_PREFIX.sub('', text, count=1)
+
+
+def is_cross_field_rule(rule, other_names):
+    """Whether a validation rule relates its field to other fields"""
+    if isinstance(rule, dict):
+        if rule.get('field') or rule.get('fields'):
+            return True
+        rule = str(rule.get('message') or '')
+    
+    text = str(rule).lower()
+    return bool(CROSS_FIELD_RULE_PATTERN.search(text)) or any(
+        re.search(rf'\b{re.escape(name)}\b', text) for name in other_names
+    )
+
+
+# ============================================
+# COMPILED RULE ENGINE
+# ============================================
+
+# Classification attributes rules are indexed by, most selective first
+RULE_INDEX_ATTRIBUTES = [
+    'work_types',
+    'scope',
+    'project_category',
+    'involves_structural_changes',
+    'involves_utilities',
+    'involves_occupancy_change',
+    'fire_safety_concerns'
+]
+
+# Condition keys used in permit_requirements that name classification fields
+CONDITION_ALIASES = {
+    'structural_changes': 'involves_structural_changes',
+    'utilities': 'involves_utilities',
+    'occupancy_change': 'involves_occupancy_change'
+}
+
+COMPARISON_OPERATORS = {
+    '$eq': lambda a, b: a == b,
+    '$ne': lambda a, b: a != b,
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+    '$in': lambda a, b: bool(as_set(a) & set(b))
+}
+
+
+def compile_conditions(conditions):
+    """
+    Compile a rule's conditions JSON into a predicate over a classification
+    
+    Every top-level key must hold. Supports any_of/all_of groups, min_/max_
+    numeric bounds, comparison operators ({"$gte": 30}), list membership
+    (matches if any value overlaps) and plain equality.
+    """
+    tests = [compile_condition(key, expected) for key, expected in conditions.items()]
+    return lambda classification: all(test(classification) for test in tests)
+
+
+def compile_condition(key, expected):
+    if key == 'any_of':
+        predicates = [compile_conditions(c) for c in expected]
+        return lambda c: any(p(c) for p in predicates)
+    
+    if key == 'all_of':
+        predicates = [compile_conditions(c) for c in expected]
+        return lambda c: all(p(c) for p in predicates)
+    
+    if key.startswith('min_'):
+        attr = CONDITION_ALIASES.get(key[4:], key[4:])
+        return lambda c: c.get(attr) is not None and c[attr] >= expected
+    
+    if key.startswith('max_'):
+        attr = CONDITION_ALIASES.get(key[4:], key[4:])
+        return lambda c: c.get(attr) is not None and c[attr] <= expected
+    
+    attr = CONDITION_ALIASES.get(key, key)
+    
+    if isinstance(expected, dict):
+        checks = [(COMPARISON_OPERATORS[op], value) for op, value in expected.items()]
+        return lambda c: c.get(attr) is not None and all(
+            check(c[attr], value) for check, value in checks
+        )
+    
+    if isinstance(expected, list):
+        allowed = set(expected)
+        return lambda c: bool(as_set(c.get(attr)) & allowed)
+    
+    return lambda c: c.get(attr) == expected
+
+
+def as_set(value):
+    if value is None:
+        return set()
+    if isinstance(value, (list, tuple, set)):
+        return set(value)
+    return {value}
+
+
+class CompiledRuleSet:
+    """
+    A jurisdiction's rules compiled to predicates and indexed by attribute
+    
+    Each rule is filed under one indexable condition it requires (the
+    first of RULE_INDEX_ATTRIBUTES it tests at top level). Rules without
+    one are always candidates.
+    """
+    
+    def __init__(self, rules, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.rules = [(rule, compile_conditions(rule['conditions'])) for rule in rules]
+        self.index = {}  # (attribute, value) -> [rule positions]
+        self.unindexed = []
+        
+        for position, (rule, _) in enumerate(self.rules):
+            key = self.index_key(rule['conditions'])
+            if key is None:
+                self.unindexed.append(position)
+                continue
+            
+            attr, values = key
+            for value in values:
+                self.index.setdefault((attr, value), []).append(position)
+        
+        self.indexed_attributes = {attr for attr, _ in self.index}
+    
+    @functools.cached_property
+    def fee_schedule(self):
+        return FeeSchedule([rule for rule, _ in self.rules])
+    
+    def index_key(self, conditions):
+        tested = {CONDITION_ALIASES.get(k, k): v for k, v in conditions.items()}
+        
+        for attr in RULE_INDEX_ATTRIBUTES:
+            expected = tested.get(attr)
+            if expected is None or isinstance(expected, dict):
+                continue
+            return attr, as_set(expected)
+        
+        return None
+    
+    def candidates(self, classification):
+        """
+        Return (rule, predicate) pairs that could match, in rule order
+        """
+        positions = set(self.unindexed)
+        
+        for attr in self.indexed_attributes:
+            for value in as_set(classification.get(attr)):
+                positions.update(self.index.get((attr, value), ()))
+        
+        return [self.rules[p] for p in sorted(positions)]
+
+
+class RuleSetCache:
+    """
+    Compiled rule sets per jurisdiction
+    
+    A cached set is reused while the fingerprint of the jurisdiction's
+    permit_requirements rows (ids and updated_at) is unchanged, so edits
+    to the table recompile it on the next request. invalidate() drops
+    entries explicitly, e.g. from a change notification.
+    """
+    
+    def __init__(self):
+        self.rule_sets = {}
+    
+    def get(self, jurisdiction_id, rules):
+        fingerprint = hash(tuple(
+            (rule.get('id'), str(rule.get('updated_at'))) for rule in rules
+        ))
+        
+        rule_set = self.rule_sets.get(jurisdiction_id)
+        if rule_set is None or rule_set.fingerprint != fingerprint:
+            rule_set = CompiledRuleSet(rules, fingerprint)
+            if jurisdiction_id is not None:
+                self.rule_sets[jurisdiction_id] = rule_set
+        
+        return rule_set
+    
+    def invalidate(self, jurisdiction_id=None):
+        if jurisdiction_id is None:
+            self.rule_sets.clear()
+        else:
+            self.rule_sets.pop(jurisdiction_id, None)
+
+
+# ============================================
+# FEE AND TIMELINE ESTIMATION
+# ============================================
+
+# Fee tiers are searched on permit position * scale + valuation, so
+# valuations must stay below the scale
+FEE_TIER_KEY_SCALE = 1e12
+
+# Rate terms of free-text fee_calculation_formula values, e.g.
+# "$50 + $0.50 per sq ft" or "$25 + $6.50 per $1,000 of valuation"
+FEE_FORMULA_RATES = {
+    'per_sqft': re.compile(r'\$([\d,.]+)\s*per\s*(?:sq\.?\s*f(?:oo)?t|square\s+f(?:oo|ee)t)', re.I),
+    'per_1000_valuation': re.compile(r'\$([\d,.]+)\s*per\s*\$1,?000', re.I)
+}
+
+# Flat amounts left once rate terms are removed; amounts followed by
+# "per" (rates in units we don't model) are not flat fees
+FEE_FORMULA_BASE = re.compile(r'\$([\d,.]+)(?![\d,.]|\s*per\b)', re.I)
+
+
+class FeeSchedule:
+    """
+    A jurisdiction's fees and processing times as flat NumPy arrays
+    
+    Each permit type has one or more valuation tiers ({'min_valuation',
+    'base_fee', 'per_sqft', 'per_1000_valuation'}) taken from the rule's
+    fee_tiers, or a single tier parsed from base_fee and
+    fee_calculation_formula. All tiers sit in one array sorted by permit
+    position and minimum valuation, so the tier for any number of
+    (permit, valuation) pairs is found with one searchsorted call.
+    
+    Without NumPy the same schedule is evaluated permit by permit.
+    """
+    
+    def __init__(self, rules):
+        self.positions = {}  # permit_type -> position
+        self.tiers = {}  # permit_type -> sorted (min_valuation, base_fee, per_sqft, per_1000_valuation)
+        self.days = {}  # permit_type -> (min days, max days)
+        
+        # The first rule for a permit type defines its fees
+        for rule in rules:
+            if rule['permit_type'] in self.positions:
+                continue
+            
+            self.positions[rule['permit_type']] = len(self.positions)
+            self.tiers[rule['permit_type']] = sorted(rule_fee_tiers(rule))
+            self.days[rule['permit_type']] = (
+                rule.get('processing_time_min_days'),
+                rule.get('processing_time_max_days')
+            )
+        
+        if np is not None:
+            self.compile()
+    
+    def compile(self):
+        tiers = [
+            (self.positions[permit_type], *tier)
+            for permit_type, permit_tiers in self.tiers.items()
+            for tier in permit_tiers
+        ]
+        days = list(self.days.values())
+        
+        # A leading sentinel tier (position -1) catches searches for
+        # permit types without tiers, and a trailing NaN row answers
+        # position -1 (unknown permit types) in the day arrays
+        tiers = np.array(
+            [(-1, 0, np.nan, np.nan, np.nan)] + sorted(tiers), dtype=np.float64
+        ).reshape(-1, 5)
+        self.tier_positions = tiers[:, 0].astype(np.int64)
+        self.tier_keys = tiers[:, 0] * FEE_TIER_KEY_SCALE + tiers[:, 1]
+        self.tier_keys[0] = -np.inf
+        self.base_fees, self.per_sqft, self.per_1000_valuation = tiers[:, 2:].T
+        
+        days = np.array(days + [(None, None)], dtype=np.float64).reshape(-1, 2)
+        self.min_days, self.max_days = days.T
+    
+    def estimate(self, permit_types, square_footage, valuation):
+        """
+        Fees and min/max processing days for each permit type
+        
+        square_footage and valuation are scalars or one value per permit.
+        Returns three lists, with None where the schedule has no value.
+        """
+        if np is None:
+            return self.estimate_each(permit_types, square_footage, valuation)
+        
+        positions = np.array(
+            [self.positions.get(t, -1) for t in permit_types], dtype=np.int64
+        )
+        square_footage = np.broadcast_to(np.asarray(square_footage, np.float64), positions.shape)
+        valuation = np.clip(
+            np.broadcast_to(np.asarray(valuation, np.float64), positions.shape),
+            0, FEE_TIER_KEY_SCALE - 1
+        )
+        
+        tier = np.searchsorted(
+            self.tier_keys, positions * FEE_TIER_KEY_SCALE + valuation, side='right'
+        ) - 1
+        tier = np.where(self.tier_positions[tier] == positions, tier, 0)
+        
+        fees = (
+            self.base_fees[tier]
+            + self.per_sqft[tier] * square_footage
+            + self.per_1000_valuation[tier] * valuation / 1000
+        )
+        
+        return (
+            [None if np.isnan(fee) else round(float(fee), 2) for fee in fees],
+            [None if np.isnan(d) else int(d) for d in self.min_days[positions]],
+            [None if np.isnan(d) else int(d) for d in self.max_days[positions]]
+        )
+    
+    def estimate_each(self, permit_types, square_footage, valuation):
+        count = len(permit_types)
+        if not isinstance(square_footage, (list, tuple)):
+            square_footage = [square_footage] * count
+        if not isinstance(valuation, (list, tuple)):
+            valuation = [valuation] * count
+        
+        fees, min_days, max_days = [], [], []
+        for permit_type, area, value in zip(permit_types, square_footage, valuation):
+            tiers = self.tiers.get(permit_type, [])
+            position = -1
+            if area is not None and value is not None:
+                value = max(value, 0)
+                position = bisect.bisect_right([tier[0] for tier in tiers], value) - 1
+            
+            if position < 0:
+                fees.append(None)
+            else:
+                _, base_fee, per_sqft, per_1000_valuation = tiers[position]
+                fees.append(round(
+                    base_fee + per_sqft * area + per_1000_valuation * value / 1000, 2
+                ))
+            
+            low, high = self.days.get(permit_type, (None, None))
+            min_days.append(low)
+            max_days.append(high)
+        
+        return fees, min_days, max_days
+
+
+def rule_fee_tiers(rule):
+    """
+    (min_valuation, base_fee, per_sqft, per_1000_valuation) tiers of a rule
+    
+    >>> rule_fee_tiers({'fee_calculation_formula': '$50 + $0.50 per sq ft'})
+    [(0, 50.0, 0.5, 0)]
+    >>> rule_fee_tiers({'fee_calculation_formula': '$25 + $6.50 per $1,000 of valuation'})
+    [(0, 25.0, 0, 6.5)]
+    >>> rule_fee_tiers({'fee_calculation_formula': '$6.50 per $1000 of valuation'})
+    [(0, 0, 0, 6.5)]
+    >>> rule_fee_tiers({'fee_calculation_formula': '$40 + $5 per fixture'})
+    [(0, 40.0, 0, 0)]
+    """
+    if rule.get('fee_tiers'):
+        return [
+            (
+                tier.get('min_valuation', 0),
+                tier.get('base_fee', 0),
+                tier.get('per_sqft', 0),
+                tier.get('per_1000_valuation', 0)
+            )
+            for tier in rule['fee_tiers']
+        ]
+    
+    formula = rule.get('fee_calculation_formula') or ''
+    terms = {}
+    for name, pattern in FEE_FORMULA_RATES.items():
+        terms[name] = fee_amounts(pattern.findall(formula))
+        # "$1,000" in a per-valuation rate is not a flat fee
+        formula = pattern.sub(' ', formula)
+    
+    terms['base_fee'] = (
+        float(rule['base_fee']) if rule.get('base_fee') is not None
+        else fee_amounts(FEE_FORMULA_BASE.findall(formula))
+    )
+    
+    if not rule.get('fee_calculation_formula') and rule.get('base_fee') is None:
+        return []
+    
+    return [(0, terms['base_fee'], terms['per_sqft'], terms['per_1000_valuation'])]
+
+
+def fee_amounts(amounts):
+    """Sum of "$1,234.50"-style amounts; 0 (not 0.0) when there are none"""
+    return sum(float(amount.replace(',', '')) for amount in amounts)
+
+
+def format_processing_time(min_days, max_days):
+    """permits.processing_time text for a min/max range, either may be None"""
+    if min_days is not None and max_days is not None:
+        return f"{min_days}-{max_days} days"
+    if max_days is not None:
+        return f"up to {max_days} days"
+    if min_days is not None:
+        return f"{min_days}+ days"
+    return None
+
+
+def critical_path_timeline(workflow, permits):
+    """
+    Earliest completion of a workflow and the steps on its critical path
+    
+    Workflow steps are {'step', 'depends_on': [steps], ...}; a step with
+    a permit_type takes that permit's processing time, any other step
+    its duration_days. Finish times are computed in a single pass in
+    dependency order.
+    
+    Returns {'min_days', 'max_days', 'critical_path': [steps]}. A cyclic
+    workflow has no critical path; its permits are then assumed to run
+    in parallel and critical_path is None.
+    """
+    processing = {p['permit_type']: p.get('processing_time') or {} for p in permits}
+    steps = {step['step']: step for step in workflow}
+    finish = {}  # step -> (min days, max days, predecessor on the critical path)
+    
+    try:
+        order = list(graphlib.TopologicalSorter(
+            {step['step']: step.get('depends_on', []) for step in workflow}
+        ).static_order())
+    except graphlib.CycleError:
+        return {
+            'min_days': max((p.get('min_days') or 0 for p in processing.values()), default=0),
+            'max_days': max((p.get('max_days') or 0 for p in processing.values()), default=0),
+            'critical_path': None
+        }
+    
+    for step_id in order:
+        step = steps.get(step_id, {})
+        duration = processing.get(step.get('permit_type'))
+        if duration is None:
+            low = high = step.get('duration_days') or 0
+        else:
+            low, high = duration.get('min_days') or 0, duration.get('max_days') or 0
+        
+        depends_on = [d for d in step.get('depends_on', []) if d in finish]
+        critical = max(depends_on, key=lambda d: finish[d][1], default=None)
+        finish[step_id] = (
+            max((finish[d][0] for d in depends_on), default=0) + low,
+            (finish[critical][1] if critical is not None else 0) + high,
+            critical
+        )
+    
+    last = max(finish, key=lambda s: finish[s][1], default=None)
+    path = []
+    while last is not None:
+        path.append(last)
+        last = finish[last][2]
+    
+    return {
+        'min_days': max((f[0] for f in finish.values()), default=0),
+        'max_days': max((f[1] for f in finish.values()), default=0),
+        'critical_path': path[::-1]
+    }
+
+
+# ============================================
+# JURISDICTION RESOLUTION CACHE
+# ============================================
+
+# How long a geocoded address is reused, in seconds
+GEOCODE_CACHE_TTL = 24 * 3600
+
+GEOCODE_CACHE_MAX_ENTRIES = 50000
+
+
+class GeocodeCache:
+    """
+    In-process geocode memoization keyed on normalized address
+    """
+    
+    def __init__(self, ttl=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # normalized address -> (expires_at, result)
+    
+    def get(self, address):
+        key = normalize_address(address)
+        entry = self.entries.get(key)
+        
+        if not entry:
+            return None
+        
+        if entry[0] <= time.time():
+            del self.entries[key]
+            return None
+        
+        self.entries.move_to_end(key)
+        return entry[1]
+    
+    def set(self, address, geocode_result):
+        key = normalize_address(address)
+        self.entries[key] = (time.time() + self.ttl, geocode_result)
+        self.entries.move_to_end(key)
+        
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class JurisdictionIndex:
+    """
+    In-memory spatial index of jurisdiction boundaries
+    
+    Boundaries are loaded at startup into an STRtree over their bounding
+    boxes; a lookup queries the tree for candidates and then runs an exact
+    point-in-polygon test. refresh() re-reads only the boundaries updated
+    since the last load, drops deleted jurisdictions and swaps in a tree
+    rebuilt from the merged set; the refresh scheduler calls it every
+    JURISDICTION_INDEX_REFRESH_INTERVAL.
+    Needs shapely (see available); without it lookups go to PostGIS.
+    """
+    
+    def __init__(self, database):
+        self.db = database
+        self.authorities = {}  # id -> authority row
+        self.boundaries = {}  # id -> shapely geometry
+        self.ids = []
+        self.tree = None
+        self.loaded_at = None
+    
+    @property
+    def available(self):
+        return shapely is not None
+    
+    @property
+    def loaded(self):
+        return self.tree is not None
+    
+    async def load(self):
+        await self.refresh()
+    
+    async def refresh(self):
+        """
+        Bring the index up to date with the jurisdictions table
+        
+        Every row's authority is re-read, but only boundaries updated
+        since loaded_at (all of them on the first load) are transferred
+        and parsed. The tree is rebuilt only when a boundary changed.
+        Returns the number of boundaries added, changed or removed.
+        """
+        # Taken before the query, so rows updated while it runs are
+        # re-read next time rather than missed
+        started = datetime.now(timezone.utc)
+        
+        rows = await self.db.query(
+            "SELECT id, authority_level, authority_name, contact_info, website_url, "
+            "       boundary IS NOT NULL AS has_boundary, "
+            "       CASE WHEN $1::timestamptz IS NULL OR updated_at > $1 "
+            "            THEN ST_AsGeoJSON(boundary) END AS boundary "
+            "FROM jurisdictions",
+            self.loaded_at
+        )
+        
+        authorities, boundaries = {}, {}
+        changed = 0
+        for row in rows:
+            boundary = row.pop('boundary')
+            if not row.pop('has_boundary', boundary is not None):
+                continue
+            
+            if boundary is not None:
+                boundaries[row['id']] = shapely.geometry.shape(json.loads(boundary))
+                changed += 1
+            elif row['id'] in self.boundaries:
+                boundaries[row['id']] = self.boundaries[row['id']]
+            else:
+                continue
+            authorities[row['id']] = row
+        
+        changed += len(self.boundaries.keys() - boundaries.keys())
+        
+        # Swapped in together, so lookups never see a partial index
+        if changed or self.tree is None:
+            ids = list(boundaries.keys())
+            self.tree = shapely.STRtree([boundaries[i] for i in ids])
+            self.authorities, self.boundaries, self.ids = authorities, boundaries, ids
+        else:
+            self.authorities = authorities
+        self.loaded_at = started
+        return changed
+    
+    def lookup(self, lng, lat):
+        """
+        Return the permit authority whose boundary contains the point
+        
+        When several boundaries contain it (e.g. a city inside a county),
+        the smallest, most specific one is returned.
+        """
+        point = shapely.geometry.Point(lng, lat)
+        
+        matches = [
+            self.ids[i]
+            for i in self.tree.query(point)
+            if self.boundaries[self.ids[i]].contains(point)
+        ]
+        
+        if not matches:
+            return None
+        
+        best = min(matches, key=lambda i: self.boundaries[i].area)
+        return self.authorities[best]
+
+
+# ============================================
+# REGULATORY CONTEXT RETRIEVAL
+# ============================================
+
+REGULATORY_CONTEXT_TOP_K = 10
+
+# Retrieved regulatory context is re-fetched after this long, in seconds,
+# even without an ingest
+REGULATORY_CONTEXT_TTL = 6 * 3600
+
+REGULATORY_CONTEXT_MAX_ENTRIES = 5000
+
+# How often the shared ingest versions are re-read, in seconds
+REGULATORY_INGEST_CHECK_INTERVAL = 60
+
+# vector_ingest_versions scope of documents not tied to one jurisdiction
+GLOBAL_INGEST_SCOPE = '*'
+
+# Dimensions of the offline hashing embedder
+HASHING_EMBEDDER_DIMENSIONS = 512
+
+
+class RegulatoryContextCache:
+    """
+    Per-jurisdiction cache of regulatory text retrieved from the vector store
+    
+    An entry is used for up to ttl seconds, and only while the ingest
+    versions it was fetched under are current. Ingestion jobs, in any
+    process, bump the shared versions in vector_ingest_versions (see
+    record_regulatory_ingest), which are re-read every
+    REGULATORY_INGEST_CHECK_INTERVAL; a store with its own ingest
+    generation (LocalVectorIndex) invalidates entries immediately. The
+    least recently used entries beyond max_entries are dropped.
+    """
+    
+    def __init__(self, vector_store, database, top_k=REGULATORY_CONTEXT_TOP_K,
+                 ttl=REGULATORY_CONTEXT_TTL, max_entries=REGULATORY_CONTEXT_MAX_ENTRIES):
+        self.vector_store = vector_store
+        self.db = database
+        self.top_k = top_k
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (jurisdiction id, query) -> (expires_at, version, context)
+        self.ingest_versions = {}  # scope -> version
+        self.versions_checked_at = None
+    
+    async def get(self, jurisdiction):
+        key = (jurisdiction['permit_authority']['id'], regulatory_query(jurisdiction))
+        version = await self.version(key[0])
+        
+        entry = self.entries.get(key)
+        hit = entry is not None and entry[0] > time.time() and entry[1] == version
+        current_span().set_attribute('cache.hit', hit)
+        if hit:
+            self.entries.move_to_end(key)
+            return entry[2]
+        
+        context = await self.vector_store.search(query=key[1], top_k=self.top_k)
+        self.store(key, version, context)
+        return context
+    
+    async def warm(self, jurisdictions):
+        """
+        Precompute context for several jurisdictions, batching the
+        searches when the store supports it
+        """
+        keys = list({
+            (j['permit_authority']['id'], regulatory_query(j)) for j in jurisdictions
+        })
+        versions = [await self.version(jurisdiction_id) for jurisdiction_id, _ in keys]
+        
+        if hasattr(self.vector_store, 'search_many'):
+            contexts = await self.vector_store.search_many(
+                [query for _, query in keys], top_k=self.top_k
+            )
+        else:
+            contexts = await asyncio.gather(*(
+                self.vector_store.search(query=query, top_k=self.top_k)
+                for _, query in keys
+            ))
+        
+        for key, version, context in zip(keys, versions, contexts):
+            self.store(key, version, context)
+    
+    async def version(self, jurisdiction_id):
+        """
+        Ingest version of a jurisdiction's regulatory text: the store's
+        own generation and the shared global and per-jurisdiction versions
+        """
+        now = time.monotonic()
+        if (self.versions_checked_at is None
+                or now - self.versions_checked_at >= REGULATORY_INGEST_CHECK_INTERVAL):
+            # Set first, so concurrent lookups don't all re-read
+            self.versions_checked_at = now
+            rows = await self.db.query("SELECT scope, version FROM vector_ingest_versions")
+            self.ingest_versions = {row['scope']: row['version'] for row in rows}
+        
+        return (
+            getattr(self.vector_store, 'generation', None),
+            self.ingest_versions.get(GLOBAL_INGEST_SCOPE),
+            self.ingest_versions.get(str(jurisdiction_id))
+        )
+    
+    def store(self, key, version, context):
+        self.entries[key] = (time.time() + self.ttl, version, context)
+        self.entries.move_to_end(key)
+        
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+async def record_regulatory_ingest(database, jurisdiction_ids=None):
+    """
+    Bump the ingest version of jurisdictions whose regulatory documents
+    were ingested into the vector store, or the global version for
+    documents not tied to one jurisdiction
+    
+    Called by ingestion jobs; every process's RegulatoryContextCache
+    stops serving context fetched before the ingest within
+    REGULATORY_INGEST_CHECK_INTERVAL.
+    """
+    scopes = [str(i) for i in jurisdiction_ids] if jurisdiction_ids else [GLOBAL_INGEST_SCOPE]
+    
+    await database.execute(
+        "INSERT INTO vector_ingest_versions (scope, version) "
+        "SELECT scope, 1 FROM unnest($1::text[]) AS scope "
+        "ON CONFLICT (scope) DO UPDATE SET "
+        "  version = vector_ingest_versions.version + 1, "
+        "  updated_at = NOW()",
+        scopes
+    )
+
+
+class LocalVectorIndex:
+    """
+    In-process embedding index with the VectorDatabase search interface
+    
+    Embeddings are kept L2-normalized in one NumPy matrix, so cosine
+    similarity for a batch of queries is a single matrix product followed
+    by a partial sort. generation increases on every ingest.
+    """
+    
+    def __init__(self, embedder, dimensions=None):
+        self.embedder = embedder
+        self.documents = []
+        self.matrix = np.zeros((0, dimensions or embedder.dimensions), dtype=np.float32)
+        self.generation = 0
+    
+    async def ingest(self, documents):
+        """
+        Add documents ({'text', ...metadata}) to the index
+        """
+        embeddings = await self.embedder.embed([doc['text'] for doc in documents])
+        self.matrix = np.vstack([self.matrix, normalize_rows(embeddings)])
+        self.documents.extend(documents)
+        self.generation += 1
+    
+    async def search(self, query, top_k=10):
+        return (await self.search_many([query], top_k))[0]
+    
+    async def search_many(self, queries, top_k=10):
+        """
+        Top-k documents by cosine similarity for each query
+        """
+        if not self.documents:
+            return [[] for _ in queries]
+        
+        vectors = normalize_rows(await self.embedder.embed(queries))
+        return [
+            [
+                {**self.documents[i], 'score': float(row[i])}
+                for i in top_k_indices(row, top_k)
+            ]
+            for row in vectors @ self.matrix.T
+        ]
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder for offline use and tests
+    
+    Tokens are hashed into a fixed number of buckets, so no model or
+    network access is needed.
+    """
+    
+    def __init__(self, dimensions=HASHING_EMBEDDER_DIMENSIONS):
+        self.dimensions = dimensions
+    
+    async def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        
+        for row, text in enumerate(texts):
+            for token in re.findall(r'[a-z0-9]+', text.lower()):
+                digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+                matrix[row, int.from_bytes(digest, 'little') % self.dimensions] += 1.0
+        
+        return matrix
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+# ============================================
+# CLASSIFICATION REUSE
+# ============================================
+
+# Cosine similarity at or above which a past classification is reused
+CLASSIFICATION_REUSE_THRESHOLD = 0.92
+
+# Past classifications kept; the least recently used is evicted first
+CLASSIFICATION_INDEX_SIZE = 10000
+
+# Fields that must match for a verified reuse to count as agreeing
+CLASSIFICATION_VERIFIED_FIELDS = (
+    'project_category', 'work_types', 'scope', 'involves_utilities',
+    'involves_structural_changes', 'involves_occupancy_change',
+    'fire_safety_concerns', 'risk_level'
+)
+
+# Classification fields that come from a project's own numbers; a reuse
+# between projects whose numbers differ re-derives them
+CLASSIFICATION_NUMERIC_FIELDS = ('square_footage', 'stories')
+
+NUMBER_TOKEN = re.compile(r'\d+(?:[.,]\d+)*')
+SQUARE_FEET_PATTERN = re.compile(
+    r'(\d[\d,]*(?:\.\d+)?)\s*(?:sq\.?\s*f(?:oo)?t|square\s+f(?:oo|ee)t)', re.I
+)
+STORIES_PATTERN = re.compile(r'(\d+)[\s-]*(?:stor(?:y|ies|eys?)|floors?)\b', re.I)
+
+
+class ClassificationIndex:
+    """
+    Embedding index of past project descriptions and their classifications
+    
+    Near-identical projects ("12x16 deck attached, 2 ft high") miss the
+    exact-prompt LLM cache, so classification looks here first. A stored
+    classification is reused for a project with the same project_type
+    and details keys whose description embedding has at least the
+    threshold cosine similarity. Only classifications that passed schema
+    validation are stored.
+    
+    Embeddings barely separate "12x16 deck" from "30x40 deck", so the
+    numbers in the two projects must also match for a full reuse. When
+    they differ only the categorical fields are reused: square_footage
+    and stories are re-derived from the new project, and if one of them
+    came from the stored project's numbers but can't be read off the new
+    one, the lookup is a miss.
+    
+    Embeddings live in one preallocated NumPy matrix, so a batch of
+    lookups is one matrix product; when it is full the least recently
+    used slot is overwritten. With verify_rate > 0, that share of matches
+    is marked 'verify': the caller classifies with the LLM anyway and
+    record() counts any disagreement and replaces the stored entry.
+    """
+    
+    def __init__(self, embedder, threshold=CLASSIFICATION_REUSE_THRESHOLD,
+                 max_entries=CLASSIFICATION_INDEX_SIZE, verify_rate=0.0):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.verify_rate = verify_rate
+        self.matrix = np.zeros((max_entries, embedder.dimensions), dtype=np.float32)
+        self.signatures = np.full(max_entries, -1, dtype=np.int64)  # -1 for free slots
+        self.last_used = np.zeros(max_entries, dtype=np.int64)
+        self.classifications = [None] * max_entries
+        self.numbers = [None] * max_entries  # (number tokens, derived numeric fields)
+        self.signature_ids = {}  # (project_type, details keys) -> id
+        self.clock = 0
+        self.metrics = {
+            'lookups': 0, 'hits': 0, 'partial_hits': 0, 'number_misses': 0,
+            'verified': 0, 'disagreements': 0
+        }
+    
+    async def lookup_many(self, projects):
+        """
+        Best match for each project, or None below the threshold
+        
+        A match is {'classification': copy, 'similarity', 'slot',
+        'partial', 'verify'}; partial matches had their numeric fields
+        re-derived.
+        """
+        vectors = normalize_rows(
+            await self.embedder.embed([similarity_text(p) for p in projects])
+        )
+        # Unknown signatures get -2, which matches no slot
+        signatures = np.array([
+            self.signature_ids.get(project_signature(p), -2) for p in projects
+        ])
+        
+        scores = vectors @ self.matrix.T
+        scores[signatures[:, None] != self.signatures[None, :]] = -np.inf
+        best = scores.argmax(axis=1)
+        
+        matches = []
+        for row, slot in enumerate(best):
+            self.metrics['lookups'] += 1
+            if scores[row, slot] < self.threshold:
+                matches.append(None)
+                continue
+            
+            classification = copy.deepcopy(self.classifications[slot])
+            tokens, stored_fields = self.numbers[slot]
+            partial = number_tokens(projects[row]) != tokens
+            
+            if partial and not rederive_numeric_fields(
+                classification, projects[row], stored_fields
+            ):
+                self.metrics['number_misses'] += 1
+                matches.append(None)
+                continue
+            
+            self.metrics['hits'] += 1
+            self.metrics['partial_hits'] += partial
+            self.touch(slot)
+            matches.append({
+                'classification': classification,
+                'similarity': float(scores[row, slot]),
+                'slot': int(slot),
+                'partial': partial,
+                'verify': random.random() < self.verify_rate
+            })
+        
+        return matches
+    
+    async def record(self, project, classification, match=None):
+        """
+        Store an LLM classification, or, for a match sampled for
+        verification, compare the two and replace the stored one if they
+        disagree
+        """
+        if match is not None:
+            self.metrics['verified'] += 1
+            if classifications_agree(match['classification'], classification):
+                return
+            
+            self.metrics['disagreements'] += 1
+            self.signatures[match['slot']] = -1
+            self.last_used[match['slot']] = 0
+        
+        vector = normalize_rows(await self.embedder.embed([similarity_text(project)]))[0]
+        signature = self.signature_ids.setdefault(
+            project_signature(project), len(self.signature_ids)
+        )
+        
+        # Free slots have last_used 0, so they are taken first
+        slot = int(self.last_used.argmin())
+        self.matrix[slot] = vector
+        self.signatures[slot] = signature
+        self.classifications[slot] = copy.deepcopy(classification)
+        self.numbers[slot] = (number_tokens(project), derived_numeric_fields(project))
+        self.touch(slot)
+    
+    def touch(self, slot):
+        self.clock += 1
+        self.last_used[slot] = self.clock
+    
+    def report(self):
+        """metrics plus hit and disagreement rates"""
+        lookups = self.metrics['lookups']
+        verified = self.metrics['verified']
+        return {
+            **self.metrics,
+            'hit_rate': self.metrics['hits'] / lookups if lookups else None,
+            'disagreement_rate': (
+                self.metrics['disagreements'] / verified if verified else None
+            )
+        }
+
+
+def similarity_text(project):
+    """Text embedded for classification reuse"""
+    return f"{project['description']} {compact_json(project.get('details', {}))}"
+
+
+def project_signature(project):
+    """Reuse is only considered between projects with equal signatures"""
+    return (
+        project.get('project_type', 'unknown'),
+        tuple(sorted(project.get('details', {})))
+    )
+
+
+def number_tokens(project):
+    """Numbers in a project's description and details, order-insensitive"""
+    return tuple(sorted(NUMBER_TOKEN.findall(similarity_text(project))))
+
+
+def derived_numeric_fields(project):
+    """
+    square_footage and stories read directly off a project, where it
+    states them
+    
+    >>> derived_numeric_fields({'description': 'Build a 30x40 foot deck'})
+    {'square_footage': 1200, 'stories': None}
+    >>> derived_numeric_fields({'description': 'Add a 2-story, 850 sq ft addition'})
+    {'square_footage': 850, 'stories': 2}
+    """
+    details = project.get('details') or {}
+    description = project['description']
+    
+    square_footage = None
+    if details.get('square_footage') is not None:
+        square_footage = parse_square_feet(details['square_footage'])
+    elif DIMENSIONS_PATTERN.search(description):
+        square_footage = parse_square_feet(DIMENSIONS_PATTERN.search(description)[0])
+    elif SQUARE_FEET_PATTERN.search(description):
+        square_footage = parse_square_feet(SQUARE_FEET_PATTERN.search(description)[1])
+    
+    stories = details.get('stories')
+    if stories is None and STORIES_PATTERN.search(description):
+        stories = int(STORIES_PATTERN.search(description)[1])
+    
+    return {'square_footage': square_footage, 'stories': stories}
+
+
+def rederive_numeric_fields(classification, project, stored_fields):
+    """
+    Replace a reused classification's numeric fields with the new
+    project's own values; False if a field the stored project stated
+    can't be read off the new one
+    """
+    derived = derived_numeric_fields(project)
+    
+    for field in CLASSIFICATION_NUMERIC_FIELDS:
+        if derived[field] is not None:
+            classification[field] = derived[field]
+        elif stored_fields[field] is not None:
+            return False
+    
+    return True
+
+
+def classifications_agree(reused, fresh):
+    for field in CLASSIFICATION_VERIFIED_FIELDS:
+        a, b = reused.get(field), fresh.get(field)
+        if isinstance(a, list) and isinstance(b, list):
+            a, b = sorted(map(str, a)), sorted(map(str, b))
+        if a != b:
+            return False
+    return True
+
+
+# ============================================
+# FORM EXTRACTION
+# ============================================
+
+# Worker processes for PDF parsing and OCR; None means one per core
+EXTRACTION_WORKERS = None
+
+# Form store: where scraped PDF and scanned documents are kept, by content
+# hash, for memory-mapped extraction and for form_templates rows to
+# reference; processes sharing a database should share it
+FORM_DOCUMENT_DIR = os.environ.get('FORM_DOCUMENT_DIR') or os.path.join(
+    tempfile.gettempdir(), 'permitpro-forms'
+)
+
+# Mean OCR word confidence (0-1) of a scanned form's fields below which
+# its fields are extracted with LLM vision instead; no fields counts as 0
+OCR_MIN_CONFIDENCE = 0.6
+
+# AcroForm field types (/FT) to form field types
+PDF_FIELD_TYPES = {
+    '/Tx': 'text',
+    '/Btn': 'checkbox',
+    '/Ch': 'choice',
+    '/Sig': 'signature'
+}
+
+# AcroForm field flag (/Ff) bit marking a field required
+PDF_FIELD_REQUIRED = 2
+
+# Printed labels followed by a blank or a checkbox on a scanned form,
+# e.g. "Owner Name: ________" or "Attached [ ]"
+OCR_FIELD_PATTERN = re.compile(
+    r"([A-Za-z][A-Za-z0-9 #/&().'-]{1,60}?)\s*:?\s*(_{3,}|\[\s*\])"
+)
+
+
+class FormExtractor:
+    """
+    Field extraction for PDF and scanned forms in a process pool
+    
+    Parsing and OCR are CPU-bound, so every page of a document is its own
+    task in a worker process: a 40-page packet spreads across all cores
+    while the event loop only awaits results. Workers memory-map the
+    document from disk rather than being sent its bytes. The pool is
+    started by the first extraction.
+    
+    pypdf and pytesseract are optional; without them extract_form raises
+    FormExtractionError and parse_form_structure falls back to the
+    engine's own PDF field reader or to LLM vision.
+    """
+    
+    def __init__(self, workers=EXTRACTION_WORKERS, document_dir=FORM_DOCUMENT_DIR):
+        self.workers = workers
+        self.pool = None
+        self.document_dir = document_dir
+    
+    async def extract_form(self, form):
+        """
+        Fields of a PDF or scanned form, merged across its pages
+        
+        Scanned-form fields carry the OCR confidence of their line.
+        Raises FormExtractionError if the backend for the form's type is
+        not installed.
+        """
+        if form['type'] == 'pdf':
+            require_pdf_backend()
+            extract_page = pdf_page_fields
+        else:
+            require_ocr_backend()
+            extract_page = ocr_page_fields
+        
+        path = await self.document_path(form)
+        loop = asyncio.get_running_loop()
+        pool = self.executor()
+        
+        page_count = await loop.run_in_executor(pool, document_page_count, path)
+        pages = await asyncio.gather(*(
+            loop.run_in_executor(pool, extract_page, path, page_number)
+            for page_number in range(page_count)
+        ))
+        
+        current_span().set_attributes({'form.pages': page_count})
+        return merge_page_fields(pages)
+    
+    async def document_path(self, form):
+        """
+        Path of the form's document on disk
+        
+        Scrapers that stream documents to disk set form['document_path'];
+        content held in memory is written out once per content hash.
+        """
+        if form.get('document_path'):
+            return form['document_path']
+        
+        path = os.path.join(self.document_dir, form_content_hash(form['content']))
+        if not os.path.exists(path):
+            await asyncio.to_thread(write_document, path, form['content'])
+        
+        return path
+    
+    def executor(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        return self.pool
+    
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+class FormExtractionError(Exception):
+    """A form's document can't be extracted, e.g. its backend is missing"""
+
+
+def require_pdf_backend():
+    if pypdf is None:
+        raise FormExtractionError("PDF form extraction needs pypdf, which is not installed")
+
+
+def require_ocr_backend():
+    if pytesseract is None:
+        raise FormExtractionError(
+            "Scanned form extraction needs Pillow and pytesseract, which are not installed"
+        )
+
+
+def ocr_confidence(fields):
+    """Mean OCR confidence of extracted fields, 0 if there are none"""
+    if not fields:
+        return 0
+    return sum(field.get('ocr_confidence', 1) for field in fields) / len(fields)
+
+
+def merge_page_fields(pages):
+    """
+    One field list from per-page results, in page order
+    
+    A field found on several pages (an AcroForm field with a widget on
+    each, or a header repeated on every page) is kept once, at the first.
+    """
+    fields = {}
+    for page_number, page_fields in enumerate(pages, 1):
+        for field in page_fields:
+            fields.setdefault(field['field_name'], {**field, 'page': page_number})
+    
+    return list(fields.values())
+
+
+def write_document(path, content):
+    """Write a document atomically, so no worker maps a partial file"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, path)
+
+
+@contextlib.contextmanager
+def mapped_document(path):
+    """Read-only memory map of a document, shared through the page cache"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def is_pdf(data):
+    return data[:5] == b'%PDF-'
+
+
+# The functions below run in worker processes
+
+def document_page_count(path):
+    with mapped_document(path) as data:
+        if is_pdf(data):
+            require_pdf_backend()
+            return len(pypdf.PdfReader(data).pages)
+        
+        with PIL.Image.open(data) as image:
+            return getattr(image, 'n_frames', 1)
+
+
+def pdf_page_fields(path, page_number):
+    """
+    AcroForm fields with a widget on one page of a fillable PDF
+    
+    pypdf resolves objects lazily, so only this page's objects are read
+    from the mapping.
+    """
+    with mapped_document(path) as data:
+        page = pypdf.PdfReader(data).pages[page_number]
+        fields = []
+        
+        for annotation in page.get('/Annots') or []:
+            widget = annotation.get_object()
+            if widget.get('/Subtype') != '/Widget':
+                continue
+            
+            # Widgets of a multi-widget field carry its name on the parent
+            parent = widget.get('/Parent')
+            field = parent.get_object() if '/T' not in widget and parent else widget
+            if not field.get('/T'):
+                continue
+            
+            fields.append({
+                'field_name': str(field['/T']),
+                'field_type': PDF_FIELD_TYPES.get(field.get('/FT'), 'text'),
+                'label': str(field.get('/TU') or field['/T']),
+                'required': bool(int(field.get('/Ff', 0)) & PDF_FIELD_REQUIRED)
+            })
+    
+    return fields
+
+
+def ocr_page_fields(path, page_number):
+    """
+    Labelled blanks and checkboxes OCR finds on one page of a scanned form,
+    each with the mean word confidence (0-1) of its line
+    """
+    with mapped_document(path) as data:
+        image = page_image(data, page_number)
+        if image is None:
+            return []
+        words = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    
+    lines = {}  # (block, paragraph, line) -> [(word, confidence)]
+    for i, word in enumerate(words['text']):
+        if word.strip():
+            key = (words['block_num'][i], words['par_num'][i], words['line_num'][i])
+            lines.setdefault(key, []).append((word, float(words['conf'][i])))
+    
+    return [
+        {
+            'field_name': re.sub(r'\W+', '_', label.lower()).strip('_'),
+            'field_type': 'text' if marker.startswith('_') else 'checkbox',
+            'label': label.strip(),
+            'ocr_confidence': round(sum(c for _, c in line) / len(line) / 100, 2)
+        }
+        for line in lines.values()
+        for label, marker in OCR_FIELD_PATTERN.findall(' '.join(w for w, _ in line))
+    ]
+
+
+def page_image(data, page_number):
+    """Image of one page of a scanned PDF or multi-page image"""
+    if is_pdf(data):
+        require_pdf_backend()
+        # Scanned PDFs carry the page as one embedded image
+        images = [image.image for image in pypdf.PdfReader(data).pages[page_number].images]
+        return max(images, key=lambda image: image.width * image.height, default=None)
+    
+    image = PIL.Image.open(data)
+    image.seek(page_number)
+    image.load()
+    return image
+
+
+# ============================================
+# BACKGROUND REFRESH
+# ============================================
+
+# Age at which stored form templates and scraped rules expire, in seconds
+SCRAPED_CONTENT_TTL = 30 * 24 * 3600
+
+# Content is refreshed this long before it expires
+REFRESH_AHEAD = 7 * 24 * 3600
+
+# While the scheduler runs, expired content is still served up to this age
+MAX_STALENESS = 90 * 24 * 3600
+
+REFRESH_WORKERS = 4
+
+# Seconds between sweeps for content due for refresh
+REFRESH_SWEEP_INTERVAL = 600
+
+# Seconds between rebuilds of a loaded jurisdiction boundary index
+JURISDICTION_INDEX_REFRESH_INTERVAL = 3600
+
+# Minimum gap between background requests to the same municipal host
+REFRESH_HOST_DELAY = 5.0
+
+# Popularity is multiplied by the decay every sweep; entries that fall
+# below the minimum are no longer kept warm
+REFRESH_POPULARITY_DECAY = 0.95
+REFRESH_MIN_POPULARITY = 0.05
+
+
+class RefreshScheduler:
+    """
+    Keeps scraped form templates and jurisdiction rules warm
+    
+    Live requests report what they used and how old it was. Anything
+    within REFRESH_AHEAD of expiry is queued for a background re-scrape,
+    most requested first, and a periodic sweep picks up entries nobody has
+    asked for since they became due. While the scheduler runs, expired
+    content is served as-is (stale-while-revalidate) up to MAX_STALENESS,
+    so requests for popular jurisdictions don't wait on a scrape.
+    
+    Refreshes run on `workers` tasks in the batch lane, with at most one
+    background request in flight per municipal host and REFRESH_HOST_DELAY
+    between them. A loaded JurisdictionIndex is also rebuilt every
+    JURISDICTION_INDEX_REFRESH_INTERVAL.
+    """
+    
+    def __init__(self, engine, workers=REFRESH_WORKERS, interval=REFRESH_SWEEP_INTERVAL):
+        self.engine = engine
+        self.workers = workers
+        self.interval = interval
+        self.popularity = {}  # key -> decayed request count
+        self.targets = {}  # key -> (kind, permit, jurisdiction)
+        self.stored_at = {}  # key -> epoch seconds the stored copy was scraped
+        self.queue = []  # heap of (-popularity, sequence, key)
+        self.queued = set()
+        self.host_ready = {}  # host -> monotonic time it may be scraped again
+        self.wakeup = asyncio.Event()
+        self.sequence = itertools.count()
+        self.tasks = []
+        self.metrics = {
+            'refreshed': 0, 'failed': 0,
+            'index_refreshes': 0, 'index_boundaries_changed': 0, 'index_failures': 0
+        }
+    
+    @property
+    def running(self):
+        return bool(self.tasks)
+    
+    def start(self):
+        engine = self.engine.with_budget(self.engine.batch_budget, priority='batch')
+        self.tasks = [
+            asyncio.create_task(self.sweep_loop()),
+            asyncio.create_task(self.index_loop())
+        ] + [
+            asyncio.create_task(self.worker(engine)) for _ in range(self.workers)
+        ]
+    
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+    
+    def usable(self, age):
+        """
+        Whether stored content `age` seconds old may be served
+        
+        None means the content is curated rather than scraped, and never
+        expires.
+        """
+        if age is None:
+            return True
+        return age < SCRAPED_CONTENT_TTL or (self.running and age < MAX_STALENESS)
+    
+    def record_form(self, permit, jurisdiction, age):
+        key = ('form', jurisdiction['permit_authority']['id'], permit['permit_type'])
+        self.record(key, ('form', permit, jurisdiction), age)
+    
+    def record_rules(self, jurisdiction, age):
+        key = ('rules', jurisdiction['permit_authority']['id'])
+        self.record(key, ('rules', None, jurisdiction), age)
+    
+    def record(self, key, target, age):
+        self.popularity[key] = self.popularity.get(key, 0) + 1
+        self.targets[key] = target
+        self.stored_at[key] = time.time() - age
+        
+        if age >= SCRAPED_CONTENT_TTL - REFRESH_AHEAD:
+            self.request(key)
+    
+    def request(self, key):
+        if key in self.queued:
+            return
+        
+        self.queued.add(key)
+        heapq.heappush(
+            self.queue, (-self.popularity.get(key, 0), next(self.sequence), key)
+        )
+        self.wakeup.set()
+    
+    def sweep(self):
+        now = time.time()
+        
+        for key in list(self.popularity):
+            self.popularity[key] *= REFRESH_POPULARITY_DECAY
+            
+            if self.popularity[key] < REFRESH_MIN_POPULARITY and key not in self.queued:
+                del self.popularity[key]
+                del self.targets[key]
+                del self.stored_at[key]
+            elif now - self.stored_at[key] >= SCRAPED_CONTENT_TTL - REFRESH_AHEAD:
+                self.request(key)
+    
+    async def sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sweep()
+    
+    async def index_loop(self):
+        index = self.engine.jurisdiction_index
+        while True:
+            await asyncio.sleep(JURISDICTION_INDEX_REFRESH_INTERVAL)
+            if not index.loaded:
+                continue
+            
+            # A failed refresh keeps serving the previous index
+            try:
+                changed = await index.refresh()
+                self.metrics['index_refreshes'] += 1
+                self.metrics['index_boundaries_changed'] += changed
+            except Exception:
+                self.metrics['index_failures'] += 1
+    
+    async def next_key(self):
+        """
+        Most popular queued key whose host may be scraped now
+        """
+        while True:
+            now = time.monotonic()
+            deferred = []
+            key = None
+            
+            while self.queue:
+                entry = heapq.heappop(self.queue)
+                if self.host_ready.get(self.host(entry[2]), 0) <= now:
+                    key = entry[2]
+                    break
+                deferred.append(entry)
+            
+            for entry in deferred:
+                heapq.heappush(self.queue, entry)
+            
+            if key is not None:
+                return key
+            
+            # Sleep until a host frees up or new work arrives
+            ready_at = min(
+                (self.host_ready[self.host(entry[2])] for entry in deferred),
+                default=float('inf')
+            )
+            timeout = ready_at - now if ready_at != float('inf') else None
+            
+            # asyncio.wait rather than wait_for, which can swallow a
+            # cancellation that races with the wakeup and keep stop() waiting
+            self.wakeup.clear()
+            waiter = asyncio.ensure_future(self.wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=timeout)
+            finally:
+                waiter.cancel()
+    
+    async def worker(self, engine):
+        while True:
+            key = await self.next_key()
+            host = self.host(key)
+            kind, permit, jurisdiction = self.targets[key]
+            
+            # Busy until this refresh finishes
+            self.host_ready[host] = float('inf')
+            try:
+                if kind == 'form':
+                    await engine.refresh_form(permit, jurisdiction)
+                else:
+                    await engine.refresh_rules(jurisdiction)
+                self.stored_at[key] = time.time()
+                self.metrics['refreshed'] += 1
+            except Exception:
+                # Still due, so the next sweep retries it
+                self.metrics['failed'] += 1
+            finally:
+                self.queued.discard(key)
+                self.host_ready[host] = time.monotonic() + REFRESH_HOST_DELAY
+                self.wakeup.set()
+    
+    def host(self, key):
+        return scrape_host(self.targets[key][2])
+
+
+# ============================================
+# SINGLE-FLIGHT
+# ============================================
+
+class SingleFlight:
+    """
+    Shares one in-flight call among concurrent callers with the same key
+    
+    The first caller for a key starts the work; callers arriving before it
+    finishes wait for the same result (or exception). Nothing is kept once
+    the call completes, so this complements the caches rather than
+    replacing them. The work only stops early if every caller waiting on
+    it is cancelled. Results are shared, so callers must not mutate them.
+    
+    With a lock (see AdvisoryLock), calls made with cross_process=True also
+    hold a lock on the key across processes while they run. Work run that
+    way should first re-check shared storage, since another process may
+    have just done it.
+    """
+    
+    def __init__(self, lock=None):
+        self.lock = lock
+        self.calls = {}  # key -> [task, waiting callers]
+        self.metrics = {'started': 0, 'shared': 0}
+    
+    async def do(self, key, func, cross_process=False):
+        call = self.calls.get(key)
+        
+        if call is None:
+            self.metrics['started'] += 1
+            task = asyncio.ensure_future(self.run(key, func, cross_process))
+            call = self.calls[key] = [task, 0]
+        else:
+            self.metrics['shared'] += 1
+        current_span().set_attribute('single_flight.shared', call[1] > 0)
+        
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                # Nobody is waiting any more; a later caller starts afresh
+                call[0].cancel()
+                self.forget(key, call[0])
+    
+    async def run(self, key, func, cross_process):
+        try:
+            if cross_process and self.lock:
+                async with self.lock.hold(key):
+                    return await func()
+            return await func()
+        finally:
+            self.forget(key, asyncio.current_task())
+    
+    def forget(self, key, task):
+        call = self.calls.get(key)
+        if call and call[0] is task:
+            del self.calls[key]
+
+
+class AdvisoryLock:
+    """
+    Cross-process lock on a key, backed by a Postgres advisory lock
+    
+    The lock is held on a dedicated connection, so it is released if the
+    holding process dies.
+    """
+    
+    def __init__(self, database, namespace='permit_engine'):
+        self.db = database
+        self.namespace = namespace
+    
+    def lock_id(self, key):
+        digest = hashlib.sha256(f"{self.namespace}:{key!r}".encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big', signed=True)
+    
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        lock_id = self.lock_id(key)
+        
+        async with self.db.connection() as connection:
+            await connection.execute("SELECT pg_advisory_lock($1)", lock_id)
+            try:
+                yield
+            finally:
+                await connection.execute("SELECT pg_advisory_unlock($1)", lock_id)
+
+
+# ============================================
+# CONCURRENCY BUDGET
+# ============================================
+
+# Global in-flight limits for batch discovery, per external service
+BATCH_CONCURRENCY_LIMITS = {
+    'llm': 8,
+    'geocoder': 10,
+    'db': 20
+}
+
+
+class ConcurrencyBudget:
+    """
+    Named concurrency limits shared by every client wrapped with them
+    """
+    
+    def __init__(self, limits):
+        self.semaphores = {
+            name: asyncio.Semaphore(limit) for name, limit in limits.items()
+        }
+    
+    def wrap(self, name, client):
+        return LimitedClient(client, self.semaphores[name])
+
+
+class LimitedClient:
+    """
+    Proxy that runs a client's coroutine methods under a semaphore
+    """
+    
+    def __init__(self, client, semaphore):
+        self.client = client
+        self.semaphore = semaphore
+    
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        
+        async def limited(*args, **kwargs):
+            async with self.semaphore:
+                return await attr(*args, **kwargs)
+        
+        return limited
+
+
+class PriorityLane:
+    """
+    Proxy that tags every LLM call made through it with a priority lane
+    
+    Only clients that declare supports_priority (directly or through the
+    clients they wrap) are passed a priority; calls to any other client go
+    through unchanged.
+    """
+    
+    def __init__(self, client, priority):
+        self.client = client
+        self.priority = priority
+    
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+    
+    async def generate(self, prompt, **kwargs):
+        if getattr(self.client, 'supports_priority', False):
+            kwargs.setdefault('priority', self.priority)
+        return await self.client.generate(prompt=prompt, **kwargs)
+
+
+# ============================================
+# RESILIENT LLM CLIENT
+# ============================================
+
+# Provider limits, per minute
+LLM_REQUESTS_PER_MINUTE = 1000
+LLM_TOKENS_PER_MINUTE = 400000
+
+# Adaptive concurrency bounds and the latency above which it backs off
+LLM_MIN_CONCURRENCY = 2
+LLM_MAX_CONCURRENCY = 64
+LLM_INITIAL_CONCURRENCY = 16
+LLM_TARGET_LATENCY = 20.0
+
+LLM_MAX_RETRIES = 4
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_CAP = 20.0
+LLM_DEFAULT_TIMEOUT = 60.0
+LLM_DEFAULT_MAX_TOKENS = 1024
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504, 529}
+
+# Lower rank is served first
+PRIORITY_LANES = {
+    'interactive': 0,
+    'batch': 1
+}
+
+
+class LLMHTTPError(Exception):
+    """Error response from the LLM provider"""
+    
+    def __init__(self, status, message='', retry_after=None):
+        super().__init__(f"LLM request failed with HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LLMDeadlineExceeded(Exception):
+    """The call's deadline passed before a successful response"""
+
+
+class PooledLLMTransport:
+    """
+    Anthropic Messages API client over a pooled HTTP connection
+    
+    base_url can point at a local fake server for tests and benchmarks.
+    """
+    
+    def __init__(self, api_key, model, base_url='https://api.anthropic.com',
+                 max_connections=LLM_MAX_CONCURRENCY):
+        self.model = model
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={
+                'x-api-key': api_key,
+                'anthropic-version': '2023-06-01'
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            timeout=None  # deadlines are enforced by ResilientLLMClient
+        )
+    
+    async def generate(self, prompt, response_format=None, model=None,
+                       max_tokens=LLM_DEFAULT_MAX_TOKENS):
+        payload = {
+            'model': model or self.model,
+            'max_tokens': max_tokens,
+            'messages': [{'role': 'user', 'content': prompt}]
+        }
+        if response_format == 'json':
+            payload['system'] = 'Respond with valid JSON only.'
+        
+        response = await self.http.post('/v1/messages', json=payload)
+        
+        if response.status_code >= 400:
+            retry_after = response.headers.get('retry-after')
+            raise LLMHTTPError(
+                response.status_code,
+                response.text,
+                float(retry_after) if retry_after else None
+            )
+        
+        body = response.json()
+        
+        usage = body.get('usage', {})
+        current_span().set_attributes({
+            'llm.model': body.get('model', payload['model']),
+            'llm.prompt_tokens': usage.get('input_tokens', 0),
+            'llm.completion_tokens': usage.get('output_tokens', 0)
+        })
+        
+        return ''.join(
+            block['text'] for block in body['content'] if block['type'] == 'text'
+        )
+    
+    async def close(self):
+        await self.http.aclose()
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `rate` per second
+    """
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit with priority admission
+    
+    The limit grows by one slot per window of successful calls under the
+    target latency and halves on a 429 or a slow call. When no slot is
+    free, callers wait in a queue ordered by PRIORITY_LANES, then arrival.
+    """
+    
+    def __init__(self, initial=LLM_INITIAL_CONCURRENCY, minimum=LLM_MIN_CONCURRENCY,
+                 maximum=LLM_MAX_CONCURRENCY, target_latency=LLM_TARGET_LATENCY):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.waiters = []  # heap of (lane rank, arrival, future)
+        self.arrivals = itertools.count()
+    
+    async def acquire(self, priority='interactive'):
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return
+        
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self.waiters,
+            (PRIORITY_LANES[priority], next(self.arrivals), waiter)
+        )
+        
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Slot was handed over just as we were cancelled
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+    
+    def release(self):
+        self.in_flight -= 1
+        self.admit()
+    
+    def admit(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            _, _, waiter = heapq.heappop(self.waiters)
+            if waiter.cancelled():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+    
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self.on_overload()
+            return
+        
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.admit()
+    
+    def on_overload(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class ResilientLLMClient:
+    """
+    Rate-limited, adaptively concurrent LLM client with retries
+    
+    Wraps a transport exposing generate(). Every call takes an admission
+    slot from the AIMD limiter (interactive lane ahead of batch), then a
+    request and token allowance from the token buckets. 429 and 5xx
+    responses are retried with full-jitter exponential backoff, or after
+    Retry-After when given, until the call's deadline.
+    """
+    
+    def __init__(self, transport, requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=LLM_TOKENS_PER_MINUTE, max_retries=LLM_MAX_RETRIES,
+                 timeout=LLM_DEFAULT_TIMEOUT, limiter=None):
+        self.transport = transport
+        self.model = getattr(transport, 'model', None)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+        self.request_bucket = TokenBucket(
+            requests_per_minute / 60, requests_per_minute / 60 * 5
+        )
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+    
+    # generate() takes priority= (see PriorityLane)
+    supports_priority = True
+    
+    async def generate(self, prompt, response_format=None, model=None,
+                       priority='interactive', deadline=None,
+                       max_tokens=LLM_DEFAULT_MAX_TOKENS):
+        """
+        Generate a response, retrying transient failures until `deadline`
+        
+        deadline is a time.monotonic() timestamp; it defaults to now plus
+        the client timeout.
+        """
+        deadline = deadline or time.monotonic() + self.timeout
+        
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(priority)
+            try:
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(estimate_tokens(prompt) + max_tokens)
+                
+                started = time.monotonic()
+                if started >= deadline:
+                    raise LLMDeadlineExceeded("LLM call deadline passed while queued")
+                
+                response = await asyncio.wait_for(
+                    self.transport.generate(
+                        prompt=prompt,
+                        response_format=response_format,
+                        model=model,
+                        max_tokens=max_tokens
+                    ),
+                    deadline - started
+                )
+                
+                self.limiter.on_success(time.monotonic() - started)
+                
+                span = current_span()
+                if span.recording:
+                    # The transport records exact usage when it has it
+                    span.set_attributes({
+                        'llm.attempts': attempt + 1,
+                        'llm.priority': priority
+                    })
+                    span.attributes.setdefault('llm.prompt_tokens', estimate_tokens(prompt))
+                    span.attributes.setdefault('llm.completion_tokens', estimate_tokens(response))
+                return response
+            except asyncio.TimeoutError:
+                self.limiter.on_overload()
+                raise LLMDeadlineExceeded("LLM call did not finish before its deadline")
+            except LLMHTTPError as e:
+                if e.status == 429:
+                    self.limiter.on_overload()
+                if e.status not in RETRYABLE_STATUSES or attempt == self.max_retries:
+                    raise
+                error = e
+            finally:
+                self.limiter.release()
+            
+            delay = error.retry_after or random.uniform(
+                0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt)
+            )
+            if time.monotonic() + delay >= deadline:
+                raise error
+            
+            await asyncio.sleep(delay)
+
+
+# ============================================
+# LLM RESPONSE CACHE
+# ============================================
+
+# Default time-to-live for cached LLM responses, in seconds
+LLM_CACHE_TTL = 7 * 24 * 3600
+
+# Maximum entries kept in the in-process tier
+LLM_CACHE_MAX_ENTRIES = 10000
+
+# generate() keyword arguments that don't change the response, so are
+# left out of the cache key
+LLM_CACHE_KEY_IGNORED = {'priority', 'deadline', 'timeout'}
+
+
+class CachedLLMClient:
+    """
+    Content-addressed cache in front of an LLM client
+    
+    Responses are keyed on a hash of the prompt (without the indentation
+    it inherits from the code), the model, the response_format and any
+    other generation arguments such as max_tokens. Lookups go to an
+    in-process LRU first, then to a persistent store (SQLiteResponseStore
+    locally, PostgresResponseStore in production); a response promoted
+    from the store keeps its stored expiry. Exposes the same generate()
+    interface as the wrapped client, so it can be shared by both engines.
+    """
+    
+    def __init__(self, client, store=None, ttl=LLM_CACHE_TTL,
+                 max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.client = client
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = OrderedDict()  # key -> (expires_at, response)
+        self.metrics = {
+            'memory_hits': 0,
+            'store_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'evictions': 0
+        }
+    
+    async def generate(self, prompt, response_format=None, model=None,
+                       cache=True, ttl=None, **kwargs):
+        """
+        Return a cached response for this prompt, or call the LLM
+        
+        Pass cache=False to bypass both tiers; the fresh response is not
+        written back either.
+        """
+        span = current_span()
+        
+        if not cache:
+            self.metrics['bypassed'] += 1
+            span.set_attribute('llm.cache', 'bypassed')
+            return await self.client.generate(
+                prompt=prompt, response_format=response_format, model=model, **kwargs
+            )
+        
+        key = self.cache_key(prompt, model, response_format, kwargs)
+        now = time.time()
+        
+        # Tier 1: in-process LRU
+        entry = self.memory.get(key)
+        if entry and entry[0] > now:
+            self.memory.move_to_end(key)
+            self.metrics['memory_hits'] += 1
+            span.set_attributes({'cache.hit': True, 'llm.cache': 'memory'})
+            return entry[1]
+        
+        # Tier 2: persistent store
+        if self.store:
+            stored = await self.store.get(key)
+            if stored is not None:
+                response, expires_at = stored
+                self.metrics['store_hits'] += 1
+                span.set_attributes({'cache.hit': True, 'llm.cache': 'store'})
+                self.remember(key, response, expires_at)
+                return response
+        
+        self.metrics['misses'] += 1
+        span.set_attributes({'cache.hit': False, 'llm.cache': 'miss'})
+        response = await self.client.generate(
+            prompt=prompt, response_format=response_format, model=model, **kwargs
+        )
+        
+        self.remember(key, response, now + (ttl or self.ttl))
+        if self.store:
+            await self.store.set(key, response, ttl or self.ttl)
+        
+        return response
+    
+    async def forget(self, prompt, response_format=None, model=None, **kwargs):
+        """
+        Drop the cached response for a generate() call from both tiers,
+        e.g. once it turns out to be malformed
+        """
+        key = self.cache_key(prompt, model, response_format, kwargs)
+        self.memory.pop(key, None)
+        if self.store:
+            await self.store.delete(key)
+    
+    def cache_key(self, prompt, model, response_format, kwargs=None):
+        # Prompts are built from indented f-strings, so each line's
+        # indentation is stripped before hashing; whitespace within a line,
+        # including inside interpolated values, is kept
+        options = {
+            name: value for name, value in (kwargs or {}).items()
+            if name not in LLM_CACHE_KEY_IGNORED
+        }
+        payload = json.dumps(
+            [compact_prompt(prompt), model or self.default_model(), response_format, options],
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def default_model(self):
+        return getattr(self.client, 'model', None)
+    
+    @property
+    def supports_priority(self):
+        # priority is passed through to the wrapped client
+        return getattr(self.client, 'supports_priority', False)
+    
+    def remember(self, key, response, expires_at):
+        self.memory[key] = (expires_at, response)
+        self.memory.move_to_end(key)
+        
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.metrics['evictions'] += 1
+    
+    def hit_rate(self):
+        hits = self.metrics['memory_hits'] + self.metrics['store_hits']
+        total = hits + self.metrics['misses']
+        return hits / total if total else 0.0
+
+
+# Cache hits whose last_used_at is updated in memory before being written
+# to the SQLite store in one transaction
+SQLITE_TOUCH_BATCH = 100
+
+
+class SQLiteResponseStore:
+    """
+    Persistent LLM response store for local development
+    
+    sqlite3 blocks, so every call runs in a worker thread, one at a time.
+    Cache hits record their last_used_at in memory; the touches are
+    written together with the next write, or once SQLITE_TOUCH_BATCH
+    accumulate, so reads never hold a write transaction open.
+    """
+    
+    def __init__(self, path, max_entries=100000):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.touched = {}  # cache key -> last used, not yet written
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+            "  cache_key TEXT PRIMARY KEY,"
+            "  response TEXT NOT NULL,"
+            "  expires_at REAL NOT NULL,"
+            "  last_used_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+    
+    async def get(self, key):
+        """(response, expires_at epoch seconds), or None"""
+        return await asyncio.to_thread(self.get_sync, key)
+    
+    async def delete(self, key):
+        await asyncio.to_thread(self.delete_sync, key)
+    
+    async def set(self, key, response, ttl):
+        await asyncio.to_thread(self.set_sync, key, response, ttl)
+    
+    def get_sync(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, expires_at FROM llm_response_cache "
+                "WHERE cache_key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            
+            if row is None:
+                return None
+            
+            self.touched[key] = now
+            if len(self.touched) >= SQLITE_TOUCH_BATCH:
+                self.write_touches()
+                self.conn.commit()
+            
+            return row[0], row[1]
+    
+    def delete_sync(self, key):
+        with self.lock:
+            self.touched.pop(key, None)
+            self.write_touches()
+            self.conn.execute("DELETE FROM llm_response_cache WHERE cache_key = ?", (key,))
+            self.conn.commit()
+    
+    def set_sync(self, key, response, ttl):
+        now = time.time()
+        with self.lock:
+            self.touched.pop(key, None)
+            self.write_touches()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_response_cache VALUES (?, ?, ?, ?)",
+                (key, response, now + ttl, now)
+            )
+            
+            # Drop expired entries, then least recently used beyond the bound
+            self.conn.execute(
+                "DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,)
+            )
+            self.conn.execute(
+                "DELETE FROM llm_response_cache WHERE cache_key IN ("
+                "  SELECT cache_key FROM llm_response_cache "
+                "  ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+    
+    def write_touches(self):
+        """Write pending last_used_at updates; the caller commits"""
+        if self.touched:
+            self.conn.executemany(
+                "UPDATE llm_response_cache SET last_used_at = ? WHERE cache_key = ?",
+                [(used_at, key) for key, used_at in self.touched.items()]
+            )
+            self.touched.clear()
+
+
+class PostgresResponseStore:
+    """
+    Persistent LLM response store shared by all API workers
+    
+    Expired and least recently used rows are pruned by a scheduled job
+    rather than on the request path.
+    """
+    
+    def __init__(self, database):
+        self.db = database
+    
+    async def get(self, key):
+        """(response, expires_at epoch seconds), or None"""
+        rows = await self.db.query(
+            "UPDATE llm_response_cache SET last_used_at = NOW() "
+            "WHERE cache_key = $1 AND expires_at > NOW() "
+            "RETURNING response, EXTRACT(EPOCH FROM expires_at) AS expires_at",
+            key
+        )
+        
+        if not rows:
+            return None
+        return rows[0]['response'], float(rows[0]['expires_at'])
+    
+    async def delete(self, key):
+        await self.db.execute("DELETE FROM llm_response_cache WHERE cache_key = $1", key)
+    
+    async def set(self, key, response, ttl):
+        await self.db.execute(
+            "INSERT INTO llm_response_cache (cache_key, response, expires_at) "
+            "VALUES ($1, $2, NOW() + make_interval(secs => $3)) "
+            "ON CONFLICT (cache_key) DO UPDATE SET "
+            "  response = EXCLUDED.response, "
+            "  expires_at = EXCLUDED.expires_at, "
+            "  last_used_at = NOW()",
+            key,
+            response,
+            ttl
+        )
+
+
+# ============================================
+# STAGE GRAPH
+# ============================================
+
+# Per-stage timeouts in seconds
+STAGE_TIMEOUTS = {
+    'jurisdiction': 10,
+    'classification': 30,
+    'permit_rules': 20,
+    'permits': 45,
+    'forms': 60,
+    'workflow': 30
+}
+
+
+class DiscoveryStageError(Exception):
+    """Raised when a discovery stage fails or times out"""
+    
+    def __init__(self, stage, cause):
+        super().__init__(f"Discovery stage '{stage}' failed: {cause!r}")
+        self.stage = stage
+        self.cause = cause
+
+
+class StageGraph:
+    """
+    Dependency-aware runner for discovery stages
+    
+    Each stage is a coroutine factory. Stages without dependencies are
+    called with no arguments; stages with dependencies receive a dict of
+    all results computed so far. A stage starts as soon as every stage it
+    depends on has finished, so independent stages overlap.
+    
+    Runs can be incremental. A stage's input hash covers its own inputs
+    (e.g. the address) and the output hashes of the stages it depends
+    on. Given the records of an earlier run, a stage whose input hash is
+    unchanged returns its stored output instead of running, so an edit
+    only recomputes the stages downstream of what actually changed.
+    Stages that read external state are marked reusable=False and always
+    run; their fingerprint decides whether dependents rerun.
+    """
+    
+    def __init__(self, instrumentation=None):
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+        self.stages = {}
+        self.timings = {}
+        self.records = {}  # stage -> {'inputs', 'input_hash', 'output_hash', 'output', 'reusable', 'reused'}
+    
+    def add_stage(self, name, func, depends_on=None, timeout=None,
+                  inputs=None, reusable=True, fingerprint=None):
+        for dep in depends_on or []:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        
+        self.stages[name] = {
+            'func': func,
+            'depends_on': depends_on or [],
+            'timeout': timeout,
+            'inputs': inputs,
+            'reusable': reusable,
+            'fingerprint': fingerprint or stable_hash
+        }
+    
+    async def run(self, on_complete=None, stored=None):
+        """
+        Run all stages and return their results keyed by stage name
+        
+        If any stage fails or exceeds its timeout, every other in-flight
+        stage is cancelled and DiscoveryStageError is raised. If given,
+        on_complete(name, result) is called as each stage finishes.
+        
+        With stored ({stage: record} from an earlier run's records, {} for
+        none), the run is incremental and fills in self.records.
+        """
+        results = {}
+        tasks = {}
+        
+        async def run_stage(name, stage):
+            # Wait for upstream stages
+            await asyncio.gather(*(tasks[dep] for dep in stage['depends_on']))
+            
+            input_hash = record = None
+            if stored is not None:
+                input_hash = stable_hash([
+                    stage['inputs'],
+                    [self.records[dep]['output_hash'] for dep in stage['depends_on']]
+                ])
+                record = stored.get(name)
+            reused = bool(
+                stage['reusable'] and record and record['input_hash'] == input_hash
+            )
+            
+            started = time.perf_counter()
+            try:
+                with self.instrumentation.span(f'stage.{name}', {'stage.reused': reused}):
+                    if reused:
+                        results[name] = record['output']
+                    else:
+                        coro = (stage['func'](results) if stage['depends_on']
+                                else stage['func']())
+                        results[name] = await asyncio.wait_for(coro, stage['timeout'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                raise DiscoveryStageError(name, e) from e
+            finally:
+                self.timings[name] = {
+                    'started_ms': (started - run_started) * 1000,
+                    'duration_ms': (time.perf_counter() - started) * 1000
+                }
+            
+            if stored is not None:
+                self.records[name] = {
+                    'inputs': stage['inputs'],
+                    'input_hash': input_hash,
+                    'output_hash': (record['output_hash'] if reused
+                                    else stage['fingerprint'](results[name])),
+                    'output': results[name],
+                    'reusable': stage['reusable'],
+                    'reused': reused
+                }
+            
+            if on_complete:
+                on_complete(name, results[name])
+            
+            return results[name]
+        
+        run_started = time.perf_counter()
+        
+        # Stages are registered in dependency order, so every upstream
+        # task exists before its dependents are created
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.create_task(run_stage(name, stage))
+        
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        
+        self.timings['total'] = {
+            'started_ms': 0,
+            'duration_ms': (time.perf_counter() - run_started) * 1000
+        }
+        
+        return results
+
+
+# ============================================
+# INSTRUMENTATION
+# ============================================
+
+# Histogram buckets for span durations, in seconds
+SPAN_DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Interval between stack samples while a request is profiled, in seconds
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Innermost span of the running task, if tracing is on
+CURRENT_SPAN = contextvars.ContextVar('permit_engine_span', default=None)
+
+
+class NoopSpan:
+    """Span returned when instrumentation is off; every method does nothing"""
+    
+    recording = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def set_attribute(self, key, value):
+        pass
+    
+    def set_attributes(self, attributes):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Instrumentation:
+    """
+    Instrumentation surface used by both engines; this base does nothing
+    
+    Engines call span() around every method and external call, so with the
+    default NO_INSTRUMENTATION the cost is one shared no-op context manager
+    per call and clients are not wrapped at all. Attributes that are
+    expensive to compute should be guarded with `span.recording`.
+    """
+    
+    enabled = False
+    
+    def span(self, name, attributes=None):
+        return NOOP_SPAN
+    
+    def request(self, name, attributes=None, profile=False):
+        return NOOP_SPAN
+    
+    def wrap(self, service, client):
+        return client
+
+
+NO_INSTRUMENTATION = Instrumentation()
+
+
+def current_span():
+    """Innermost active span, or NOOP_SPAN when nothing is being traced"""
+    return CURRENT_SPAN.get() or NOOP_SPAN
+
+
+class Span:
+    """
+    One timed operation, shaped like an OpenTelemetry span
+    
+    Spans nest through a context variable, so children created in tasks
+    spawned inside a span (stage graph, gather) get the right parent.
+    Times are epoch nanoseconds, as OpenTelemetry expects.
+    """
+    
+    recording = True
+    
+    def __init__(self, tracer, name, attributes, parent):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.trace_id = parent.trace_id if parent else f'{random.getrandbits(128):032x}'
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent.span_id if parent else None
+        self.status = 'ok'
+        self.start_time = None
+        self.end_time = None
+        self.profiler = None
+        self.token = None
+    
+    @property
+    def duration(self):
+        return (self.end_time - self.start_time) / 1e9
+    
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+    
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+    
+    def __enter__(self):
+        self.start_time = time.time_ns()
+        self.token = CURRENT_SPAN.set(self)
+        self.tracer.on_start(self)
+        if self.profiler:
+            self.profiler.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler:
+            self.profiler.stop()
+            self.attributes['profile.samples'] = self.profiler.total
+        if exc_type is not None:
+            self.status = 'error'
+            self.attributes['error.type'] = exc_type.__name__
+        self.end_time = time.time_ns()
+        CURRENT_SPAN.reset(self.token)
+        self.tracer.on_end(self)
+        return False
+
+
+class Tracer(Instrumentation):
+    """
+    Recording instrumentation
+    
+    Finished spans go to every exporter (objects with on_start(span) and
+    on_end(span), e.g. OpenTelemetryExporter) and, if given, into a
+    PrometheusMetrics registry. Request spans are profiled when the caller
+    asks for it, or at random with probability profile_rate.
+    """
+    
+    enabled = True
+    
+    def __init__(self, exporters=(), metrics=None, profile_rate=0.0,
+                 profile_interval=PROFILE_SAMPLE_INTERVAL):
+        self.exporters = list(exporters)
+        self.metrics = metrics
+        self.profile_rate = profile_rate
+        self.profile_interval = profile_interval
+    
+    def span(self, name, attributes=None):
+        return Span(self, name, attributes, CURRENT_SPAN.get())
+    
+    def request(self, name, attributes=None, profile=False):
+        span = self.span(name, attributes)
+        if profile or random.random() < self.profile_rate:
+            span.profiler = SamplingProfiler(self.profile_interval)
+        return span
+    
+    def wrap(self, service, client):
+        return InstrumentedClient(self, service, client)
+    
+    def on_start(self, span):
+        for exporter in self.exporters:
+            exporter.on_start(span)
+    
+    def on_end(self, span):
+        if self.metrics:
+            self.metrics.record_span(span)
+        for exporter in self.exporters:
+            exporter.on_end(span)
+
+
+class InstrumentedClient:
+    """
+    Proxy that runs each of a client's coroutine methods in a span
+    
+    Spans are named '<service>.<method>', e.g. 'db.query' or 'llm.generate'.
+    """
+    
+    def __init__(self, tracer, service, client):
+        self.tracer = tracer
+        self.service = service
+        self.client = client
+    
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        
+        span_name = f'{self.service}.{name}'
+        attributes = {'peer.service': self.service}
+        
+        async def traced_call(*args, **kwargs):
+            with self.tracer.span(span_name, attributes):
+                return await attr(*args, **kwargs)
+        
+        return traced_call
+
+
+class PrometheusMetrics:
+    """
+    Counters and histograms derived from finished spans
+    
+    render() returns the Prometheus text exposition format, for the API's
+    /metrics endpoint. Recorded per span: duration by name and status,
+    cache hits and misses for spans carrying 'cache.hit', and LLM tokens
+    for spans carrying 'llm.prompt_tokens' / 'llm.completion_tokens'.
+    """
+    
+    def __init__(self, namespace='permit_engine', buckets=SPAN_DURATION_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+        
+        # Values above the last bound only count towards +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+    
+    def record_span(self, span):
+        self.observe('span_duration_seconds', span.duration,
+                     span=span.name, status=span.status)
+        
+        attributes = span.attributes
+        if 'cache.hit' in attributes:
+            self.inc('cache_requests_total', span=span.name,
+                     result='hit' if attributes['cache.hit'] else 'miss')
+        for kind in ('prompt', 'completion'):
+            tokens = attributes.get(f'llm.{kind}_tokens')
+            if tokens:
+                self.inc('llm_tokens_total', tokens, kind=kind)
+    
+    def render(self):
+        lines = []
+        
+        for name in sorted({name for name, _ in self.counters}):
+            metric = f'{self.namespace}_{name}'
+            lines.append(f'# TYPE {metric} counter')
+            for (key, labels), value in sorted(self.counters.items()):
+                if key == name:
+                    lines.append(f'{metric}{format_labels(labels)} {value}')
+        
+        for name in sorted({name for name, _ in self.histograms}):
+            metric = f'{self.namespace}_{name}'
+            lines.append(f'# TYPE {metric} histogram')
+            for (key, labels), (counts, total, count) in sorted(self.histograms.items()):
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (('le', str(bound)),)
+                    lines.append(f'{metric}_bucket{format_labels(bucket_labels)} {cumulative}')
+                lines.append(f'{metric}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{metric}_sum{format_labels(labels)} {total}')
+                lines.append(f'{metric}_count{format_labels(labels)} {count}')
+        
+        return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetryExporter:
+    """
+    Mirrors spans into OpenTelemetry, so they reach any configured collector
+    
+    Requires the opentelemetry-api package; the SDK and exporter (e.g.
+    OTLP) are configured by the host application as usual.
+    """
+    
+    def __init__(self, tracer_provider=None):
+        self.tracer = otel_trace.get_tracer(
+            'permitpro.permit_engine', tracer_provider=tracer_provider
+        )
+        self.live = {}  # span_id -> OpenTelemetry span
+    
+    def on_start(self, span):
+        parent = self.live.get(span.parent_id)
+        self.live[span.span_id] = self.tracer.start_span(
+            span.name,
+            context=otel_trace.set_span_in_context(parent) if parent else None,
+            start_time=span.start_time
+        )
+    
+    def on_end(self, span):
+        otel_span = self.live.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        
+        otel_span.set_attributes(span.attributes)
+        if span.status == 'error':
+            otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+        if span.profiler:
+            otel_span.add_event('profile', {'collapsed_stacks': span.profiler.collapsed()})
+        otel_span.end(end_time=span.end_time)
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of the thread that started it
+    
+    A background thread records the profiled (event loop) thread's stack
+    every `interval` seconds. Samples are aggregated as collapsed stacks,
+    the input format of flamegraph.pl and speedscope. The event loop is
+    shared, so samples taken while other requests run include their work;
+    profile a request on a quiet worker for a clean picture.
+    """
+    
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()  # collapsed stack -> sample count
+        self.stopped = threading.Event()
+        self.thread = None
+        self.target = None
+    
+    @property
+    def total(self):
+        return sum(self.samples.values())
+    
+    def start(self):
+        self.target = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+    
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common())
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+# ============================================
+# LLM RESPONSE SCHEMAS
+# ============================================
+
+# Times generate_json asks the LLM to continue a truncated response
+JSON_MAX_CONTINUATIONS = 2
+
+# Characters of the truncated response repeated in a continuation prompt
+JSON_CONTINUATION_CONTEXT = 500
+
+JSON_LITERALS = {
+    'True': 'true',
+    'False': 'false',
+    'None': 'null',
+    'NaN': 'null',
+    'Infinity': 'null'
+}
+
+JSON_TYPE_CHECKS = {
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'string': lambda v: isinstance(v, str),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'null': lambda v: v is None
+}
+
+CLASSIFICATION_JSON_SCHEMA = {
+    'type': 'object',
+    'required': ['project_category', 'work_types', 'scope', 'risk_level'],
+    'properties': {
+        'project_category': {'enum': ['residential', 'commercial', 'industrial']},
+        'work_types': {'type': 'array', 'items': {'type': 'string'}},
+        'scope': {'enum': ['new_construction', 'addition', 'alteration', 'repair']},
+        'square_footage': {'type': ['number', 'null']},
+        'stories': {'type': ['number', 'null']},
+        'involves_utilities': {'type': 'boolean'},
+        'involves_structural_changes': {'type': 'boolean'},
+        'involves_occupancy_change': {'type': 'boolean'},
+        'fire_safety_concerns': {'type': 'boolean'},
+        'key_features': {'type': 'array'},
+        'risk_level': {'enum': ['low', 'medium', 'high']}
+    }
+}
+
+PERMIT_LIST_JSON_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'required': ['permit_type', 'permit_name', 'required'],
+        'properties': {
+            'permit_type': {'type': 'string'},
+            'permit_name': {'type': 'string'},
+            'required': {'type': 'boolean'},
+            'reasoning': {'type': 'string'},
+            'triggers': {'type': 'array'},
+            'exemptions': {'type': 'array'}
+        }
+    }
+}
+
+FORM_FIELDS_JSON_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'required': ['field_name', 'field_type', 'label', 'required'],
+        'properties': {
+            'field_name': {'type': 'string'},
+            'field_type': {'type': 'string'},
+            'label': {'type': 'string'},
+            'required': {'type': 'boolean'},
+            'validation_rules': {'type': 'array'},
+            'auto_fillable': {'type': 'boolean'}
+        }
+    }
+}
+
+FIELD_MAPPINGS_JSON_SCHEMA = {
+    'type': 'object',
+    'additionalProperties': {
+        'type': 'object',
+        'required': ['source', 'confidence'],
+        'properties': {
+            'source': {'type': 'string'},
+            'transformation': {'type': ['string', 'null']},
+            'confidence': {'type': 'number'}
+        }
+    }
+}
+
+CONSISTENCY_JSON_SCHEMA = {
+    'type': 'object',
+    'required': ['valid'],
+    'properties': {
+        'valid': {'type': 'boolean'},
+        'errors': {'type': 'array'},
+        'warnings': {'type': 'array'}
+    }
+}
+
+
+class LLMResponseError(Exception):
+    """LLM response could not be parsed or failed schema validation"""
+
+
+class TruncatedJSONError(LLMResponseError):
+    """LLM response ended before its JSON payload was complete"""
+
+
+# ============================================
+# PROMPT BUDGETING
+# ============================================
+
+# Estimated input tokens per prompt; larger inputs are split into chunks
+PROMPT_TOKEN_BUDGET = 12000
+
+# Share of a permit-matching prompt given to regulatory context
+REGULATORY_CONTEXT_TOKEN_BUDGET = 3000
+
+# Longest single value sent in a form consistency check, in characters
+PROMPT_VALUE_MAX_CHARS = 500
+
+# Field attributes the LLM needs to map a field to a data source
+FIELD_PROMPT_KEYS = ('field_name', 'label', 'field_type', 'help_text')
+
+
+def stable_hash(value):
+    """Content hash of a JSON-serializable value, independent of key order"""
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def permit_rules_fingerprint(permit_rules):
+    """
+    Hash of the rules and context permit matching sees, ignoring
+    per-read fields such as age_seconds
+    """
+    return stable_hash([
+        [(rule.get('id'), rule.get('updated_at')) for rule in permit_rules['structured_rules']],
+        permit_rules['regulatory_context']
+    ])
+
+
+def compact_json(value):
+    """JSON for prompts: no indentation or spaces after separators"""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def compact_prompt(prompt):
+    """Strip the indentation f-string prompts inherit from the code"""
+    return '\n'.join(line.strip() for line in prompt.strip().splitlines())
+
+
+def prune_record(record, keys):
+    """Only the given keys of a dict, skipping empty values"""
+    return {key: record[key] for key in keys if record.get(key) not in (None, '', [], {})}
+
+
+def clip_value(value, max_chars=PROMPT_VALUE_MAX_CHARS):
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + '...'
+    return value
+
+
+def fit_to_budget(value, budget):
+    """
+    Trim a ranked list (or a string) to roughly `budget` tokens
+    
+    Lists keep their leading items, so pass them most relevant first.
+    """
+    if isinstance(value, str):
+        return value[:budget * 4]
+    
+    kept = []
+    used = 0
+    for item in value or []:
+        used += estimate_tokens(compact_json(item))
+        if used > budget:
+            break
+        kept.append(item)
+    return kept
+
+
+def chunk_by_budget(items, build_prompt, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Split items into consecutive chunks whose prompts fit the budget
+    
+    The cost of the prompt around the items is measured once with an
+    empty chunk. An item too large to share a prompt gets a chunk of its
+    own. Always returns at least one (possibly empty) chunk.
+    """
+    available = budget - estimate_tokens(build_prompt([]))
+    chunks = [[]]
+    used = 0
+    
+    for item in items:
+        cost = estimate_tokens(compact_json(item)) + 1
+        if chunks[-1] and used + cost > available:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(item)
+        used += cost
+    
+    return chunks
+
+
+def merge_json_results(results, key=None):
+    """
+    Merge the parsed responses of a chunked prompt
+    
+    Arrays are concatenated, keeping the first item per `key` if given.
+    Objects are combined: list values are concatenated, anything else
+    keeps the first chunk's value.
+    """
+    if len(results) == 1:
+        return results[0]
+    
+    if isinstance(results[0], list):
+        merged = [item for result in results for item in result]
+        if not key:
+            return merged
+        
+        unique = {}
+        for item in merged:
+            unique.setdefault(item.get(key), item)
+        return list(unique.values())
+    
+    merged = {}
+    for result in results:
+        for name, value in result.items():
+            if isinstance(merged.get(name), list) and isinstance(value, list):
+                merged[name] = merged[name] + value
+            else:
+                merged.setdefault(name, value)
+    return merged
+
+
+async def generate_json_chunked(llm, build_prompt, items, schema=None,
+                                merge=merge_json_results, budget=PROMPT_TOKEN_BUDGET):
+    """
+    generate_json over a list of inputs, split to stay within budget
+    
+    build_prompt(chunk) returns the prompt for a sublist of items. Chunks
+    are sent concurrently and their responses combined with merge, so
+    latency stays close to that of a single prompt as inputs grow. An
+    input that fits the budget is sent as one prompt, unchanged.
+    """
+    chunks = chunk_by_budget(items, build_prompt, budget)
+    prompts = [build_prompt(chunk) for chunk in chunks]
+    
+    current_span().set_attributes({
+        'prompt.chunks': len(prompts),
+        'prompt.estimated_tokens': sum(estimate_tokens(p) for p in prompts)
+    })
+    
+    results = await asyncio.gather(*(
+        generate_json(llm, prompt, schema=schema) for prompt in prompts
+    ))
+    return merge(list(results))
+
+
+# ============================================
+# HELPER FUNCTIONS
+# ============================================
+
+async def discovery_event_stream(engine, project_data):
+    """
+    Server-sent events body for POST /permits/discover in streaming mode
+    """
+    try:
+        async for event in engine.discover_permits_stream(project_data):
+            yield format_sse(event['event'], event['data'])
+    except DiscoveryStageError as e:
+        yield format_sse('error', {'stage': e.stage, 'message': str(e)})
+
+
+def format_sse(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def form_structure_hash(form_structure):
+    """Stable hash identifying a parsed form template"""
+    return hashlib.sha256(
+        json.dumps(form_structure, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def data_key_paths(data, prefix=''):
+    """
+    Map every leaf key path in nested dicts to its value's type name,
+    e.g. {'user.property.zip': 'str'}
+    """
+    paths = {}
+    
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            paths.update(data_key_paths(value, path))
+        else:
+            paths[path] = type(value).__name__
+    
+    return paths
+
+
+def scrape_host(jurisdiction):
+    """Host a jurisdiction's website is scraped from, else its id"""
+    authority = jurisdiction['permit_authority']
+    url = authority.get('website_url')
+    return urllib.parse.urlsplit(url).hostname if url else authority['id']
+
+
+def regulatory_query(jurisdiction):
+    """Vector search query for a jurisdiction's regulatory text"""
+    return f"{jurisdiction['city']} building code permit requirements"
+
+
+def estimate_tokens(text):
+    """Rough token count for rate limiting and prompt budgeting"""
+    return len(text) // 4 + 1
+
+
+def normalize_address(address):
+    """Normalize an address for use as a cache key"""
+    address = re.sub(r'[^\w\s#-]', ' ', address.lower())
+    return ' '.join(address.split())
+
+
+def form_content_hash(content):
+    """Content hash used to decide whether a stored form structure is current"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    
+    return hashlib.sha256(content).hexdigest()
+
+
+def template_form(row):
+    """
+    A form_templates row in the shape scrape_form returns, with its
+    stored structure, content hash and age
+    """
+    return {
+        'permit_type': row['permit_type'],
+        'name': row['form_name'],
+        'type': row['form_type'],
+        'url': row['form_url'],
+        'pdf_url': row.get('pdf_url'),
+        'online_portal_url': row.get('online_portal_url'),
+        'content': row.get('raw_content'),
+        'document_path': row.get('document_path'),
+        'content_hash': row.get('content_hash'),
+        'form_structure': row.get('form_structure'),
+        'version': row.get('version'),
+        'age_seconds': row['age_seconds']
+    }
+
+
+def default_form_name(permit_type):
+    """form_name for a scraped form that didn't report one"""
+    return f"{permit_type.replace('_', ' ').title()} Permit Application"
+
+
+async def form_hash(form):
+    """
+    form_content_hash of a scraped form, whether its content is held in
+    memory or was written to disk by the scraper
+    """
+    if form.get('content') is None:
+        return await asyncio.to_thread(file_content_hash, form['document_path'])
+    
+    return form_content_hash(form['content'])
+
+
+def file_content_hash(path):
+    with mapped_document(path) as data:
+        return hashlib.sha256(data).hexdigest()
+
+
+async def form_content(form):
+    """A scraped form's document, from memory or from the form store"""
+    if form.get('content') is None:
+        return await asyncio.to_thread(read_document, form['document_path'])
+    
+    return form['content']
+
+
+def read_document(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def document_available(form):
+    """
+    Whether a form's document can be read here: held in memory, or in a
+    form store this process can reach
+    """
+    if form.get('content') is not None:
+        return True
+    
+    return bool(form.get('document_path')) and os.path.exists(form['document_path'])
+
+
+async def generate_json(llm, prompt, schema=None,
+                        max_continuations=JSON_MAX_CONTINUATIONS):
+    """
+    Call the LLM for a JSON response and parse it
+    
+    If the response is cut off mid-payload, only the missing tail is
+    requested, up to max_continuations times, instead of regenerating the
+    whole response. A response that still can't be parsed is dropped from
+    the response cache, if llm has one, and requested once more.
+    """
+    prompt = compact_prompt(prompt)
+    
+    try:
+        return await complete_json(llm, prompt, schema, max_continuations)
+    except LLMResponseError:
+        # Otherwise the cached malformed response fails every call for its
+        # whole TTL
+        forget = getattr(llm, 'forget', None)
+        if forget is None:
+            raise
+        await forget(prompt=prompt, response_format='json')
+        return await complete_json(llm, prompt, schema, max_continuations)
+
+
+async def complete_json(llm, prompt, schema, max_continuations):
+    """One generate_json attempt, with continuations of a cut-off payload"""
+    response = await llm.generate(prompt=prompt, response_format='json')
+    
+    for _ in range(max_continuations):
+        try:
+            return parse_json(response, schema)
+        except TruncatedJSONError:
+            tail = await llm.generate(
+                prompt=f"""
+                {prompt}
+                
+                Your previous response was cut off. It ended with:
+                {response[-JSON_CONTINUATION_CONTEXT:]}
+                
+                Continue from exactly where it stopped. Return only the
+                remaining text, without repeating anything.
+                """
+            )
+            response += tail
+    
+    return parse_json(response, schema)
+
+
+def parse_json(text, schema=None):
+    """
+    Safely parse JSON from LLM response
+    
+    Tolerates surrounding prose, markdown fences, trailing commas, single
+    quotes and Python literals. Raises TruncatedJSONError if the payload
+    never closes, and LLMResponseError if it can't be parsed or doesn't
+    match schema.
+    """
+    text = text.strip()
+    
+    try:
+        value = json.loads(text)
+    except ValueError:
+        payload, complete = extract_json(text)
+        if not complete:
+            raise TruncatedJSONError("LLM response ended inside the JSON payload")
+        
+        try:
+            value = json.loads(payload)
+        except ValueError as e:
+            raise LLMResponseError(f"Invalid JSON in LLM response: {e}") from e
+    
+    if schema:
+        errors = validate_schema(value, schema)
+        if errors:
+            raise LLMResponseError(
+                "LLM response does not match schema: " + '; '.join(errors[:5])
+            )
+    
+    return value
+
+
+def extract_json(text):
+    """
+    Locate and repair the JSON payload in an LLM response in one pass
+    
+    Returns (payload, complete); complete is False when the text ends
+    before the outermost object or array closes.
+    """
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        raise LLMResponseError("No JSON payload in LLM response")
+    
+    out = []
+    closers = []
+    quote = None  # quote character of the string being scanned
+    pending_comma = False
+    i = min(starts)
+    
+    while i < len(text):
+        ch = text[i]
+        
+        if quote:
+            if ch == '\\' and i + 1 < len(text):
+                # \' is not a JSON escape, so unescape it
+                nxt = text[i + 1]
+                out.append("'" if nxt == "'" else ch + nxt)
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+                out.append('"')
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == '\n':
+                out.append('\\n')
+            else:
+                out.append(ch)
+            i += 1
+            continue
+        
+        if ch.isspace():
+            i += 1
+            continue
+        
+        # Drop trailing commas before a closing bracket
+        if pending_comma:
+            pending_comma = False
+            if ch not in '}]':
+                out.append(',')
+        
+        if ch in '"\'':
+            quote = ch
+            out.append('"')
+        elif ch in '{[':
+            closers.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            if closers:
+                out.append(closers.pop())
+            if not closers:
+                return ''.join(out), True
+        elif ch == ',':
+            pending_comma = True
+        elif ch.isalpha():
+            end = i
+            while end < len(text) and (text[end].isalnum() or text[end] == '_'):
+                end += 1
+            word = text[i:end]
+            out.append(JSON_LITERALS.get(word, word))
+            i = end
+            continue
+        else:
+            out.append(ch)
+        
+        i += 1
+    
+    return ''.join(out), False
+
+
+def validate_schema(value, schema, path='$'):
+    """
+    Check value against a small JSON Schema subset
+    
+    Supports type (name or list of names), enum, required, properties,
+    additionalProperties and items. Returns a list of error messages.
+    """
+    errors = []
+    
+    types = schema.get('type')
+    if types:
+        if isinstance(types, str):
+            types = [types]
+        if not any(JSON_TYPE_CHECKS[t](value) for t in types):
+            return [f"{path}: expected {'|'.join(types)}"]
+    
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: {value!r} not one of {schema['enum']}")
+    
+    if isinstance(value, dict):
+        for key in schema.get('required', []):
+            if key not in value:
+                errors.append(f"{path}: missing '{key}'")
+        
+        properties = schema.get('properties', {})
+        for key, item in value.items():
+            item_schema = properties.get(key, schema.get('additionalProperties'))
+            if isinstance(item_schema, dict):
+                errors.extend(validate_schema(item, item_schema, f"{path}.{key}"))
+    
+    if isinstance(value, list) and 'items' in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate_schema(item, schema['items'], f"{path}[{index}]"))
+    
+    return errors
+
+
+# ============================================
+# USAGE EXAMPLE
+# ============================================
+
+async def main():
+    """
+    Example usage of the permit system
+    """
+    
+    # Initialize engines
+    db = Database(connection_string="...")
+    llm = CachedLLMClient(
+        ResilientLLMClient(
+            PooledLLMTransport(api_key="...", model="claude-sonnet-4-5")
+        ),
+        store=PostgresResponseStore(db)
+    )
+    geocoder = GeocodingService()
+    
+    discovery = PermitDiscoveryEngine(
+        llm, db, geocoder,
+        classification_index=ClassificationIndex(HashingEmbedder(), verify_rate=0.05)
+    )
+    if discovery.jurisdiction_index.available:
+        await discovery.jurisdiction_index.load()
+    discovery.refresh_scheduler.start()
     autofill = AutoFillEngine(llm, db)
     
     # User project data
@@ -637,5 +5866,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())